@@ -12,22 +12,33 @@ an answers JSON file where each entry contains a string under the "output" key.
 from __future__ import annotations
 
 import json
+import os
 from pathlib import Path
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional, Sequence
 import re
 import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-from src.api import call_llm
+from src import api, sandbox, tracing
+from src.api import call_llm, stop_at_line
+from src.domain_router import route_domain, load_model as load_router_model
 from src.math_reasoning_v2 import solve_math_v2
-from src.planning import solve_planning_problem
-from src.common_sense import solve_common_sense
-from src.code_reasoning import solve_coding_problem
-from src.future_prediction import predict_future_event
+from src.planning import solve_planning_problem, planning_stages
+from src.common_sense import solve_common_sense, common_sense_stages
+from src.code_reasoning import solve_coding_problem, coding_stages
+from src.future_prediction import predict_future_event, prediction_stages
+from src.pipeline import LLM_STAGE_RETRIES, LLM_STAGE_TIMEOUT, Pipeline, Stage
+from src.scheduling import CostModel, longest_first
 
 
 INPUT_PATH = Path("src/data/cse_476_final_project_test_data.json")
 OUTPUT_PATH = Path("src/data/cse_476_final_project_answers.json")
 
+# Extra keyword arguments for solve_math_v2, filled in from the command line
+MATH_OPTIONS: Dict[str, Any] = {}
+CODE_OPTIONS: Dict[str, Any] = {}
+FUTURE_OPTIONS: Dict[str, Any] = {}
+
 
 def load_questions(path: Path) -> List[Dict[str, Any]]:
     with path.open("r") as fp:
@@ -37,7 +48,13 @@ def load_questions(path: Path) -> List[Dict[str, Any]]:
     return data
 
 
+@tracing.traced("routing.identify_domain")
 def identify_domain(question: str) -> str:
+    # Obvious cases are routed locally; only ambiguous ones pay for the LLM classifier
+    domain = route_domain(question)
+    if domain is not None:
+        return domain
+
     system_prompt = (
         "You are an expert domain classifier. "
         "Your task is to identify the domain of the given problem from the following list: "
@@ -118,7 +135,7 @@ Identify the domain for the following problem:
 Input: {question}
 """
     
-    response = call_llm(prompt, system=system_prompt, temperature=0.0)
+    response = call_llm(prompt, system=system_prompt, temperature=0.0, stop_when=stop_at_line("FINAL:"))
     
     match = re.search(r"FINAL:\s*(\w+)", response)
     if match:
@@ -136,58 +153,244 @@ def solve_question(question_data: Dict[str, Any]) -> str:
     question_text = question_data["input"]
     domain = identify_domain(question_text)
     print(f"Domain identified: {domain}")
-    
+    with tracing.stage(f"solve.{domain}"):
+        return solve_for_domain(domain, question_text)
+
+
+def solve_for_domain(domain: str, question_text: str) -> str:
     if domain == "MATH":
-        return solve_math_v2(question_text)
+        return solve_math_v2(question_text, **MATH_OPTIONS)
     elif domain == "PLANNING":
         return solve_planning_problem(question_text)
     elif domain == "COMMON_SENSE":
         return solve_common_sense(question_text)
     elif domain == "CODING":
-        return solve_coding_problem(question_text)
+        return solve_coding_problem(question_text, **CODE_OPTIONS)
     elif domain == "FUTURE_PREDICTION":
-        return predict_future_event(question_text)
+        return predict_future_event(question_text, **FUTURE_OPTIONS)
     else:
         # Fallback to common sense if unknown
         return solve_common_sense(question_text)
 
 
-def build_answers(questions: List[Dict[str, Any]], output_file: Path) -> List[Dict[str, str]]:
-    answers = []
-    total = len(questions)
-    
-    # Initialize the output file with the start of the JSON list
-    with output_file.open("w") as f:
-        f.write("[\n")
-        
-    for idx, question in enumerate(questions, start=1):
-        print(f"Processing question {idx}/{total}...")
+def solver_pipeline(llm_workers: Optional[int] = None) -> Pipeline:
+    """The solvers as stage graphs, for solving many questions at once."""
+    # Each math chain makes three requests in sequence; adaptive mode may run
+    # one round of chains after another. Retrying would redo every chain.
+    math_rounds = MATH_OPTIONS.get("max_samples", 1) if MATH_OPTIONS.get("adaptive") else 1
+    graphs = {
+        # The math chains already run concurrently inside one stage
+        "MATH": [
+            Stage(
+                "solve", lambda question: solve_math_v2(question, **MATH_OPTIONS),
+                timeout=LLM_STAGE_TIMEOUT * 3 * math_rounds,
+            ),
+        ],
+        "PLANNING": planning_stages(),
+        "COMMON_SENSE": common_sense_stages(),
+        "CODING": coding_stages(**CODE_OPTIONS),
+        "FUTURE_PREDICTION": prediction_stages(**FUTURE_OPTIONS),
+    }
+    route = Stage("route", identify_domain, retries=LLM_STAGE_RETRIES, timeout=LLM_STAGE_TIMEOUT)
+    return Pipeline(route, graphs, default="COMMON_SENSE", llm_workers=llm_workers)
+
+
+def _solve_safely(idx: int, total: int, question: Dict[str, Any]) -> Dict[str, Any]:
+    print(f"Processing question {idx}/{total}...")
+    with tracing.question(idx - 1):
         try:
             real_answer = solve_question(question)
-            answer_obj = {"output": real_answer}
-            answers.append(answer_obj)
+            return {"output": real_answer, "error": real_answer.startswith("Error")}
         except Exception as e:
             print(f"Error processing question {idx}: {e}")
-            answer_obj = {"output": "Error"}
-            answers.append(answer_obj)
-            
-        # Write the answer to the file incrementally
-        with output_file.open("a") as f:
-            json_str = json.dumps(answer_obj, ensure_ascii=False)
-            # Add comma if not the first item (which is index 1 in this 1-based loop, so idx > 1)
-            # But wait, we are appending. The previous item needs a comma.
-            # Easier: Write comma BEFORE the item if it's not the first item.
-            if idx > 1:
-                f.write(",\n")
-            f.write(f"  {json_str}")
-            
-    # Close the JSON list
-    with output_file.open("a") as f:
-        f.write("\n]")
-            
+            return {"output": "Error", "error": True}
+
+
+def journal_path_for(output_file: Path) -> Path:
+    return output_file.with_name(f"{output_file.stem}.journal.jsonl")
+
+
+def load_journal(journal_file: Path) -> Dict[int, Dict[str, Any]]:
+    """Read finished answers from a checkpoint journal, keyed by question index.
+
+    Later records win, so a question that was re-run on resume replaces its
+    earlier entry. A truncated last line from a crash mid-write is ignored.
+    """
+    records: Dict[int, Dict[str, Any]] = {}
+    if not journal_file.exists():
+        return records
+    with journal_file.open("r") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            records[record["index"]] = record
+    return records
+
+
+def build_answers(
+    questions: List[Dict[str, Any]],
+    output_file: Path,
+    workers: int = 1,
+    resume: bool = False,
+    indices: Optional[Sequence[int]] = None,
+    pipeline: bool = False,
+    cost_model: Optional[CostModel] = None,
+) -> List[Dict[str, str]]:
+    total = len(questions)
+    journal_file = journal_path_for(output_file)
+    # A shard only solves its own slice of the questions
+    sharded = indices is not None
+    if indices is None:
+        indices = range(total)
+
+    # On resume, keep every journaled answer except the ones that errored
+    # (usually the inference server dropping) and solve the rest again.
+    done = {}
+    if resume:
+        done = {
+            idx: record
+            for idx, record in load_journal(journal_file).items()
+            if not record.get("error") and idx in indices
+        }
+        print(f"Resuming: {len(done)}/{len(indices)} questions already answered.")
+    elif journal_file.exists():
+        journal_file.unlink()
+
+    pending = [idx for idx in indices if idx not in done]
+    if cost_model is not None:
+        # Start the expensive questions first so no worker is left with a
+        # slow tail; answers are still assembled in input order
+        pending = longest_first(pending, questions, cost_model)
+
+    # Terminate a line left half-written by a crash so new records start cleanly
+    if journal_file.exists() and journal_file.stat().st_size:
+        with journal_file.open("rb") as f:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                with journal_file.open("a") as journal:
+                    journal.write("\n")
+
+    # Each answer is appended to the journal as soon as it is ready, in
+    # completion order, so a crash never loses finished work.
+    with journal_file.open("a") as journal:
+        def record_answer(idx: int, result: Dict[str, Any]) -> None:
+            record = {"index": idx, **result}
+            done[idx] = record
+            journal.write(json.dumps(record, ensure_ascii=False) + "\n")
+            journal.flush()
+
+        if pipeline:
+            # Stages of different questions interleave instead of each
+            # question holding a worker from start to finish
+            def on_done(idx: int, answer: Any) -> None:
+                if not isinstance(answer, str):
+                    print(f"Error processing question {idx + 1}: no answer produced")
+                    answer = "Error"
+                record_answer(idx, {"output": answer, "error": answer.startswith("Error")})
+
+            solver_pipeline(llm_workers=workers).run(
+                ((idx, questions[idx]["input"]) for idx in pending), on_done
+            )
+        else:
+            with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+                futures = {
+                    executor.submit(_solve_safely, idx + 1, total, questions[idx]): idx
+                    for idx in pending
+                }
+                for future in as_completed(futures):
+                    record_answer(futures[future], future.result())
+
+    if sharded:
+        return write_shard(questions, done, output_file, indices)
+    return finalize_answers(questions, done, output_file)
+
+
+def _write_json_atomic(data: Any, output_file: Path) -> None:
+    # Write to a temporary file first so the target is always valid JSON
+    tmp_file = output_file.with_name(f"{output_file.name}.tmp")
+    with tmp_file.open("w") as fp:
+        json.dump(data, fp, ensure_ascii=False, indent=2)
+    os.replace(tmp_file, output_file)
+
+
+def finalize_answers(
+    questions: List[Dict[str, Any]],
+    records: Dict[int, Dict[str, Any]],
+    output_file: Path,
+) -> List[Dict[str, str]]:
+    """Assemble journaled answers in input order, validate them and write the answers JSON."""
+    missing = [idx for idx in range(len(questions)) if idx not in records]
+    if missing:
+        raise ValueError(
+            f"{len(missing)} questions have no answer yet (first missing index: {missing[0]})."
+        )
+    answers = [{"output": records[idx]["output"]} for idx in range(len(questions))]
+    validate_results(questions, answers)
+    _write_json_atomic(answers, output_file)
+    return answers
+
+
+def parse_shard(spec: str, total: int) -> range:
+    """Turn ``i/N`` (1-based shard i of N) or ``start:end`` (0-based, end exclusive) into question indices."""
+    if "/" in spec:
+        shard, count = (int(part) for part in spec.split("/"))
+        if not 1 <= shard <= count:
+            raise ValueError(f"Shard must be between 1 and {count}, got {shard}.")
+        return range(total * (shard - 1) // count, total * shard // count)
+    start, _, end = spec.partition(":")
+    start_idx = int(start) if start else 0
+    end_idx = min(int(end), total) if end else total
+    if not 0 <= start_idx <= end_idx:
+        raise ValueError(f"Invalid index range: {spec}")
+    return range(start_idx, end_idx)
+
+
+def shard_output_path(output_file: Path, indices: range) -> Path:
+    return output_file.with_name(
+        f"{output_file.stem}.shard-{indices.start}-{indices.stop}{output_file.suffix}"
+    )
+
+
+def write_shard(
+    questions: List[Dict[str, Any]],
+    records: Dict[int, Dict[str, Any]],
+    shard_file: Path,
+    indices: Sequence[int],
+) -> List[Dict[str, str]]:
+    """Write one shard's answers, tagged with their question index, for merge_shards()."""
+    answers = [{"output": records[idx]["output"]} for idx in indices]
+    validate_results([questions[idx] for idx in indices], answers)
+    _write_json_atomic(
+        [
+            {"index": idx, "output": records[idx]["output"], "error": bool(records[idx].get("error"))}
+            for idx in indices
+        ],
+        shard_file,
+    )
     return answers
 
 
+def merge_shards(
+    questions: List[Dict[str, Any]], shard_files: List[Path], output_file: Path
+) -> List[Dict[str, str]]:
+    """Reassemble shard results (shard JSON files or journals) into one validated answers file."""
+    records: Dict[int, Dict[str, Any]] = {}
+    for shard_file in shard_files:
+        if shard_file.suffix == ".jsonl":
+            shard_records = list(load_journal(shard_file).values())
+        else:
+            with shard_file.open("r") as fp:
+                shard_records = json.load(fp)
+        for record in shard_records:
+            # If shards overlap, a clean answer beats an errored one
+            existing = records.get(record["index"])
+            if existing is None or existing.get("error") or not record.get("error"):
+                records[record["index"]] = record
+    return finalize_answers(questions, records, output_file)
+
+
 def validate_results(
     questions: List[Dict[str, Any]], answers: List[Dict[str, Any]]
 ) -> None:
@@ -213,23 +416,151 @@ def main() -> None:
     parser = argparse.ArgumentParser(description="Generate answers for the final project.")
     parser.add_argument("--input_file", type=Path, default=INPUT_PATH, help="Path to the input JSON file.")
     parser.add_argument("--output_file", type=Path, default=OUTPUT_PATH, help="Path to the output JSON file.")
+    parser.add_argument("--workers", type=int, default=1, help="Number of questions to solve concurrently.")
+    parser.add_argument("--pipeline", action="store_true", help="Run the solvers as stage graphs that interleave stages across questions; --workers sizes the LLM stage pool.")
+    parser.add_argument("--longest_first", action="store_true", help="Solve the questions with the highest estimated cost (by domain and length) first.")
+    parser.add_argument("--cost_trace", type=Path, default=None, help="Learn the cost estimates for --longest_first from the --trace JSONL of an earlier run (requires --longest_first).")
+    parser.add_argument("--resume", action="store_true", help="Resume from the checkpoint journal, only solving unfinished or errored questions.")
+    parser.add_argument("--finalize", action="store_true", help="Only assemble and validate the answers JSON from the checkpoint journal.")
+    sharding = parser.add_mutually_exclusive_group()
+    sharding.add_argument("--shard", type=str, default=None, help="Only solve part of the dataset: 'i/N' for shard i of N (1-based) or 'start:end' for an index range.")
+    sharding.add_argument("--merge", type=Path, nargs="+", default=None, help="Merge shard result files (or their journals) into the output file and validate them.")
+    parser.add_argument("--api_base", type=str, default=None, help="Inference server URL, overriding the API_BASE environment variable.")
+    parser.add_argument("--router_model", type=Path, default=None, help="Naive Bayes router model trained with `python -m src.domain_router`.")
+    parser.add_argument("--math_agreement", type=int, default=None, help="Stop math sampling once this many chains agree (enables adaptive self-consistency).")
+    parser.add_argument("--math_max_samples", type=int, default=6, help="Maximum number of math chains in adaptive mode.")
+    parser.add_argument("--math_program", action="store_true", help="Check math answers by executing a generated Python computation; skips the critique when they agree.")
+    parser.add_argument("--sandbox", action="store_true", help="Run generated code (coding checks, --math_program) in the local subprocess sandbox; it is not isolated from the network or filesystem, so this is opt-in.")
+    parser.add_argument("--code_candidates", type=int, default=1, help="Coding solutions generated concurrently and selected by running them (1 = single draft).")
+    parser.add_argument("--future_samples", type=int, default=3, help="Future prediction samples drawn concurrently and voted on.")
+    parser.add_argument("--max_retries", type=int, default=None, help="Retries per LLM request on 429/5xx responses and timeouts.")
+    parser.add_argument("--rate_limit", type=float, default=None, help="Client-side limit on LLM requests per second (0 = unlimited).")
+    parser.add_argument("--max_concurrency", type=int, default=None, help="Maximum number of LLM requests in flight at once.")
+    parser.add_argument("--batch_window", type=float, default=None, help="Coalesce LLM requests of the same stage arriving within this many seconds into batches.")
+    parser.add_argument("--batch_max_size", type=int, default=None, help="Maximum number of requests per batch (default 32).")
+    parser.add_argument("--batch_url", type=str, default=None, help="Completions endpoint taking a list of prompts, e.g. <API_BASE>/completions; without it requests are sent right away. Needs --chat_template and --generation_prompt.")
+    parser.add_argument("--chat_template", type=str, default=None, help="One chat message of the served model's prompt format, with {role} and {content}, e.g. '<|im_start|>{role}\\n{content}<|im_end|>\\n' for ChatML (default: LLM_CHAT_TEMPLATE).")
+    parser.add_argument("--generation_prompt", type=str, default=None, help="Text that starts the model's reply in that format, e.g. '<|im_start|>assistant\\n' (default: LLM_GENERATION_PROMPT).")
+    parser.add_argument("--trace", type=Path, default=None, help="Write per-stage latency and token records to this JSONL file and print a summary.")
+    parser.add_argument("--cache", type=Path, default=None, help="Path to an on-disk LLM response cache (SQLite).")
+    parser.add_argument("--cache_max_entries", type=int, default=100_000, help="Maximum number of cached responses before LRU eviction.")
+    parser.add_argument("--cache_sampled", action="store_true", help="Also cache calls made with a non-zero temperature.")
     args = parser.parse_args()
+    if args.cost_trace is not None and not args.longest_first:
+        # The trace only feeds the cost model; reordering is --longest_first's call
+        parser.error("--cost_trace requires --longest_first")
 
-    questions = load_questions(args.input_file)
-    answers = build_answers(questions, args.output_file)
-
-    # File is already written by build_answers incrementally
-    # with args.output_file.open("w") as fp:
-    #     json.dump(answers, fp, ensure_ascii=False, indent=2)
-
-    with args.output_file.open("r") as fp:
-        saved_answers = json.load(fp)
-    validate_results(questions, saved_answers)
-    print(
-        f"Wrote {len(answers)} answers to {args.output_file} "
-        "and validated format successfully."
+    if args.api_base is not None:
+        api.API_BASE = args.api_base
+
+    if args.router_model is not None:
+        load_router_model(args.router_model)
+
+    api.configure_transport(
+        max_retries=args.max_retries,
+        rate_limit=args.rate_limit,
+        max_concurrency=args.max_concurrency,
     )
 
+    if args.batch_window is not None:
+        try:
+            api.configure_dispatcher(
+                window=args.batch_window,
+                max_batch=args.batch_max_size,
+                batch_url=args.batch_url,
+                chat_template=args.chat_template,
+                generation_prompt=args.generation_prompt,
+            )
+        except ValueError as e:
+            parser.error(str(e))
+
+    if args.trace is not None:
+        tracing.configure(args.trace)
+
+    if args.sandbox:
+        sandbox.configure(True)
+
+    if args.cache is not None:
+        api.configure_cache(
+            args.cache,
+            max_entries=args.cache_max_entries,
+            cache_sampled=args.cache_sampled,
+        )
+
+    if args.math_agreement is not None:
+        MATH_OPTIONS.update(
+            adaptive=True,
+            agreement=args.math_agreement,
+            max_samples=args.math_max_samples,
+        )
+
+    if args.math_program:
+        MATH_OPTIONS.update(program_of_thought=True)
+    if args.code_candidates > 1:
+        CODE_OPTIONS.update(candidates=args.code_candidates)
+    FUTURE_OPTIONS.update(samples=args.future_samples)
+
+    questions = load_questions(args.input_file)
+    cost_model = None
+    if args.longest_first:
+        cost_model = CostModel.from_trace(args.cost_trace, questions) if args.cost_trace is not None else CostModel()
+    if args.shard:
+        indices = parse_shard(args.shard, len(questions))
+        shard_file = shard_output_path(args.output_file, indices)
+        if args.finalize:
+            records = load_journal(journal_path_for(shard_file))
+            answers = write_shard(questions, records, shard_file, indices)
+        else:
+            answers = build_answers(
+                questions, shard_file, workers=args.workers, resume=args.resume, indices=indices,
+                pipeline=args.pipeline, cost_model=cost_model,
+            )
+        print(
+            f"Wrote {len(answers)} answers for questions {indices.start}-{indices.stop - 1} "
+            f"to {shard_file}. Combine the shards with --merge."
+        )
+    else:
+        if args.merge:
+            answers = merge_shards(questions, args.merge, args.output_file)
+        elif args.finalize:
+            records = load_journal(journal_path_for(args.output_file))
+            answers = finalize_answers(questions, records, args.output_file)
+        else:
+            answers = build_answers(
+                questions, args.output_file, workers=args.workers, resume=args.resume,
+                pipeline=args.pipeline, cost_model=cost_model,
+            )
+
+        with args.output_file.open("r") as fp:
+            saved_answers = json.load(fp)
+        validate_results(questions, saved_answers)
+        print(
+            f"Wrote {len(answers)} answers to {args.output_file} "
+            "and validated format successfully."
+        )
+
+    cache = api.get_cache()
+    if cache is not None:
+        stats = cache.stats()
+        print(
+            f"LLM cache: {stats['hits']} hits, {stats['misses']} misses "
+            f"({stats['hit_rate']:.1%} hit rate), {stats['entries']} entries."
+        )
+
+    dispatcher = api.get_dispatcher()
+    if dispatcher is not None:
+        api.configure_dispatcher(None)
+        stats = dispatcher.stats()
+        print(
+            f"LLM batching: {stats['requests']} requests in {stats['batches']} batches "
+            f"({stats['mean_batch_size']:.1f} per batch)."
+        )
+
+    tracer = tracing.get_tracer()
+    if tracer is not None:
+        print(tracer.format_summary())
+        tracer.close()
+
 
 if __name__ == "__main__":
     main()
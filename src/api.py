@@ -1,5 +1,26 @@
 import os
+import asyncio
+import json
+import re
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
 import requests
+from requests.adapters import HTTPAdapter
+from src.dispatcher import Dispatcher
+from src.llm_cache import ResponseCache
+from src.resilience import RETRY_STATUSES, RetryPolicy, TokenBucket
+from src import tracing
+
+try:
+    import httpx
+except ImportError:  # only needed for the async client
+    httpx = None
+
+# Built only when httpx is present, so a missing httpx surfaces as the
+# ImportError from _get_async_client() rather than an AttributeError here
+_ASYNC_RETRY_ERRORS = (httpx.TimeoutException, httpx.TransportError) if httpx is not None else ()
 
 API_KEY = os.getenv("OPENAI_API_KEY", "cse476")
 API_BASE = os.getenv("API_BASE", "http://10.4.58.53:41701/v1")
@@ -7,23 +28,485 @@ MODEL = os.getenv("MODEL_NAME", "bens_model")
 
 DEFAULT_SYSTEM = "You are a helpful reasoning assistant."
 
+# Connection pool settings shared by the sync session and the async client
+MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "32"))
+KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "30"))
 
-def _post(payload, timeout=60):
-    url = f"{API_BASE}/chat/completions"
-    headers = {
+# Set LLM_CACHE_PATH to cache responses on disk across runs
+CACHE_PATH = os.getenv("LLM_CACHE_PATH")
+
+# Retry, rate limit and concurrency settings, see configure_transport()
+MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "4"))
+BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "1.0"))
+BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "30"))
+RATE_LIMIT = float(os.getenv("LLM_RATE_LIMIT", "0"))  # requests per second, 0 = unlimited
+MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "64"))
+
+_session = None
+_session_lock = threading.Lock()
+# One async client per event loop, since an httpx client is bound to its loop
+_async_clients = weakref.WeakKeyDictionary()
+# Optional persistent response cache, see configure_cache()
+_cache = None
+# Optional request batching, see configure_dispatcher()
+_dispatcher = None
+
+_retry_policy = RetryPolicy(MAX_RETRIES, BACKOFF_BASE, BACKOFF_MAX)
+_rate_limiter = TokenBucket(RATE_LIMIT)
+# Caps in-flight requests across all threads; async callers get a per-loop semaphore
+_concurrency = threading.BoundedSemaphore(MAX_CONCURRENCY)
+_async_concurrency = weakref.WeakKeyDictionary()
+# Cleared once the server rejects the `n` parameter, see sample_llm()
+_n_supported = True
+# Cleared once the server rejects `stream_options`, see _open_usage_stream()
+_stream_usage_supported = True
+# Rough prompt size for token estimates when a stream ends without usage
+CHARS_PER_TOKEN = 4
+
+
+def _headers():
+    return {
         "Authorization": f"Bearer {API_KEY}",
         "Content-Type": "application/json",
     }
-    resp = requests.post(url, headers=headers, json=payload, timeout=timeout)
-    resp.raise_for_status()
-    data = resp.json()
-    return data["choices"][0]["message"]["content"]
 
 
-def call_llm(
-    prompt, system=DEFAULT_SYSTEM, temperature=0.0, max_tokens=4096, timeout=60
+def configure_pool(max_connections=None, keepalive_expiry=None):
+    """Change the pool limits. Existing clients are dropped and rebuilt lazily."""
+    global MAX_CONNECTIONS, KEEPALIVE_EXPIRY, _session
+    if max_connections is not None:
+        MAX_CONNECTIONS = max_connections
+    if keepalive_expiry is not None:
+        KEEPALIVE_EXPIRY = keepalive_expiry
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+        _session = None
+    _async_clients.clear()
+
+
+def get_session():
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=MAX_CONNECTIONS, pool_maxsize=MAX_CONNECTIONS
+            )
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            session.headers.update(_headers())
+            _session = session
+        return _session
+
+
+def _get_async_client():
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        if httpx is None:
+            raise ImportError(
+                "The async LLM client requires httpx. Install it with `pip install httpx`."
+            )
+        limits = httpx.Limits(
+            max_connections=MAX_CONNECTIONS,
+            max_keepalive_connections=MAX_CONNECTIONS,
+            keepalive_expiry=KEEPALIVE_EXPIRY,
+        )
+        client = httpx.AsyncClient(limits=limits, headers=_headers())
+        _async_clients[loop] = client
+    return client
+
+
+async def aclose():
+    """Close the async client bound to the running event loop, if any."""
+    client = _async_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+
+def configure_transport(
+    max_retries=None,
+    backoff_base=None,
+    backoff_max=None,
+    rate_limit=None,
+    burst=None,
+    max_concurrency=None,
 ):
-    payload = {
+    """Change retry, client-side rate limiting and concurrency cap settings."""
+    global _retry_policy, _rate_limiter, _concurrency, MAX_CONCURRENCY
+    _retry_policy = RetryPolicy(
+        max_retries if max_retries is not None else _retry_policy.max_retries,
+        backoff_base if backoff_base is not None else _retry_policy.backoff_base,
+        backoff_max if backoff_max is not None else _retry_policy.backoff_max,
+    )
+    if rate_limit is not None:
+        _rate_limiter = TokenBucket(rate_limit, burst)
+    if max_concurrency is not None:
+        MAX_CONCURRENCY = max_concurrency
+        _concurrency = threading.BoundedSemaphore(max_concurrency)
+        _async_concurrency.clear()
+
+
+def _get_async_concurrency():
+    loop = asyncio.get_running_loop()
+    semaphore = _async_concurrency.get(loop)
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(MAX_CONCURRENCY)
+        _async_concurrency[loop] = semaphore
+    return semaphore
+
+
+def configure_cache(path=None, max_entries=100_000, cache_sampled=False):
+    """Enable the on-disk response cache at `path`, or disable it when path is None."""
+    global _cache
+    if _cache is not None:
+        _cache.close()
+    _cache = ResponseCache(path, max_entries=max_entries, cache_sampled=cache_sampled) if path else None
+    return _cache
+
+
+def get_cache():
+    return _cache
+
+
+def configure_dispatcher(window=None, max_batch=None, batch_url=None, chat_template=None, generation_prompt=None):
+    """Batch non-streamed requests across threads into `batch_url`, a completions
+    endpoint (see src/dispatcher.py), or stop when window is None."""
+    global _dispatcher
+    if _dispatcher is not None:
+        _dispatcher.close()
+    _dispatcher = None
+    if window is not None:
+        _dispatcher = Dispatcher(
+            _send, window=window, max_batch=max_batch, batch_url=batch_url,
+            chat_template=chat_template, generation_prompt=generation_prompt,
+        )
+    return _dispatcher
+
+
+def get_dispatcher():
+    return _dispatcher
+
+
+def _extract_content(data):
+    return data["choices"][0]["message"]["content"]
+
+
+def _send(payload, timeout=60, stats=None, url=None):
+    url = url or f"{API_BASE}/chat/completions"
+    attempt = 0
+    while True:
+        _rate_limiter.acquire()
+        try:
+            with _concurrency:
+                resp = get_session().post(url, json=payload, timeout=timeout)
+        except (requests.Timeout, requests.ConnectionError):
+            if attempt >= _retry_policy.max_retries:
+                raise
+            delay = _retry_policy.delay(attempt)
+        else:
+            if resp.status_code not in RETRY_STATUSES or attempt >= _retry_policy.max_retries:
+                resp.raise_for_status()
+                return resp.json()
+            delay = _retry_policy.delay(attempt, resp.headers.get("Retry-After"))
+        attempt += 1
+        if stats is not None:
+            stats["retries"] = attempt
+        time.sleep(delay)
+
+
+async def _asend(payload, timeout=60, stats=None):
+    url = f"{API_BASE}/chat/completions"
+    attempt = 0
+    while True:
+        delay = _rate_limiter.reserve()
+        if delay:
+            await asyncio.sleep(delay)
+        try:
+            async with _get_async_concurrency():
+                resp = await _get_async_client().post(url, json=payload, timeout=timeout)
+        except _ASYNC_RETRY_ERRORS:
+            if attempt >= _retry_policy.max_retries:
+                raise
+            delay = _retry_policy.delay(attempt)
+        else:
+            if resp.status_code not in RETRY_STATUSES or attempt >= _retry_policy.max_retries:
+                resp.raise_for_status()
+                return resp.json()
+            delay = _retry_policy.delay(attempt, resp.headers.get("Retry-After"))
+        attempt += 1
+        if stats is not None:
+            stats["retries"] = attempt
+        await asyncio.sleep(delay)
+
+
+def _open_stream(payload, timeout=60, stats=None):
+    """Open a streamed completion, retrying like _send() until the first byte.
+
+    Returns the response and the concurrency slot it holds; the caller
+    releases the slot once the stream is closed.
+    """
+    url = f"{API_BASE}/chat/completions"
+    attempt = 0
+    while True:
+        _rate_limiter.acquire()
+        slot = _concurrency
+        slot.acquire()
+        try:
+            resp = get_session().post(url, json=payload, timeout=timeout, stream=True)
+        except (requests.Timeout, requests.ConnectionError):
+            slot.release()
+            if attempt >= _retry_policy.max_retries:
+                raise
+            delay = _retry_policy.delay(attempt)
+        else:
+            if resp.status_code not in RETRY_STATUSES or attempt >= _retry_policy.max_retries:
+                if not resp.ok:
+                    resp.close()
+                    slot.release()
+                    resp.raise_for_status()
+                return resp, slot
+            resp.close()
+            slot.release()
+            delay = _retry_policy.delay(attempt, resp.headers.get("Retry-After"))
+        attempt += 1
+        if stats is not None:
+            stats["retries"] = attempt
+        time.sleep(delay)
+
+
+def _open_usage_stream(payload, timeout=60, stats=None):
+    """_open_stream() asking for the final usage chunk, unless the server rejected that before."""
+    global _stream_usage_supported
+    if _stream_usage_supported:
+        try:
+            return _open_stream(
+                {**payload, "stream_options": {"include_usage": True}}, timeout=timeout, stats=stats
+            )
+        except requests.HTTPError as e:
+            if e.response is None or e.response.status_code not in (400, 422):
+                raise
+            _stream_usage_supported = False
+    return _open_stream(payload, timeout=timeout, stats=stats)
+
+
+def _estimated_usage(payload, deltas):
+    """Token counts for a stream that ended before its usage chunk.
+
+    Servers send about one token per content delta; the prompt is estimated
+    from its length.
+    """
+    chars = sum(len(message.get("content") or "") for message in payload.get("messages", []))
+    return {"prompt_tokens": chars // CHARS_PER_TOKEN, "completion_tokens": deltas, "estimated": True}
+
+
+def _stream_choices(payload, timeout=60, stats=None):
+    """Yield (choice index, content delta) pairs of a server-sent-events completion.
+
+    Closing the generator closes the connection, which lets the server stop
+    generating. Servers that ignore `stream` and answer with a plain JSON
+    body yield the whole content of each choice at once. The usage is stored
+    in `stats`; a stream closed before the final usage chunk gets an
+    estimate from the deltas received.
+    """
+    resp, slot = _open_usage_stream({**payload, "stream": True}, timeout=timeout, stats=stats)
+    deltas = 0
+    try:
+        if resp.headers.get("Content-Type", "").startswith("application/json"):
+            data = resp.json()
+            if stats is not None:
+                stats["usage"] = data.get("usage")
+            for i, choice in enumerate(data["choices"]):
+                yield choice.get("index", i), choice["message"]["content"]
+            return
+        for line in resp.iter_lines(decode_unicode=True):
+            if not line or not line.startswith("data:"):
+                continue
+            chunk = line[len("data:"):].strip()
+            if chunk == "[DONE]":
+                return
+            data = json.loads(chunk)
+            if data.get("usage") and stats is not None:
+                stats["usage"] = data["usage"]
+            for choice in data.get("choices") or []:
+                delta = (choice.get("delta") or {}).get("content")
+                if delta:
+                    deltas += 1
+                    yield choice.get("index", 0), delta
+    finally:
+        resp.close()
+        slot.release()
+        if stats is not None and not stats.get("usage"):
+            stats["usage"] = _estimated_usage(payload, deltas)
+
+
+def _stream(payload, timeout=60, stats=None):
+    """Yield the content deltas of a single-choice streamed completion."""
+    stream = _stream_choices(payload, timeout=timeout, stats=stats)
+    try:
+        for _, delta in stream:
+            yield delta
+    finally:
+        stream.close()
+
+
+def stop_at_line(marker):
+    """Stop predicate for call_llm(): true once a line with `marker` and a value after it is complete."""
+    pattern = re.compile(re.escape(marker) + r"[ \t]*\S[^\n]*\n")
+
+    def predicate(text):
+        return pattern.search(text) is not None
+
+    # Names the predicate in cache keys, see _post_streaming()
+    predicate.__qualname__ = f"stop_at_line({marker!r})"
+    return predicate
+
+
+def _post_streaming(payload, stop_when, timeout=60):
+    """Like _post(), but streams the completion and stops once stop_when(text) is true."""
+    start = time.perf_counter()
+    cache = _cache
+    # A stopped completion is a prefix of the full one, so it gets its own entry
+    key = cache.key_for({**payload, "stop_when": stop_when.__qualname__}) if cache is not None else None
+    if key is not None:
+        cached = cache.get(key)
+        if cached is not None:
+            tracing.record_llm_call(time.perf_counter() - start, cached=True)
+            return cached
+    stats = {"retries": 0, "usage": None}
+    text = ""
+    try:
+        stream = _stream(payload, timeout=timeout, stats=stats)
+        try:
+            for delta in stream:
+                text += delta
+                if stop_when(text):
+                    break
+        finally:
+            stream.close()
+    except Exception as e:
+        tracing.record_llm_call(time.perf_counter() - start, retries=stats["retries"], error=repr(e))
+        raise
+    tracing.record_llm_call(time.perf_counter() - start, usage=stats["usage"], retries=stats["retries"])
+    if key is not None:
+        cache.put(key, text)
+    return text
+
+
+def _post(payload, timeout=60):
+    start = time.perf_counter()
+    cache = _cache
+    key = cache.key_for(payload) if cache is not None else None
+    if key is not None:
+        cached = cache.get(key)
+        if cached is not None:
+            tracing.record_llm_call(time.perf_counter() - start, cached=True)
+            return cached
+    stats = {"retries": 0}
+    dispatcher = _dispatcher
+    try:
+        if dispatcher is not None:
+            data = dispatcher.submit(payload, timeout=timeout, stats=stats).result()
+        else:
+            data = _send(payload, timeout=timeout, stats=stats)
+        content = _extract_content(data)
+    except Exception as e:
+        tracing.record_llm_call(time.perf_counter() - start, retries=stats["retries"], error=repr(e))
+        raise
+    tracing.record_llm_call(time.perf_counter() - start, usage=data.get("usage"), retries=stats["retries"])
+    if key is not None:
+        cache.put(key, content)
+    return content
+
+
+def _request_samples(payload, n, stop_when=None, timeout=60):
+    """Request n choices of one completion, bypassing the cache.
+
+    Returns the choices in order; servers that ignore `n` return fewer. With
+    `stop_when`, each choice is cut off like in _post_streaming() and the
+    stream is closed once every choice has stopped.
+    """
+    start = time.perf_counter()
+    if n > 1:
+        payload = {**payload, "n": n}
+    stats = {"retries": 0, "usage": None}
+    try:
+        if stop_when is None:
+            dispatcher = _dispatcher
+            if dispatcher is not None:
+                data = dispatcher.submit(payload, timeout=timeout, stats=stats).result()
+            else:
+                data = _send(payload, timeout=timeout, stats=stats)
+            stats["usage"] = data.get("usage")
+            choices = sorted(enumerate(data["choices"]), key=lambda c: c[1].get("index", c[0]))
+            texts = [choice["message"]["content"] for _, choice in choices]
+        else:
+            parts, stopped = {}, set()
+            stream = _stream_choices(payload, timeout=timeout, stats=stats)
+            try:
+                for index, delta in stream:
+                    if index in stopped:
+                        continue
+                    parts[index] = parts.get(index, "") + delta
+                    if stop_when(parts[index]):
+                        stopped.add(index)
+                        if len(stopped) == n:
+                            break
+            finally:
+                stream.close()
+            texts = [parts[index] for index in sorted(parts)]
+    except Exception as e:
+        tracing.record_llm_call(time.perf_counter() - start, retries=stats["retries"], error=repr(e))
+        raise
+    tracing.record_llm_call(time.perf_counter() - start, usage=stats["usage"], retries=stats["retries"])
+    return texts
+
+
+async def _afetch(payload, timeout=60):
+    """The content of one async completion, traced but not cached."""
+    start = time.perf_counter()
+    stats = {"retries": 0}
+    try:
+        data = await _asend(payload, timeout=timeout, stats=stats)
+        content = _extract_content(data)
+    except Exception as e:
+        tracing.record_llm_call(time.perf_counter() - start, retries=stats["retries"], error=repr(e))
+        raise
+    tracing.record_llm_call(time.perf_counter() - start, usage=data.get("usage"), retries=stats["retries"])
+    return content
+
+
+async def _apost(payload, timeout=60):
+    cache = _cache
+    key = cache.key_for(payload) if cache is not None else None
+    if key is not None:
+        cached = cache.get(key)
+        if cached is not None:
+            tracing.record_llm_call(0.0, cached=True)
+            return cached
+    content = await _afetch(payload, timeout=timeout)
+    if key is not None:
+        cache.put(key, content)
+    return content
+
+
+def gather_llm(*calls):
+    """Await acall_llm()/achat_llm() coroutines concurrently from synchronous code.
+
+    The calls share one event loop on the calling thread, so a solver can
+    fan out without a thread per request. Results come back in call order.
+    """
+    async def run():
+        try:
+            return await asyncio.gather(*calls)
+        finally:
+            await aclose()
+    return asyncio.run(run())
+
+
+def _call_payload(prompt, system, temperature, max_tokens):
+    return {
         "model": MODEL,
         "messages": [
             {"role": "system", "content": system},
@@ -32,18 +515,118 @@ def call_llm(
         "temperature": temperature,
         "max_tokens": max_tokens,
     }
-    return _post(payload, timeout=timeout)
 
 
-def chat_llm(
-    messages, temperature=0.2, max_tokens=4096, timeout=60, system=DEFAULT_SYSTEM
-):
+def _chat_payload(messages, system, temperature, max_tokens):
     full_messages = [{"role": "system", "content": system}] + messages
 
-    payload = {
+    return {
         "model": MODEL,
         "messages": full_messages,
         "temperature": temperature,
         "max_tokens": max_tokens,
     }
+
+
+def call_llm(
+    prompt, system=DEFAULT_SYSTEM, temperature=0.0, max_tokens=4096, timeout=60, stop_when=None
+):
+    """Return the completion text.
+
+    With `stop_when`, the completion is streamed and cut off as soon as
+    stop_when(text_so_far) is true, e.g. stop_at_line("FINAL:").
+    """
+    payload = _call_payload(prompt, system, temperature, max_tokens)
+    if stop_when is not None:
+        return _post_streaming(payload, stop_when, timeout=timeout)
     return _post(payload, timeout=timeout)
+
+
+def sample_llm(
+    prompt, n, system=DEFAULT_SYSTEM, temperature=0.7, max_tokens=4096, timeout=60, stop_when=None
+):
+    """Return n sampled completions of the same prompt.
+
+    The samples are requested as n choices of a single completion, so the
+    server processes the prompt once. Choices the server does not return are
+    requested as separate concurrent calls, as are all samples once the
+    server has rejected `n`. Each sample is cached like a call_llm() call.
+    """
+    global _n_supported
+    payload = _call_payload(prompt, system, temperature, max_tokens)
+    cache = _cache
+    samples = [None] * n
+    keys = [None] * n
+    if cache is not None:
+        cache_payload = {**payload, "stop_when": stop_when.__qualname__} if stop_when else payload
+        keys = [cache.key_for(cache_payload) for _ in range(n)]
+        for i, key in enumerate(keys):
+            if key is not None:
+                samples[i] = cache.get(key)
+                if samples[i] is not None:
+                    tracing.record_llm_call(0.0, cached=True)
+    missing = [i for i, sample in enumerate(samples) if sample is None]
+    fetched = list(missing)
+
+    if len(missing) > 1 and _n_supported:
+        try:
+            texts = _request_samples(payload, len(missing), stop_when, timeout=timeout)
+        except requests.HTTPError as e:
+            if e.response is None or e.response.status_code not in (400, 422):
+                raise
+            _n_supported = False
+            texts = []
+        for i, text in zip(missing, texts):
+            samples[i] = text
+        missing = missing[len(texts):]
+
+    if missing and stop_when is None and _dispatcher is None:
+        texts = gather_llm(*(_afetch(payload, timeout=timeout) for _ in missing))
+        for i, text in zip(missing, texts):
+            samples[i] = text
+    elif missing:
+        with ThreadPoolExecutor(max_workers=len(missing)) as executor:
+            futures = [
+                tracing.submit(executor, _request_samples, payload, 1, stop_when, timeout=timeout)
+                for _ in missing
+            ]
+            for i, future in zip(missing, futures):
+                samples[i] = future.result()[0]
+
+    for i in fetched:
+        if keys[i] is not None:
+            cache.put(keys[i], samples[i])
+    return samples
+
+
+def stream_llm(
+    prompt, system=DEFAULT_SYSTEM, temperature=0.0, max_tokens=4096, timeout=60
+):
+    """Yield the completion text incrementally; close the generator to stop early."""
+    payload = _call_payload(prompt, system, temperature, max_tokens)
+    yield from _stream(payload, timeout=timeout)
+
+
+def chat_llm(
+    messages, temperature=0.2, max_tokens=4096, timeout=60, system=DEFAULT_SYSTEM
+):
+    payload = _chat_payload(messages, system, temperature, max_tokens)
+    return _post(payload, timeout=timeout)
+
+
+async def acall_llm(
+    prompt, system=DEFAULT_SYSTEM, temperature=0.0, max_tokens=4096, timeout=60
+):
+    payload = _call_payload(prompt, system, temperature, max_tokens)
+    return await _apost(payload, timeout=timeout)
+
+
+async def achat_llm(
+    messages, temperature=0.2, max_tokens=4096, timeout=60, system=DEFAULT_SYSTEM
+):
+    payload = _chat_payload(messages, system, temperature, max_tokens)
+    return await _apost(payload, timeout=timeout)
+
+
+if CACHE_PATH:
+    configure_cache(CACHE_PATH)
@@ -1,10 +1,21 @@
-from src.api import call_llm
+import ast
+import io
+import re
+import tokenize
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from src.api import acall_llm, call_llm, gather_llm
+from src import tracing
+from src.tracing import traced
+from src.pipeline import LLM_STAGE_RETRIES, LLM_STAGE_TIMEOUT, Stage
+from src.sandbox import run_code
 
 # Debugging log file for tracking the thought process of the model
 def log_to_file(message):
     with open("src/cot_debug.log", "a") as f:
         f.write(message + "\n")
 
+@traced("code_reasoning.plan_code")
 def plan_code(question: str, logging: bool = False) -> str:
     system_prompt = (
         "You are a strategic coding planner. Create a concise, step-by-step plan to solve the coding problem. "
@@ -24,23 +35,28 @@ def plan_code(question: str, logging: bool = False) -> str:
         log_to_file(f"\n[Plan]\n{response}\n")
     return response.strip()
 
-def generate_code(question: str, plan: str, logging: bool = False) -> str:
-    system_prompt = (
-        "You are a precise Python coder. Implement the function exactly following the plan. "
-        "Output only valid Python code, no backticks, no explanation. Write simple, readable code without complex logic."
-    )
-    prompt = (
+CODE_SYSTEM = (
+    "You are a precise Python coder. Implement the function exactly following the plan. "
+    "Output only valid Python code, no backticks, no explanation. Write simple, readable code without complex logic."
+)
+
+def _code_prompt(question: str, plan: str) -> str:
+    return (
         f"Question: {question}\n\n"
         f"Plan:\n{plan}\n\n"
         "Now implement the function exactly following your plan.\n"
         "Start with the given imports and function signature if provided in the question.\n"
         "Output only valid Python code, no backticks, no explanation. Write simple, readable code without complex logic."
     )
-    
-    response = call_llm(prompt, system=system_prompt, temperature=0.2)
+
+@traced("code_reasoning.generate_code")
+def generate_code(question: str, plan: str, logging: bool = False, temperature: float = 0.2) -> str:
+    response = call_llm(_code_prompt(question, plan), system=CODE_SYSTEM, temperature=temperature)
     if logging:
         log_to_file(f"\n[Code]\n{response}\n")
-    
+    return _clean_code(response)
+
+def _clean_code(response: str) -> str:
     # Clean up code (remove unnecessary formatting)
     code = response.strip()
     if code.startswith("```python"):
@@ -51,16 +67,264 @@ def generate_code(question: str, plan: str, logging: bool = False) -> str:
         code = code[:-3]
     return code.strip()
 
-def critic_and_fix(question: str, plan: str, code: str, logging: bool = False) -> str:
+def extract_starter(question: str):
+    """The starting code snippet the question asks the solution to begin with, if any."""
+    blocks = re.findall(r"```(?:python)?\n(.*?)```", question, re.S)
+    for block in reversed(blocks):
+        if re.search(r"^\s*def \w+\(", block, re.M):
+            return block
+    return None
+
+def _parse_starter(starter: str):
+    # The starter usually ends with a bare signature; give it a body
+    try:
+        return ast.parse(starter if not starter.rstrip().endswith(":") else starter.rstrip() + "\n    pass")
+    except SyntaxError:
+        return None
+
+def _function_signature(source: str, name: str = None):
+    """(name, parameter names) of the first (or the named) top-level function, or None."""
+    tree = _parse_starter(source)
+    if tree is None:
+        return None
+    for node in tree.body:
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)) and name in (None, node.name):
+            args = node.args
+            params = [a.arg for a in args.posonlyargs + args.args + args.kwonlyargs]
+            return node.name, params
+    return None
+
+def extract_examples(question: str):
+    """Split the `>>>` examples in the question into (statement, expected output) pairs."""
+    examples = []
+    for chunk in question.split(">>>")[1:]:
+        first, _, rest = chunk.strip(" ").partition("\n")
+        # Inline examples put the output after the statement on the same line:
+        # the statement is the longest prefix that parses
+        tokens = first.split()
+        for end in range(len(tokens), 0, -1):
+            source = " ".join(tokens[:end])
+            try:
+                tree = ast.parse(source)
+            except SyntaxError:
+                continue
+            if end < len(tokens):
+                output = " ".join(tokens[end:])
+            elif tree.body and isinstance(tree.body[-1], ast.Expr):
+                # Docstring style: the output is on the following lines
+                output = re.split(r"\n\s*\n|```", rest)[0]
+            else:
+                output = ""
+            examples.append((source, output.strip()))
+            break
+    return examples
+
+# Probe arguments by parameter type, from annotations or default values
+_PROBE_VALUES = {
+    "int": ["0", "3", "-2"],
+    "float": ["0.0", "2.5"],
+    "str": ["''", "'Hello World 42'"],
+    "bool": ["True", "False"],
+    "list": ["[]", "[3, 1, 2]"],
+    "tuple": ["()", "(3, 1, 2)"],
+    "dict": ["{}", "{'a': 1, 'b': 2}"],
+}
+
+def _parameter_type(annotation, default):
+    # `int`, `List[int]` or `list[int]`; else the type of a literal default
+    if isinstance(annotation, ast.Subscript):
+        annotation = annotation.value
+    if isinstance(annotation, ast.Name) and annotation.id.lower() in _PROBE_VALUES:
+        return annotation.id.lower()
+    if default is not None:
+        try:
+            kind = type(ast.literal_eval(default)).__name__
+        except ValueError:
+            return None
+        return kind if kind in _PROBE_VALUES else None
+    return None
+
+def _signature_calls(func, count: int = 3):
+    """Calls of `func` with arguments built from its parameter types.
+
+    Parameters with a default but no known type keep the default; a required
+    parameter without one means no calls. At least one argument is always
+    passed, so the defaults alone are never run.
+    """
+    args = func.args.args
+    defaults = [None] * (len(args) - len(func.args.defaults)) + list(func.args.defaults)
+    values = {}
+    for arg, default in zip(args, defaults):
+        kind = _parameter_type(arg.annotation, default)
+        if kind is not None:
+            values[arg.arg] = _PROBE_VALUES[kind]
+        elif default is None:
+            return []
+    if not values:
+        return []
+    return [
+        f"{func.name}({', '.join(f'{name}={options[i % len(options)]}' for name, options in values.items())})"
+        for i in range(min(count, max(len(options) for options in values.values())))
+    ]
+
+def _probes(question: str, examples):
+    """Extra statements whose output fingerprints a candidate's behaviour.
+
+    The values assigned in the examples are printed, and when they assign
+    nothing, the function is called with arguments built from the starter's
+    signature (see _signature_calls()). Exceptions are printed by type, so
+    candidates failing the same way agree. Returns [] when there is nothing
+    to probe with.
+    """
+    expressions = []
+    for source, _ in examples:
+        try:
+            node = ast.parse(source).body[0]
+        except (SyntaxError, IndexError):
+            continue
+        if isinstance(node, ast.Assign):
+            expressions.extend(ast.unparse(target) for target in node.targets)
+    if not expressions:
+        starter = extract_starter(question)
+        tree = _parse_starter(starter) if starter else None
+        func = next((n for n in tree.body if isinstance(n, ast.FunctionDef)), None) if tree else None
+        if func is not None:
+            expressions.extend(_signature_calls(func))
+    return [
+        f"try:\n    print(repr({expr}))\nexcept Exception as e:\n    print(type(e).__name__)\n"
+        for expr in expressions
+    ]
+
+# Expected outputs that cannot be compared as text: doctest ellipses, object
+# reprs and memory addresses
+_UNCHECKABLE_RE = re.compile(r"\.\.\.|<[^<>\n]*>| at 0x")
+
+def _run_checks(question: str, code: str, probes=()):
+    """check_code() that also returns the printed output of the probes."""
+    try:
+        compile(code, "<solution>", "exec")
+    except SyntaxError as e:
+        return "failed", f"SyntaxError: {e}", None
+
+    starter = extract_starter(question)
+    expected = _function_signature(starter) if starter else None
+    if expected is not None:
+        actual = _function_signature(code, expected[0])
+        if actual is None:
+            return "failed", f"The code does not define `{expected[0]}`.", None
+        if actual[1] != expected[1]:
+            return "failed", (
+                f"`{expected[0]}` must take the parameters ({', '.join(expected[1])}), "
+                f"but the code defines ({', '.join(actual[1])})."
+            ), None
+
+    examples = extract_examples(question)
+    result = run_code(code, [source for source, _ in examples] + list(probes))
+    if not result.passed:
+        return result.status, result.error, None
+    unchecked = None
+    for (source, wanted), output in zip(examples, result.outputs):
+        if wanted and " ".join(output.split()) != " ".join(wanted.split()):
+            report = f"The example `{source}` printed:\n{output.strip()}\nExpected:\n{wanted}"
+            if not _UNCHECKABLE_RE.search(wanted):
+                return "failed", report, None
+            unchecked = unchecked or report
+    if unchecked is not None:
+        # The code ran, but its output can only be compared by reading it
+        return "unavailable", unchecked, None
+    # Default reprs carry memory addresses that differ between runs
+    fingerprint = tuple(re.sub(r" at 0x[0-9a-fA-F]+", "", output) for output in result.outputs[len(examples):])
+    return "passed", None, fingerprint
+
+def check_code(question: str, code: str):
+    """Run the code against the question's starter signature and examples.
+
+    Returns (status, report): the sandbox status and, when it failed, a
+    description of the problem for the fix step. The status is "unavailable"
+    when the run was inconclusive, e.g. the sandbox is disabled or an
+    expected output cannot be compared as text.
+    """
+    status, report, _ = _run_checks(question, code)
+    return status, report
+
+@traced("code_reasoning.generate_candidates")
+def generate_candidates(
+    question: str, plan: str, candidates: int, logging: bool = False, temperature: float = 0.8, probes=None,
+):
+    """Generate and check `candidates` solutions concurrently.
+
+    The first candidate uses the usual low temperature, the others are
+    sampled at `temperature` for diversity. Returns one (code, status,
+    report, fingerprint) tuple per candidate, in generation order.
+    """
+    if probes is None:
+        probes = _probes(question, extract_examples(question))
+
+    # All candidates are awaited at once from this thread; only the sandbox
+    # checks, which wait on subprocesses, use a thread each
+    prompt = _code_prompt(question, plan)
+    responses = gather_llm(*(
+        acall_llm(prompt, system=CODE_SYSTEM, temperature=0.2 if i == 0 else temperature)
+        for i in range(candidates)
+    ))
+    codes = [_clean_code(response) for response in responses]
+    if logging:
+        for code in codes:
+            log_to_file(f"\n[Code]\n{code}\n")
+
+    with ThreadPoolExecutor(max_workers=candidates) as executor:
+        futures = [tracing.submit(executor, _run_checks, question, code, probes) for code in codes]
+        return [(code,) + future.result() for code, future in zip(codes, futures)]
+
+def select_candidate(results):
+    """Pick the candidate to keep from generate_candidates() results.
+
+    Among the passing candidates, the largest group that behaves the same on
+    the probes wins (ties go to the earliest candidate). Returns (code,
+    status, report) of the chosen candidate, where status is not "passed"
+    only if no candidate passed.
+    """
+    passing = [(i, r) for i, r in enumerate(results) if r[1] == "passed"]
+    if passing:
+        sizes = Counter(r[3] for _, r in passing)
+        _, best = min(passing, key=lambda item: (-sizes[item[1][3]], item[0]))
+        return best[:3]
+    # Prefer a candidate that could not be judged here over one that failed
+    for code, status, report, _ in results:
+        if status == "unavailable":
+            return code, status, report
+    return results[0][:3]
+
+def draft_code(question: str, plan: str, candidates: int = 1, logging: bool = False):
+    """Generate and check the code to review: (code, status, report).
+
+    Several candidates only help when their behaviour can be compared, so
+    without probes (see _probes()) a single draft is generated instead.
+    """
+    probes = _probes(question, extract_examples(question)) if candidates > 1 else []
+    if probes:
+        return select_candidate(generate_candidates(question, plan, candidates, logging=logging, probes=probes))
+    code = generate_code(question, plan, logging=logging)
+    return (code, *check_code(question, code))
+
+@traced("code_reasoning.critic_and_fix")
+def critic_and_fix(question: str, plan: str, code: str, logging: bool = False, failure: str = None) -> str:
     system_prompt = (
         "You are a rigorous code reviewer. Review the solution for correctness against requirements. "
         "Do concise reasoning first, then at the very end output ONLY the final code (no explanation) "
         "preceded by the marker 'FINAL CODE:'."
     )
+    failure_note = ""
+    if failure:
+        failure_note = (
+            f"Running this code on the examples from the question failed:\n{failure}\n\n"
+            "Find the cause of this failure and fix it.\n"
+        )
     prompt = (
         f"Question: {question}\n\n"
         f"Plan:\n{plan}\n\n"
         f"Code:\n{code}\n\n"
+        f"{failure_note}"
         "Restate the requirements in your own words.\n"
         "Go through each requirement one by one and check if the code satisfies it.\n"
         "If all are satisfied, output the exact same code.\n"
@@ -89,7 +353,103 @@ def critic_and_fix(question: str, plan: str, code: str, logging: bool = False) -
         
     return final_code.strip()
 
+def _header_end(code: str, func: ast.FunctionDef):
+    """(line, column) just past the colon that ends the function header."""
+    lines = code.splitlines(keepends=True)
+    source = "".join(lines[func.lineno - 1:])
+    depth = 0
+    for tok in tokenize.generate_tokens(io.StringIO(source).readline):
+        if tok.type == tokenize.OP and tok.string in "([{":
+            depth += 1
+        elif tok.type == tokenize.OP and tok.string in ")]}":
+            depth -= 1
+        elif tok.type == tokenize.OP and tok.string == ":" and depth == 0:
+            return tok.end[0] + func.lineno - 1, tok.end[1]
+    return None
+
+def _is_test_code(node) -> bool:
+    # `if __name__ == "__main__":` blocks and bare calls such as print(task_func(1))
+    if isinstance(node, ast.Expr) and not isinstance(node.value, ast.Constant):
+        return True
+    return isinstance(node, ast.If) and "__name__" in ast.dump(node.test)
+
+def _string_continuation_lines(node) -> set:
+    # Line numbers inside multi-line string literals, whose text must not change
+    lines = set()
+    for child in ast.walk(node):
+        if isinstance(child, (ast.JoinedStr, ast.Constant)) and child.end_lineno > child.lineno:
+            lines.update(range(child.lineno + 1, child.end_lineno + 1))
+    return lines
+
+def _indented(code: str, node, indent: str):
+    continuation = _string_continuation_lines(node)
+    return [
+        line if node.lineno + i in continuation else (indent + line if line.strip() else "")
+        for i, line in enumerate(ast.get_source_segment(code, node).splitlines())
+    ]
+
+def strip_preamble_locally(question: str, code: str):
+    """Return the implementation that follows the question's starter snippet, or None.
+
+    The function body keeps its indentation. Top-level imports and helpers the
+    solution adds beyond the starter are moved into the body so they are not
+    lost with the preamble. Returns None when the starter or the code cannot be
+    parsed, or the function is defined more than once, so the caller can fall
+    back to the LLM. Code with a `from __future__` import the starter lacks is
+    returned unstripped, since that import is only valid at the top of the
+    module.
+    """
+    starter = extract_starter(question)
+    starter_tree = _parse_starter(starter) if starter else None
+    if starter_tree is None:
+        return None
+    signature = _function_signature(starter)
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return None
+    funcs = [n for n in tree.body if isinstance(n, (ast.FunctionDef, ast.AsyncFunctionDef))
+             and signature and n.name == signature[0]]
+    if len(funcs) != 1 or funcs[0].decorator_list:
+        return None
+    func = funcs[0]
+
+    lines = code.splitlines()
+    header_line, header_col = _header_end(code, func)
+    rest = lines[header_line - 1][header_col:].strip()
+    if rest and not rest.startswith("#"):
+        # One-line function: `def f(x): return x`
+        body = ["    " + rest]
+        indent = "    "
+    else:
+        body = lines[header_line:func.end_lineno]
+        first = next((line for line in body if line.strip()), "")
+        indent = first[:len(first) - len(first.lstrip())] or "    "
+
+    # Imports and constants of the starter are kept by the grader already
+    starter_nodes = {ast.dump(n) for n in starter_tree.body}
+    extra = []
+    for node in tree.body:
+        if node is func or _is_test_code(node) or ast.dump(node) in starter_nodes:
+            continue
+        if isinstance(node, ast.ImportFrom) and node.module == "__future__":
+            return code
+        extra.extend(_indented(code, node, indent))
+
+    while body and not body[0].strip():
+        body.pop(0)
+    return "\n".join(extra + body).rstrip()
+
+@traced("code_reasoning.remove_preamble")
 def remove_preamble(question: str, code: str, logging: bool = False) -> str:
+    cleaned_code = strip_preamble_locally(question, code)
+    if cleaned_code is not None:
+        if logging:
+            log_to_file(f"\n[Remove Preamble] (local)\n{cleaned_code}\n")
+        return cleaned_code
+    return _llm_remove_preamble(question, code, logging=logging)
+
+def _llm_remove_preamble(question: str, code: str, logging: bool = False) -> str:
     system_prompt = (
         "You are a code formatter. Your task is to remove the starting code snippet that was provided in the question from the final solution code."
     )
@@ -117,14 +477,56 @@ def remove_preamble(question: str, code: str, logging: bool = False) -> str:
         
     return cleaned_code.strip()
 
-def solve_coding_problem(question: str, logging: bool = False) -> str:
+def _review(question: str, plan: str, code: str, status: str, report: str, logging: bool = False) -> str:
+    # Only spend the review call when running the code did not settle it
+    if status == "passed":
+        return code
+    if status == "unavailable":
+        return critic_and_fix(question, plan, code, logging=logging)
+    return critic_and_fix(question, plan, code, logging=logging, failure=report)
+
+def solve_coding_problem(question: str, logging: bool = False, candidates: int = 1) -> str:
     try:
         plan = plan_code(question, logging=logging)
-        code = generate_code(question, plan, logging=logging)
-        final_code = critic_and_fix(question, plan, code, logging=logging)
+        code, status, report = draft_code(question, plan, candidates, logging=logging)
+        if logging:
+            log_to_file(f"\n[Sandbox] {status}\n{report or ''}\n")
+        final_code = _review(question, plan, code, status, report, logging=logging)
         cleaned_code = remove_preamble(question, final_code, logging=logging)
         return cleaned_code
     except Exception as e:
         if logging:
             log_to_file(f"[Error] {str(e)}")
         return f"Error: {str(e)}"
+
+def coding_stages(candidates: int = 1):
+    """solve_coding_problem() as pipeline stages, see src/pipeline.py.
+
+    The "draft" result is (code, status, report), as from select_candidate().
+    """
+    llm = dict(retries=LLM_STAGE_RETRIES, timeout=LLM_STAGE_TIMEOUT)
+    if candidates > 1:
+        drafts = [
+            Stage(
+                "draft", lambda question, plan: draft_code(question, plan, candidates), ("question", "plan"),
+                retries=LLM_STAGE_RETRIES, timeout=LLM_STAGE_TIMEOUT * 2,  # The requests, then the sandbox runs
+            ),
+        ]
+    else:
+        drafts = [
+            Stage("code", generate_code, ("question", "plan"), **llm),
+            Stage("draft", lambda question, code: (code, *check_code(question, code)), ("question", "code"), pool="cpu"),
+        ]
+    return [
+        Stage("plan", plan_code, ("question",), **llm),
+        *drafts,
+        # Without a review, the draft itself is cleaned
+        Stage(
+            "review", lambda question, plan, draft: _review(question, plan, *draft),
+            ("question", "plan", "draft"), when=lambda r: r["draft"][1] != "passed", optional=True, **llm,
+        ),
+        Stage(
+            "clean", lambda question, draft, reviewed: remove_preamble(question, draft[0] if reviewed is None else reviewed),
+            ("question", "draft", "review"), **llm,  # May call the LLM formatter
+        ),
+    ]
@@ -1,6 +1,9 @@
 import re
 from src.api import call_llm
+from src.pipeline import LLM_STAGE_RETRIES, LLM_STAGE_TIMEOUT, Stage
+from src.tracing import traced
 
+@traced("common_sense.generate_clarifying_questions")
 def generate_clarifying_questions(question: str):
     system_prompt = (
         "You are a helpful assistant. "
@@ -17,6 +20,7 @@ def generate_clarifying_questions(question: str):
     response = call_llm(prompt, system=system_prompt, temperature=0.5)
     return response
 
+@traced("common_sense.solve_and_verify")
 def solve_and_verify(question: str, context: str):
     system_prompt = (
         "You are a precise solver. "
@@ -36,6 +40,65 @@ def solve_and_verify(question: str, context: str):
     response = call_llm(prompt, system=system_prompt, temperature=0.3)
     return response
 
+# Answers longer than this are probably a sentence and go to the LLM extractor
+MAX_ANSWER_WORDS = 12
+
+_MARKER_RE = re.compile(r"FINAL\s+ANSWER\s*[:：]", re.IGNORECASE)
+_OPTION_RE = re.compile(r"(?:^|\s)\(?([A-J])[.)]\s+(.+?)(?=\s+\(?[A-J][.)]\s|\n|$)", re.MULTILINE)
+_LETTER_RE = re.compile(r"^(?:option\s+)?\(?([A-J])\)?(?:[.):]\s*(.*))?$", re.IGNORECASE)
+
+def parse_options(question: str):
+    """Lettered answer options in the question ({"A": text, ...}), or {} if it is not multiple choice."""
+    options = {}
+    for letter, text in _OPTION_RE.findall(question):
+        options.setdefault(letter, text.strip())
+    letters = sorted(options)
+    # Options must run A, B, C, ... without gaps
+    if len(letters) < 2 or "".join(letters) != "ABCDEFGHIJ"[:len(letters)]:
+        return {}
+    return options
+
+def _trim(answer: str):
+    answer = re.sub(r"^\\boxed\{(.*)\}$", r"\1", answer.strip())
+    answer = answer.strip(" *_`\"'")
+    answer = re.sub(r"^(?:the\s+)?(?:final\s+)?answer\s+is\s*:?\s*", "", answer, flags=re.IGNORECASE)
+    # Drop a sentence-final period, but keep abbreviations such as "U.S."
+    if answer.endswith(".") and not re.search(r"\b\w\.\w\.$", answer):
+        answer = answer[:-1]
+    return answer.strip(" *_`\"'")
+
+def extract_answer_locally(previous_output: str, question: str = None):
+    """Read the answer after the last `FINAL ANSWER:` marker, or return None.
+
+    Multiple-choice answers are normalized to "B. <option text>" using the
+    options in the question. None means the marker is missing or the answer
+    looks like a sentence, so the LLM extractor should be used.
+    """
+    markers = list(_MARKER_RE.finditer(previous_output))
+    if not markers:
+        return None
+    lines = [line for line in previous_output[markers[-1].end():].splitlines() if line.strip(" *_`")]
+    if not lines:
+        return None
+    answer = _trim(lines[0])
+    if not answer:
+        return None
+
+    options = parse_options(question) if question else {}
+    if options:
+        match = _LETTER_RE.match(answer)
+        if match and match.group(1).upper() in options:
+            letter = match.group(1).upper()
+            return f"{letter}. {options[letter]}"
+        for letter, text in options.items():
+            if _trim(text).lower() == answer.lower():
+                return f"{letter}. {text}"
+
+    if len(answer.split()) > MAX_ANSWER_WORDS:
+        return None
+    return answer
+
+@traced("common_sense.extract_final_answer")
 def extract_final_answer(previous_output: str):
     system_prompt = (
         "You are a strict extractor. "
@@ -58,11 +121,26 @@ def solve_common_sense(question: str):
         # Step 2: Solve and Verify (returns reasoning + answer)
         reasoning_output = solve_and_verify(question, context)
         
-        # Step 3: Final Extraction
-        final_answer = extract_final_answer(reasoning_output)
+        # Step 3: Final Extraction, with the LLM only when the marker is missing
+        # or the answer reads like a sentence
+        final_answer = extract_answer_locally(reasoning_output, question)
+        if final_answer is None:
+            final_answer = extract_final_answer(reasoning_output)
         
         return final_answer
         
     except Exception as e:
         return f"Error: {str(e)}"
 
+def common_sense_stages():
+    """solve_common_sense() as pipeline stages, see src/pipeline.py."""
+    llm = dict(retries=LLM_STAGE_RETRIES, timeout=LLM_STAGE_TIMEOUT)
+    return [
+        Stage("clarify", generate_clarifying_questions, ("question",), **llm),
+        Stage("solve", solve_and_verify, ("question", "clarify"), **llm),
+        Stage("extract_locally", extract_answer_locally, ("solve", "question"), pool="cpu"),
+        Stage(
+            "extract", extract_final_answer, ("solve",),
+            after=("extract_locally",), when=lambda r: r["extract_locally"] is None, **llm,
+        ),
+    ]
@@ -0,0 +1,271 @@
+"""Coalesce concurrent LLM requests from different questions into batches.
+
+Solver stages call call_llm() independently, one question per worker thread,
+so the server only ever sees single chat requests. Once a dispatcher is
+enabled with api.configure_dispatcher(), non-streamed requests (call_llm()
+and the unstreamed sample_llm() requests) go through it instead: requests
+with the same model, system prompt and sampling settings that arrive within
+`window` seconds of each other form a batch of up to `max_batch` requests.
+Callers get a future per request; call_llm() simply waits on it.
+
+A batch is posted to `batch_url`, an OpenAI-compatible completions endpoint
+(`<API_BASE>/completions`, as served by vLLM), which takes a list of prompts
+and answers with `n` choices per prompt, in prompt order. The chat messages
+are rendered into prompts with `chat_template` and `generation_prompt`
+(LLM_CHAT_TEMPLATE and LLM_GENERATION_PROMPT), which must match the chat
+template of the served model. There is no default: a wrong template changes
+every answer without any error, so a batch endpoint is refused until both
+are set. The usage of a batch is shared out between its requests by text
+length.
+
+Without a batch endpoint, or once it answers 404, 405 or 501, requests are
+sent as chat completions right away, without waiting for a batch to fill.
+Streamed requests (call_llm() with `stop_when`) never reach the dispatcher,
+since each stream is stopped on its own.
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import requests
+
+BATCH_WINDOW = float(os.getenv("LLM_BATCH_WINDOW", "0.02"))
+BATCH_MAX_SIZE = int(os.getenv("LLM_BATCH_MAX_SIZE", "32"))
+BATCH_URL = os.getenv("LLM_BATCH_URL")
+SENDER_THREADS = int(os.getenv("LLM_MAX_CONCURRENCY", "64"))
+# One message of the rendered prompt ("{role}" and "{content}"), and the text
+# that starts the reply, with "\n" for newlines
+CHAT_TEMPLATE = os.getenv("LLM_CHAT_TEMPLATE")
+GENERATION_PROMPT = os.getenv("LLM_GENERATION_PROMPT")
+
+# Statuses meaning the server has no batch endpoint
+_UNAVAILABLE_STATUSES = {404, 405, 501}
+
+
+def batch_key(payload):
+    """Requests with the same key can share a batch: everything but the conversation must match."""
+    messages = payload.get("messages") or []
+    system = messages[0].get("content") if messages and messages[0].get("role") == "system" else None
+    settings = tuple(sorted((key, repr(value)) for key, value in payload.items() if key != "messages"))
+    return system, settings
+
+
+def _unescape(text):
+    return text.replace(r"\n", "\n") if text is not None else None
+
+
+def render_chat(messages, chat_template, generation_prompt):
+    """The completions prompt for a list of chat messages."""
+    return "".join(
+        chat_template.format(role=message["role"], content=message["content"]) for message in messages
+    ) + generation_prompt
+
+
+def _shares(total, sizes):
+    # Split a token count in proportion to sizes, keeping the sum
+    if not sum(sizes):
+        sizes = [1] * len(sizes)
+    bounds = [round(total * sum(sizes[:i]) / sum(sizes)) for i in range(len(sizes) + 1)]
+    return [bounds[i + 1] - bounds[i] for i in range(len(sizes))]
+
+
+def split_batch_response(data, prompts, n=1):
+    """Turn a completions response for `prompts` into one chat completion per prompt."""
+    choices = sorted(enumerate(data["choices"]), key=lambda c: c[1].get("index", c[0]))
+    choices = [choice for _, choice in choices]
+    if len(choices) != len(prompts) * n:
+        raise ValueError(f"Batch endpoint returned {len(choices)} choices for {len(prompts)} prompts.")
+    groups = [choices[i * n:(i + 1) * n] for i in range(len(prompts))]
+    usage = data.get("usage") or {}
+    prompt_tokens = _shares(usage.get("prompt_tokens") or 0, [len(p) for p in prompts])
+    completion_tokens = _shares(
+        usage.get("completion_tokens") or 0, [sum(len(c.get("text") or "") for c in group) for group in groups]
+    )
+    responses = []
+    for i, group in enumerate(groups):
+        response = {
+            "choices": [
+                {
+                    "index": j,
+                    "message": {"role": "assistant", "content": choice.get("text") or ""},
+                    "finish_reason": choice.get("finish_reason"),
+                }
+                for j, choice in enumerate(group)
+            ]
+        }
+        if usage:
+            response["usage"] = {
+                "prompt_tokens": prompt_tokens[i],
+                "completion_tokens": completion_tokens[i],
+                "estimated": True,
+            }
+        responses.append(response)
+    return responses
+
+
+def _resolve(future, result=None, error=None):
+    if not future.set_running_or_notify_cancel():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+
+class _Batch:
+    def __init__(self, deadline):
+        self.deadline = deadline
+        self.items = []  # (payload, timeout, stats, future)
+
+
+class Dispatcher:
+    """Groups submitted chat payloads by batch_key() and sends each group with `send`.
+
+    `send(payload, timeout=..., stats=None, url=None)` posts one payload and
+    returns the response JSON, e.g. api._send; `stats["retries"]` is passed
+    through to each caller. A background thread flushes a group once its
+    window has passed or it is full. A `batch_url` needs `chat_template` and
+    `generation_prompt` (see the module docstring), else ValueError.
+    """
+
+    def __init__(
+        self, send, window=None, max_batch=None, batch_url=None, max_workers=None,
+        chat_template=None, generation_prompt=None,
+    ):
+        self.send = send
+        self.window = BATCH_WINDOW if window is None else window
+        self.max_batch = max_batch or BATCH_MAX_SIZE
+        self.batch_url = batch_url if batch_url is not None else BATCH_URL
+        self.chat_template = _unescape(chat_template if chat_template is not None else CHAT_TEMPLATE)
+        self.generation_prompt = _unescape(generation_prompt if generation_prompt is not None else GENERATION_PROMPT)
+        if self.batch_url and (not self.chat_template or self.generation_prompt is None):
+            raise ValueError(
+                "Batching into a completions endpoint needs the served model's chat template and "
+                "generation prompt (LLM_CHAT_TEMPLATE and LLM_GENERATION_PROMPT)."
+            )
+        self.batches = 0
+        self.requests = 0
+        self._pending = {}
+        self._ready = []
+        self._closed = False
+        self._cond = threading.Condition()
+        self._senders = ThreadPoolExecutor(
+            max_workers=max_workers or SENDER_THREADS, thread_name_prefix="llm-batch"
+        )
+        self._thread = threading.Thread(target=self._run, name="llm-dispatcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, payload, timeout=60, stats=None) -> Future:
+        """Queue a chat completion payload; the future resolves to the response JSON."""
+        future = Future()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("The dispatcher is closed.")
+            item = (payload, timeout, stats, future)
+            if not self.batch_url:
+                # Nothing to batch into: holding the request back only adds latency
+                self.batches += 1
+                self.requests += 1
+                self._senders.submit(self._send_one, *item)
+                return future
+            key = batch_key(payload)
+            batch = self._pending.get(key)
+            if batch is None:
+                batch = self._pending[key] = _Batch(time.monotonic() + self.window)
+            batch.items.append(item)
+            if len(batch.items) >= self.max_batch:
+                del self._pending[key]
+                self._ready.append(batch)
+            self._cond.notify()
+        return future
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    now = time.monotonic()
+                    for key, batch in list(self._pending.items()):
+                        if batch.deadline <= now or self._closed:
+                            del self._pending[key]
+                            self._ready.append(batch)
+                    if self._ready or self._closed:
+                        break
+                    deadline = min((b.deadline for b in self._pending.values()), default=None)
+                    self._cond.wait(None if deadline is None else deadline - now)
+                ready, self._ready = self._ready, []
+                if not ready and self._closed:
+                    return
+                for batch in ready:
+                    self.batches += 1
+                    self.requests += len(batch.items)
+            for batch in ready:
+                self._dispatch(batch.items)
+
+    def _dispatch(self, items):
+        if self.batch_url and len(items) > 1:
+            self._senders.submit(self._send_batch, items)
+        else:
+            for item in items:
+                self._senders.submit(self._send_one, *item)
+
+    def _send_one(self, payload, timeout, stats, future):
+        try:
+            result = self.send(payload, timeout=timeout, stats=stats)
+        except Exception as e:
+            _resolve(future, error=e)
+        else:
+            _resolve(future, result)
+
+    def _send_batch(self, items):
+        timeout = max(timeout for _, timeout, _, _ in items)
+        first = items[0][0]
+        prompts = [
+            render_chat(payload["messages"], self.chat_template, self.generation_prompt) for payload, _, _, _ in items
+        ]
+        body = {key: value for key, value in first.items() if key != "messages"}
+        body["prompt"] = prompts
+        batch_stats = {"retries": 0}
+        try:
+            data = self.send(body, timeout=timeout, stats=batch_stats, url=self.batch_url)
+            responses = split_batch_response(data, prompts, first.get("n", 1))
+        except requests.HTTPError as e:
+            if e.response is not None and e.response.status_code in _UNAVAILABLE_STATUSES:
+                self.batch_url = None
+                for item in items:
+                    try:
+                        self._senders.submit(self._send_one, *item)
+                    except RuntimeError:  # Shutting down: send it from this thread
+                        self._send_one(*item)
+                return
+            self._fail(items, batch_stats, e)
+            return
+        except Exception as e:
+            self._fail(items, batch_stats, e)
+            return
+        for (_, _, stats, future), response in zip(items, responses):
+            if stats is not None:
+                stats["retries"] = batch_stats["retries"]
+            _resolve(future, response)
+
+    def _fail(self, items, batch_stats, error):
+        for _, _, stats, future in items:
+            if stats is not None:
+                stats["retries"] = batch_stats["retries"]
+            _resolve(future, error=error)
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "requests": self.requests,
+            "mean_batch_size": self.requests / self.batches if self.batches else 0.0,
+        }
+
+    def close(self):
+        """Send whatever is still queued and stop the background thread."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+        self._senders.shutdown(wait=True)
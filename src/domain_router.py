@@ -0,0 +1,178 @@
+"""Local domain routing that runs before the LLM classifier.
+
+Most questions in the dataset carry unmistakable surface markers (the coding
+starter-code instruction, the planning `[STATEMENT]` block, the future
+prediction preamble, ...). `route_domain()` scores those markers with regex
+rules and, when a model has been loaded, a naive Bayes classifier trained on
+the dev set. It returns a domain only when it is confident, and None when the
+question should go to the LLM classifier instead.
+
+Train a model from the dev set with:
+
+    python -m src.domain_router --dev_file src/data/cse476_final_project_dev_data.json --out router_model.json
+"""
+
+import argparse
+import json
+import math
+import re
+from collections import Counter, defaultdict
+
+DOMAINS = ["MATH", "CODING", "FUTURE_PREDICTION", "PLANNING", "COMMON_SENSE"]
+
+# (domain, pattern, weight). A single strong marker is enough to route.
+RULES = [
+    ("CODING", re.compile(r"You should write self-contained code starting with", re.I), 5.0),
+    ("CODING", re.compile(r"The function should (output|raise)", re.I), 3.0),
+    ("CODING", re.compile(r"\bdef task_func\("), 3.0),
+    ("CODING", re.compile(r"```"), 1.0),
+    ("FUTURE_PREDICTION", re.compile(r"You are an agent that can predict future events", re.I), 5.0),
+    ("FUTURE_PREDICTION", re.compile(r"The event to be predicted", re.I), 5.0),
+    ("FUTURE_PREDICTION", re.compile(r"请预测"), 3.0),
+    ("PLANNING", re.compile(r"My plan is as follows", re.I), 5.0),
+    ("PLANNING", re.compile(r"\[STATEMENT\]"), 4.0),
+    ("PLANNING", re.compile(r"initial conditions", re.I), 2.0),
+    ("PLANNING", re.compile(r"My goal is to have", re.I), 2.0),
+    ("PLANNING", re.compile(r"Here are the actions I can do", re.I), 3.0),
+    ("MATH", re.compile(r"\\boxed\{"), 2.0),
+    ("MATH", re.compile(r"\\(frac|sqrt|cdot|times|pi|angle|triangle|sum|binom)\b"), 2.0),
+    ("MATH", re.compile(r"\$[^$]+\$"), 1.5),
+    ("MATH", re.compile(r"\b(how many|how much|what is the (value|sum|product|area|probability|remainder)|find the|compute|evaluate|solve for)\b", re.I), 1.0),
+]
+
+# The top domain must reach MIN_SCORE and beat the runner-up by MIN_MARGIN
+MIN_SCORE = 4.0
+MIN_MARGIN = 3.0
+# Naive Bayes posterior needed to route without the LLM
+MIN_PROBABILITY = 0.98
+
+_model = None
+
+
+def rule_scores(question: str):
+    scores = Counter()
+    for domain, pattern, weight in RULES:
+        if pattern.search(question):
+            scores[domain] += weight
+    return scores
+
+
+def route_by_rules(question: str):
+    ranked = rule_scores(question).most_common(2)
+    if not ranked:
+        return None
+    top_domain, top_score = ranked[0]
+    runner_up = ranked[1][1] if len(ranked) > 1 else 0.0
+    if top_score >= MIN_SCORE and top_score - runner_up >= MIN_MARGIN:
+        return top_domain
+    return None
+
+
+def _tokenize(text: str):
+    return re.findall(r"[a-z]+|\d+|[^\sa-z\d]", text.lower())
+
+
+def normalize_label(label: str):
+    label = label.strip().upper().replace(" ", "_").replace("-", "_")
+    return label if label in DOMAINS else None
+
+
+def train_naive_bayes(examples, vocab_size=5000):
+    """Fit a multinomial naive Bayes model on (question, domain) pairs."""
+    token_counts = defaultdict(Counter)
+    doc_counts = Counter()
+    for question, domain in examples:
+        doc_counts[domain] += 1
+        token_counts[domain].update(_tokenize(question))
+
+    totals = Counter()
+    for counts in token_counts.values():
+        totals.update(counts)
+    vocab = [token for token, _ in totals.most_common(vocab_size)]
+
+    num_docs = sum(doc_counts.values())
+    model = {"priors": {}, "log_probs": {}}
+    for domain, counts in token_counts.items():
+        # Laplace smoothing over the shared vocabulary
+        denom = sum(counts[t] for t in vocab) + len(vocab)
+        model["priors"][domain] = math.log(doc_counts[domain] / num_docs)
+        model["log_probs"][domain] = {t: math.log((counts[t] + 1) / denom) for t in vocab}
+    return model
+
+
+def predict_proba(model, question: str):
+    tokens = _tokenize(question)
+    log_scores = {}
+    for domain, prior in model["priors"].items():
+        # Every domain shares the same vocabulary; out-of-vocabulary tokens are skipped
+        log_probs = model["log_probs"][domain]
+        log_scores[domain] = prior + sum(log_probs[t] for t in tokens if t in log_probs)
+    peak = max(log_scores.values())
+    exp_scores = {d: math.exp(s - peak) for d, s in log_scores.items()}
+    norm = sum(exp_scores.values())
+    return {d: s / norm for d, s in exp_scores.items()}
+
+
+def route_by_model(model, question: str):
+    probs = predict_proba(model, question)
+    domain, prob = max(probs.items(), key=lambda item: item[1])
+    return domain if prob >= MIN_PROBABILITY else None
+
+
+def load_model(path):
+    """Load a trained router model so route_domain() can use it."""
+    global _model
+    with open(path, "r") as f:
+        _model = json.load(f)
+    return _model
+
+
+def get_model():
+    return _model
+
+
+def route_domain(question: str):
+    """Return a domain if the local router is confident, otherwise None."""
+    domain = route_by_rules(question)
+    if domain is None and _model is not None:
+        domain = route_by_model(_model, question)
+    return domain
+
+
+def load_dev_examples(path):
+    with open(path, "r") as f:
+        data = json.load(f)
+    examples = []
+    for item in data:
+        domain = normalize_label(item["domain"])
+        if domain is not None:
+            examples.append((item["input"], domain))
+    return examples
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the local domain router on the dev set.")
+    parser.add_argument("--dev_file", default="src/data/cse476_final_project_dev_data.json")
+    parser.add_argument("--out", default="router_model.json")
+    args = parser.parse_args()
+
+    examples = load_dev_examples(args.dev_file)
+    model = train_naive_bayes(examples)
+    with open(args.out, "w") as f:
+        json.dump(model, f)
+
+    # Report how often the model would route on its own, and how accurately
+    routed = correct = 0
+    for question, domain in examples:
+        predicted = route_by_rules(question) or route_by_model(model, question)
+        if predicted is not None:
+            routed += 1
+            correct += predicted == domain
+    print(
+        f"Trained on {len(examples)} examples. Routed locally: {routed}/{len(examples)}, "
+        f"accuracy on routed: {correct / max(routed, 1):.1%}. Saved to {args.out}."
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,24 @@
-from src.api import call_llm
+from src.api import call_llm, sample_llm, stop_at_line
+from src.pipeline import LLM_STAGE_RETRIES, LLM_STAGE_TIMEOUT, Stage
+from src.tracing import traced
+from collections import Counter, defaultdict
+import ast
 import re
+import statistics
 
-def extract_prediction(question: str):
-    system_prompt = (
-        "You are an agent that can predict future events. "
-        "Your goal is ONLY to decide the internal final prediction."
-    )
-    prompt = (
+# Stream the samples and stop once the prediction line is complete
+STOP_AT_PREDICTION = stop_at_line("INTERNAL_PREDICTION:")
+
+# Reciprocal rank fusion constant: damps the weight of the top ranks
+RRF_K = 60
+
+PREDICTION_SYSTEM = (
+    "You are an agent that can predict future events. "
+    "Your goal is ONLY to decide the internal final prediction."
+)
+
+def _prediction_prompt(question: str):
+    return (
         f"Think step-by-step about the future event. Do NOT produce the final output format yet.\n"
         "Your goal in this step is ONLY to decide the internal final prediction.\n\n"
         f"Event to be predicted: \"{question}\"\n\n"
@@ -16,25 +28,125 @@ def extract_prediction(question: str):
         "For numeric predictions: <value> is a number\n"
         "For other tasks: <value> is a string or list of strings"
     )
-    return call_llm(prompt, system=system_prompt, temperature=0.7)
 
+@traced("future_prediction.extract_prediction")
+def extract_prediction(question: str):
+    return call_llm(
+        _prediction_prompt(question), system=PREDICTION_SYSTEM, temperature=0.7, stop_when=STOP_AT_PREDICTION
+    )
+
+@traced("future_prediction.extract_prediction")
+def extract_predictions(question: str, samples: int):
+    # Self-consistency samples of the same prompt, drawn as choices of one request
+    return sample_llm(
+        _prediction_prompt(question), samples, system=PREDICTION_SYSTEM, temperature=0.7,
+        stop_when=STOP_AT_PREDICTION,
+    )
+
+def _clean_prediction(prediction: str):
+    match = re.search(r"INTERNAL_PREDICTION:\s*(.+)", prediction, re.IGNORECASE | re.DOTALL)
+    return match.group(1).strip() if match else prediction.strip()
+
+def _prediction_value(prediction: str):
+    """The predicted value on its own: first line after the marker, without markdown or \\boxed{}."""
+    # A sample with nothing after the marker has no value and does not vote
+    value = (_clean_prediction(prediction).splitlines() or [""])[0]
+    value = value.strip(" *`.")
+    match = re.fullmatch(r"\\boxed\{(.*)\}", value)
+    if match:
+        value = match.group(1).strip()
+    return value
+
+def _parse_number(value: str):
+    text = value.replace("$", "").replace("%", "").strip()
+    if re.fullmatch(r"-?\d{1,3}(,\d{3})+(\.\d+)?", text):
+        text = text.replace(",", "")
+    try:
+        return float(text)
+    except ValueError:
+        return None
+
+def _parse_list(value: str):
+    if value.startswith("["):
+        try:
+            items = ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            items = value.strip("[]").split(",")
+        if not isinstance(items, (list, tuple)):
+            return None
+        items = [str(item) for item in items]
+    else:
+        items = re.split(r"\s*[,;]\s*", value)
+    items = [item.strip().strip("'\"").strip() for item in items]
+    return [item for item in items if item]
+
+def _format_number(value: float, originals):
+    for original in originals:
+        if _parse_number(original) == value:
+            return original
+    if value.is_integer() and all(_parse_number(o).is_integer() for o in originals):
+        return str(int(value))
+    decimals = max(len(m.group(1)) if (m := re.search(r"\.(\d+)", o)) else 0 for o in originals)
+    return f"{value:.{max(decimals, 1)}f}"
+
+def aggregate_locally(predictions: list[str]):
+    """Aggregate the sampled predictions without the LLM, or return None if undecided.
+
+    Yes/No answers need a strict majority, numbers are combined with the
+    median (a 20% trimmed mean from 5 samples up), lists by reciprocal rank
+    fusion, and any other answer needs a strict majority of identical values.
+    Ties go to the value of the earliest sample, so the result only depends
+    on the samples and their order.
+    """
+    values = [_prediction_value(p) for p in predictions]
+    values = [v for v in values if v]
+    if not values:
+        return None
+    majority = len(values) // 2 + 1
+
+    counts = Counter(v.lower() for v in values)
+    if set(counts) <= {"yes", "no"}:
+        answer, count = counts.most_common(1)[0]
+        return answer.capitalize() if count >= majority else None
+
+    numbers = [_parse_number(v) for v in values]
+    if all(n is not None for n in numbers):
+        if len(numbers) >= 5:
+            trim = len(numbers) // 5
+            value = statistics.mean(sorted(numbers)[trim:len(numbers) - trim])
+        else:
+            value = statistics.median(numbers)
+        return _format_number(value, values)
+
+    lists = [_parse_list(v) for v in values]
+    if all(lists) and any(len(items) > 1 for items in lists):
+        scores = defaultdict(float)
+        spelling = {}
+        for items in lists:
+            for rank, item in enumerate(items):
+                scores[item.lower()] += 1 / (RRF_K + rank)
+                spelling.setdefault(item.lower(), item)
+        length = round(statistics.median(len(items) for items in lists))
+        # Stable sort: equal scores keep the order of their first sample
+        ranked = sorted(scores, key=lambda item: -scores[item])[:length]
+        return ", ".join(spelling[item] for item in ranked)
+
+    answer, count = counts.most_common(1)[0]
+    if count >= majority:
+        return next(v for v in values if v.lower() == answer)
+    return None
+
+@traced("future_prediction.aggregate_internal_predictions")
 def aggregate_internal_predictions(predictions: list[str], question: str):
     # Extract values from the raw CoT responses
-    cleaned_preds = []
-    for p in predictions:
-        match = re.search(r"INTERNAL_PREDICTION:\s*(.+)", p, re.IGNORECASE | re.DOTALL)
-        if match:
-            cleaned_preds.append(match.group(1).strip())
-        else:
-            cleaned_preds.append(p.strip())
+    cleaned_preds = [_clean_prediction(p) for p in predictions]
+    numbered = "\n".join(f"{i}. {pred}" for i, pred in enumerate(cleaned_preds, 1))
 
     system_prompt = "You are a judge that aggregates predictions."
     prompt = (
         f"Question: {question}\n\n"
-        "Here are 3 internal predictions from different reasoning paths:\n"
-        f"1. {cleaned_preds[0]}\n"
-        f"2. {cleaned_preds[1]}\n"
-        f"3. {cleaned_preds[2]}\n\n"
+        f"Here are {len(cleaned_preds)} internal predictions from different reasoning paths:\n"
+        f"{numbered}\n\n"
         "Consider the above outputs and reason about which one is the most logical.\n"
         "Decide the most logical final internal prediction or if there is another prediction that is more logical.\n"
         "Output ONLY the final internal prediction.\n"
@@ -48,6 +160,60 @@ def aggregate_internal_predictions(predictions: list[str], question: str):
         return f"INTERNAL_PREDICTION: {match.group(1).strip()}"
     return f"INTERNAL_PREDICTION: {response.strip()}"
 
+def parse_boxed_list(text: str):
+    """The list of strings in `\\boxed{[...]}`, or None if the text is not in that format."""
+    match = re.search(r"\\boxed\{\s*(\[.*\])\s*\}", text, re.DOTALL)
+    if not match:
+        return None
+    try:
+        items = ast.literal_eval(match.group(1))
+    except (ValueError, SyntaxError):
+        return None
+    if not isinstance(items, list) or not items or not all(isinstance(item, str) and item.strip() for item in items):
+        return None
+    return items
+
+def _boxed(items):
+    # repr() keeps CJK text readable and picks quotes that survive apostrophes
+    return "\\boxed{" + repr([str(item) for item in items]) + "}"
+
+def _looks_like_prose(item: str):
+    # Long answers or sentence punctuation mean reasoning leaked into the value
+    return len(item.split()) > 8 or re.search(r"[.!?。！？](\s|$)", item) is not None
+
+def format_boxed_list(internal_pred_text: str):
+    """Format the prediction as `\\boxed{['...']}` without the LLM, or return None.
+
+    Handles Yes/No, numbers, single names and comma-separated or bulleted
+    lists (including CJK separators); anything that reads like prose is left
+    to the LLM formatter.
+    """
+    lines = [line.strip() for line in _clean_prediction(internal_pred_text).splitlines() if line.strip()]
+    if not lines:
+        return None
+    if len(lines) > 1:
+        # A bulleted or numbered list, one item per line
+        bullet = re.compile(r"^(?:[-*•]|\d+[.)])\s+")
+        if not all(bullet.match(line) for line in lines):
+            return None
+        items = [bullet.sub("", line).strip(" *`.") for line in lines]
+    else:
+        value = _prediction_value(internal_pred_text)
+        boxed = parse_boxed_list(value if value.startswith("\\boxed") else f"\\boxed{{{value}}}")
+        if boxed is not None:
+            items = boxed
+        elif value.lower() in {"yes", "no"}:
+            items = [value.capitalize()]
+        elif _parse_number(value) is not None:
+            items = [value]
+        else:
+            items = _parse_list(value.replace("、", ",").replace("，", ",").replace("；", ";")) or []
+
+    if not items or any(_looks_like_prose(item) for item in items):
+        return None
+    return _boxed(items)
+
+@traced("future_prediction.format_to_list")
 def format_to_list(internal_pred_text: str, question: str):
     # Extract value
     pred_match = re.search(r"INTERNAL_PREDICTION:\s*(.+)", internal_pred_text, re.IGNORECASE | re.DOTALL)
@@ -72,6 +238,7 @@ def format_to_list(internal_pred_text: str, question: str):
     )
     return call_llm(prompt, system=system_prompt, temperature=0.0)
 
+@traced("future_prediction.verify_and_refine")
 def verify_and_refine(formatted_pred: str, question: str):
     # Extract list prediction
     match = re.search(r"LIST_PREDICTION:\s*(.+)", formatted_pred, re.IGNORECASE | re.DOTALL)
@@ -99,18 +266,67 @@ def verify_and_refine(formatted_pred: str, question: str):
         return match.group(1).strip()
     return response.strip()
 
-def predict_future_event(question: str):
-    # Step1: Self-consistency extraction
-    internal_preds = []
-    for _ in range(3):
-        internal_preds.append(extract_prediction(question))
+def sample_predictions(question: str, samples: int):
+    if samples > 1:
+        return extract_predictions(question, samples)
+    return [extract_prediction(question)]
+
+def _aggregated(local_pred, judged_pred):
+    return f"INTERNAL_PREDICTION: {local_pred}" if local_pred is not None else judged_pred
+
+def _boxed_if_parses(list_pred: str):
+    items = parse_boxed_list(list_pred)
+    return _boxed(items) if items is not None else None
+
+def predict_future_event(question: str, samples: int = 3):
+    try:
+        # Step1: Self-consistency extraction
+        internal_preds = sample_predictions(question, samples)
+
+        # Vote locally; the LLM judge only breaks ties and free-form disagreements
+        local_pred = aggregate_locally(internal_preds)
+        judged_pred = None
+        if local_pred is None:
+            judged_pred = aggregate_internal_predictions(internal_preds, question)
+        aggregated_pred = _aggregated(local_pred, judged_pred)
         
-    aggregated_pred = aggregate_internal_predictions(internal_preds, question)
-    
-    # Step 2: Formatting
-    list_pred = format_to_list(aggregated_pred, question)
-    
-    # Step3: Verification
-    final_answer = verify_and_refine(list_pred, question)
-    
-    return final_answer
+        # Step 2: Formatting, locally unless the prediction cannot be normalized
+        final_answer = format_boxed_list(aggregated_pred)
+        if final_answer is None:
+            list_pred = format_to_list(aggregated_pred, question)
+            
+            # Step3: Verification, only if the LLM output does not parse
+            final_answer = _boxed_if_parses(list_pred)
+            if final_answer is None:
+                final_answer = verify_and_refine(list_pred, question)
+        
+        return final_answer
+
+    except Exception as e:
+        return f"Error: {str(e)}"
+
+def prediction_stages(samples: int = 3):
+    """predict_future_event() as pipeline stages, see src/pipeline.py."""
+    no_vote = lambda r: r["vote"] is None
+    not_formatted = lambda r: r["format_locally"] is None
+    llm = dict(retries=LLM_STAGE_RETRIES, timeout=LLM_STAGE_TIMEOUT)
+    return [
+        # The samples are requested together, so the stage takes one request's time
+        Stage("sample", lambda question: sample_predictions(question, samples), ("question",), **llm),
+        Stage("vote", aggregate_locally, ("sample",), pool="cpu"),
+        Stage("judge", aggregate_internal_predictions, ("sample", "question"), after=("vote",), when=no_vote, **llm),
+        Stage(
+            "format_locally", lambda local, judged: format_boxed_list(_aggregated(local, judged)),
+            ("vote", "judge"), pool="cpu",
+        ),
+        Stage(
+            "format", lambda local, judged, question: format_to_list(_aggregated(local, judged), question),
+            ("vote", "judge", "question"), after=("format_locally",), when=not_formatted, **llm,
+        ),
+        Stage("parse", _boxed_if_parses, ("format",), after=("format_locally",), when=not_formatted, pool="cpu"),
+        Stage(
+            "verify", verify_and_refine, ("format", "question"),
+            after=("format_locally", "parse"), when=lambda r: r["format_locally"] is None and r["parse"] is None,
+            **llm,
+        ),
+    ]
@@ -0,0 +1,117 @@
+import hashlib
+import json
+import sqlite3
+import threading
+from collections import Counter
+
+
+class ResponseCache:
+    """On-disk LLM response cache keyed by a hash of the request.
+
+    Entries live in a small SQLite file so they survive crashes and reruns.
+    Once more than `max_entries` responses are stored, the least recently
+    used ones are evicted.
+
+    Calls with a non-zero temperature are only cached when `cache_sampled`
+    is set. In that case the k-th identical sampled request of a run maps to
+    its own entry, so self-consistency samples stay distinct while a rerun
+    replays the same samples.
+    """
+
+    def __init__(self, path, max_entries=100_000, cache_sampled=False):
+        self.path = str(path)
+        self.max_entries = max_entries
+        self.cache_sampled = cache_sampled
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._occurrences = Counter()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, response TEXT NOT NULL, last_used INTEGER NOT NULL)"
+        )
+        row = self._conn.execute("SELECT MAX(last_used), COUNT(*) FROM responses").fetchone()
+        self._clock = row[0] or 0
+        # Kept up to date by put() so writes do not scan the table
+        self._count = row[1]
+
+    def key_for(self, payload):
+        """Return the cache key for a request payload, or None if it should not be cached."""
+        request = {
+            "model": payload.get("model"),
+            "messages": payload.get("messages"),
+            "temperature": payload.get("temperature"),
+            "max_tokens": payload.get("max_tokens"),
+        }
+        # Streamed calls cut off by a stop predicate are cached separately
+        if payload.get("stop_when"):
+            request["stop_when"] = payload["stop_when"]
+        digest = hashlib.sha256(
+            json.dumps(request, sort_keys=True, ensure_ascii=False).encode("utf-8")
+        ).hexdigest()
+        if not request["temperature"]:
+            return digest
+        if not self.cache_sampled:
+            return None
+        with self._lock:
+            occurrence = self._occurrences[digest]
+            self._occurrences[digest] += 1
+        return f"{digest}:{occurrence}"
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._clock += 1
+            self._conn.execute(
+                "UPDATE responses SET last_used = ? WHERE key = ?", (self._clock, key)
+            )
+            return row[0]
+
+    def put(self, key, response):
+        with self._lock:
+            self._clock += 1
+            exists = self._conn.execute("SELECT 1 FROM responses WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, response, last_used) VALUES (?, ?, ?)",
+                (key, response, self._clock),
+            )
+            if exists is None:
+                self._count += 1
+            if self._count > self.max_entries:
+                self._evict()
+
+    def _evict(self):
+        # Recount first: other processes (e.g. shards) may share the file
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()
+        if count > self.max_entries:
+            self._conn.execute(
+                "DELETE FROM responses WHERE key IN "
+                "(SELECT key FROM responses ORDER BY last_used ASC LIMIT ?)",
+                (count - self.max_entries,),
+            )
+        self._count = min(count, self.max_entries)
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": len(self),
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
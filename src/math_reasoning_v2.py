@@ -1,26 +1,68 @@
 import re
+import threading
 from collections import Counter
-from src.api import call_llm
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from fractions import Fraction
+from src.api import call_llm, sample_llm, stop_at_line
+from src import tracing
+from src.sandbox import run_code
+from src.tracing import traced
+
+# Stream completions and stop once the answer line is complete
+STOP_AT_FINAL = stop_at_line("FINAL:")
+
+# Wall-clock limit for the program-of-thought check; these are short computations
+PROGRAM_TIMEOUT = 5
+
+PROGRAM_INSTRUCTIONS = (
+    "\n\nAfter the FINAL line, write a short Python program in a ```python block that computes "
+    "the answer from scratch and prints ONLY the final number. You may use math, fractions and sympy."
+)
+
+PLAN_SYSTEM = (
+    "You are a strategic planner. Create a concise, step-by-step plan to solve the math problem. "
+    "Do not solve it yourself. Be direct and avoid unnecessary words."
+)
+
+_log_lock = threading.Lock()
 
 # Debugging log file for tracking the thought process of the model
 def log_to_file(message):
-    with open("src/cot_debug.log", "a") as f:
-        f.write(message + "\n")
+    # Sample chains run in parallel, so keep each message in one piece
+    with _log_lock:
+        with open("src/cot_debug.log", "a") as f:
+            f.write(message + "\n")
 
+@traced("math.generate_plan")
 def generate_plan(question: str, logging: bool = False):
-    system_prompt = (
-        "You are a strategic planner. Create a concise, step-by-step plan to solve the math problem. "
-        "Do not solve it yourself. Be direct and avoid unnecessary words."
-    )
     prompt = f"Question: {question}\nPlan:"
     
     if logging:
         log_to_file(f"\n=== New V2 Run ===\nQuestion: {question}")
-    response = call_llm(prompt, system=system_prompt, temperature=0.7)
+    response = call_llm(prompt, system=PLAN_SYSTEM, temperature=0.7)
     if logging:
         log_to_file(f"\n[Plan]\n{response}\n")
     return response.strip(), 1
 
+@traced("math.generate_plan")
+def generate_plans(question: str, n: int, logging: bool = False):
+    # The chains share the planning prompt, so draw all their plans from one
+    # request. A chain whose plan could not be sampled plans for itself.
+    prompt = f"Question: {question}\nPlan:"
+
+    if logging:
+        log_to_file(f"\n=== New V2 Run ===\nQuestion: {question}")
+    try:
+        responses = sample_llm(prompt, n, system=PLAN_SYSTEM, temperature=0.7)
+    except Exception as e:
+        if logging:
+            log_to_file(f"[Error in Plans] {str(e)}")
+        return [None] * n
+    if logging:
+        for response in responses:
+            log_to_file(f"\n[Plan]\n{response}\n")
+    return [response.strip() for response in responses]
+
 def extract_answer(text: str):
     # Strictly check for FINAL: ... pattern only
     match = re.search(r"FINAL:\s*(.+)", text)
@@ -33,7 +75,8 @@ def extract_answer(text: str):
         
     return "Error: No answer found"
 
-def reason_and_solve(question: str, plan: str, logging: bool = False):
+@traced("math.reason_and_solve")
+def reason_and_solve(question: str, plan: str, logging: bool = False, with_program: bool = False):
     system_prompt = (
         "You are a precise math solver. Follow the plan to solve the problem. "
         "Keep explanations short and to the point. "
@@ -45,16 +88,57 @@ def reason_and_solve(question: str, plan: str, logging: bool = False):
         "Thought: Subtracting 5 from 15 gives 10. Dividing 10 by 2 gives 5.\n"
         "FINAL: 5"
     )
+    if with_program:
+        system_prompt += PROGRAM_INSTRUCTIONS
     prompt = f"Question: {question}\nPlan:\n{plan}\nThought:"
     
-    response = call_llm(prompt, system=system_prompt, temperature=0.7)
+    # The program comes after the FINAL line, so only stop early without it
+    stop_when = None if with_program else STOP_AT_FINAL
+    response = call_llm(prompt, system=system_prompt, temperature=0.7, stop_when=stop_when)
     if logging:
         log_to_file(f"\n[Reason & Solve]\n{response}\n")
     
-    answer = extract_answer(response)
+    answer = extract_answer(re.sub(r"```.*?(```|$)", "", response, flags=re.DOTALL))
     return response, answer, 1
 
-def self_refine(question: str, plan: str, reasoning: str, logging: bool = False):
+def extract_program(response: str):
+    match = re.search(r"```(?:python|py)?\s*\n(.*?)```", response, re.DOTALL)
+    return match.group(1) if match else None
+
+@traced("math.run_program")
+def run_program(response: str, logging: bool = False):
+    """Execute the program in the response in the sandbox; returns the last line it printed, or None."""
+    program = extract_program(response)
+    if program is None:
+        return None
+    result = run_code(program, timeout=PROGRAM_TIMEOUT)
+    if logging:
+        log_to_file(f"\n[Program] {result.status}\n{result.stdout}{result.error or ''}\n")
+    lines = [line.strip() for line in result.stdout.splitlines() if line.strip()]
+    if not result.passed or not lines:
+        return None
+    return lines[-1]
+
+def _as_number(answer: str):
+    # Exact, so huge answers such as 10**400 do not overflow a float
+    text = re.sub(r"[$,\s]", "", answer)
+    try:
+        return Fraction(text)
+    except (ValueError, ZeroDivisionError):
+        return None
+
+def answers_agree(a: str, b: str):
+    """Whether two answers are the same number (or the same text when not numeric)."""
+    if a is None or b is None or "Error" in a or "Error" in b:
+        return False
+    x, y = _as_number(a), _as_number(b)
+    if x is not None and y is not None:
+        # Same tolerance as math.isclose(rel_tol=1e-6, abs_tol=1e-9), in exact arithmetic
+        return abs(x - y) <= max(Fraction(1, 10**6) * max(abs(x), abs(y)), Fraction(1, 10**9))
+    return normalize_answer(a) == normalize_answer(b)
+
+@traced("math.self_refine")
+def self_refine(question: str, plan: str, reasoning: str, logging: bool = False, computed: str = None):
     system_prompt = (
         "You are a rigorous math critic. Review the solution for errors. "
         "If correct, output the same FINAL: <number>. "
@@ -65,45 +149,144 @@ def self_refine(question: str, plan: str, reasoning: str, logging: bool = False)
         "Critique: The steps followed the plan correctly. The arithmetic is accurate.\n"
         "FINAL: 5"
     )
-    prompt = f"Question: {question}\nPlan:\n{plan}\nReasoning:\n{reasoning}\nCritique:"
+    prompt = f"Question: {question}\nPlan:\n{plan}\nReasoning:\n{reasoning}\n"
+    if computed is not None:
+        prompt += f"Running the Python program in the reasoning printed: {computed}\n"
+    prompt += "Critique:"
     
-    response = call_llm(prompt, system=system_prompt, temperature=0.7)
+    response = call_llm(prompt, system=system_prompt, temperature=0.7, stop_when=STOP_AT_FINAL)
     if logging:
         log_to_file(f"\n[Self Refine]\n{response}\n")
     
     answer = extract_answer(response)
     return answer, 1
 
-def solve_math_v2(question: str, samples: int = 3, logging: bool = False):
-    answers = []
-    for _ in range(samples):
-        try:
-            plan, _ = generate_plan(question, logging=logging)
-            reasoning, _, _ = reason_and_solve(question, plan, logging=logging)
-            final_answer, _ = self_refine(question, plan, reasoning, logging=logging)
-            answers.append(final_answer)
-        except Exception as e:
-            if logging:
-                log_to_file(f"[Error in Loop] {str(e)}")
-            continue
-    
+def normalize_answer(answer: str):
+    if "Error" in answer:
+        return None
+    try:
+        val = float(re.sub(r'[^\d.-]', '', answer))
+        if val.is_integer():
+            return str(int(val))
+        return str(val)
+    except ValueError:
+        return answer.strip()
+
+def run_chain(question: str, logging: bool = False, program_of_thought: bool = False, plan: str = None):
+    # A single plan -> solve -> refine chain; each step depends on the previous one
+    if plan is None:
+        plan, _ = generate_plan(question, logging=logging)
+    reasoning, answer, _ = reason_and_solve(question, plan, logging=logging, with_program=program_of_thought)
+    computed = None
+    if program_of_thought:
+        # An executed computation that agrees with the reasoning replaces the critique
+        computed = run_program(reasoning, logging=logging)
+        if answers_agree(answer, computed):
+            return answer
+    final_answer, _ = self_refine(question, plan, reasoning, logging=logging, computed=computed)
+    return final_answer
+
+def solve_math_v2(
+    question: str,
+    samples: int = 3,
+    logging: bool = False,
+    adaptive: bool = False,
+    agreement: int = 2,
+    max_samples: int = 6,
+    program_of_thought: bool = False,
+):
+    if adaptive:
+        return solve_math_adaptive(
+            question, agreement=agreement, max_samples=max_samples, logging=logging,
+            program_of_thought=program_of_thought,
+        )
+
+    answers = {}
+    # The sample chains are independent, so run them all at once and
+    # collect each answer as its chain finishes.
+    plans = generate_plans(question, samples, logging=logging) if samples > 1 else [None] * samples
+    with ThreadPoolExecutor(max_workers=max(1, samples)) as executor:
+        futures = {
+            tracing.submit(executor, run_chain, question, logging, program_of_thought, plan): i
+            for i, plan in enumerate(plans)
+        }
+        for future in as_completed(futures):
+            try:
+                answers[futures[future]] = future.result()
+            except Exception as e:
+                if logging:
+                    log_to_file(f"[Error in Loop] {str(e)}")
+
     if not answers:
         return "Error: No answers generated"
-        
-    # Normalize and vote
-    normalized_answers = []
-    for a in answers:
-        if "Error" in a: continue
-        try:
-            val = float(re.sub(r'[^\d.-]', '', a))
-            if val.is_integer():
-                normalized_answers.append(str(int(val)))
-            else:
-                normalized_answers.append(str(val))
-        except ValueError:
-            normalized_answers.append(a.strip())
-            
-    if not normalized_answers:
-        return answers[0] if answers else "Error"
-            
-    return Counter(normalized_answers).most_common(1)[0][0]
+    return majority_vote(answers)
+
+def majority_vote(answers: dict):
+    """The most common normalized answer of {sample index: final answer}.
+
+    Ties go to the answer first given by the lowest sample index, not by the
+    chain that happened to finish first, so repeated runs agree. Without any
+    normalizable answer, the answer of the lowest sample index is returned.
+    """
+    votes, first = Counter(), {}
+    for index in sorted(answers):
+        normalized = normalize_answer(answers[index])
+        if normalized is not None:
+            votes[normalized] += 1
+            first.setdefault(normalized, index)
+    if not votes:
+        return answers[min(answers)]
+    return min(votes, key=lambda answer: (-votes[answer], first[answer]))
+
+def solve_math_adaptive(
+    question: str, agreement: int = 2, max_samples: int = 6, logging: bool = False, program_of_thought: bool = False
+):
+    # Launch only as many chains as could still produce `agreement` matching
+    # answers, and stop as soon as one answer gets there. Hard problems keep
+    # sampling until the `max_samples` budget is spent.
+    answers = {}
+    votes = Counter()
+    launched = 0
+    pending = {}
+    first_batch = max(0, min(agreement, max_samples))
+    executor = ThreadPoolExecutor(max_workers=max(1, first_batch))
+    # The first batch always runs, so sample its plans together
+    plans = generate_plans(question, first_batch, logging=logging) if first_batch > 1 else []
+
+    def top_up():
+        nonlocal launched
+        leader = votes.most_common(1)[0][1] if votes else 0
+        while len(pending) < agreement - leader and launched < max_samples:
+            plan = plans.pop(0) if plans else None
+            pending[tracing.submit(executor, run_chain, question, logging, program_of_thought, plan)] = launched
+            launched += 1
+
+    try:
+        top_up()
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                index = pending.pop(future)
+                try:
+                    final_answer = future.result()
+                except Exception as e:
+                    if logging:
+                        log_to_file(f"[Error in Loop] {str(e)}")
+                    continue
+                answers[index] = final_answer
+                normalized = normalize_answer(final_answer)
+                if normalized is not None:
+                    votes[normalized] += 1
+            if votes and votes.most_common(1)[0][1] >= agreement:
+                break
+            top_up()
+    finally:
+        # Any chain still running is no longer needed
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    if logging:
+        log_to_file(f"[Adaptive Vote] {launched} chains, votes: {dict(votes)}")
+
+    if not answers:
+        return "Error: No answers generated"
+    return majority_vote(answers)
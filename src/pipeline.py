@@ -0,0 +1,246 @@
+"""Run many questions through their solver stages at once.
+
+A solver is described as a list of Stages: the function, the earlier results
+it takes as arguments, an optional condition, and its retry and timeout
+policy. A Pipeline keeps one job per question, first runs the routing stage
+and then the stage graph of the question's domain, and starts every stage
+whose inputs are ready. Stages from all active questions share two thread
+pools: "llm" stages, which mostly wait on the inference server, and "cpu"
+stages (parsing, local search, formatting, sandbox runs), so the LLM queue
+stays full while local work runs alongside it. When several stages are
+ready, those of the question admitted first go first, so answers keep
+arriving in a steady stream.
+
+A stage's result is stored under its name; "question" and "domain" are
+always available as inputs. A stage whose `when` condition is false is
+skipped and its result is None. The answer is the result of the last stage
+in the list that ran. A stage that still fails after its retries, or runs
+past its timeout, ends the question with "Error: ...", like the solvers do,
+unless it is `optional`: then its result is None, so a later stage
+conditioned on that (e.g. the draft plan when search found nothing) takes
+over as its fallback.
+
+LLM stages use LLM_STAGE_TIMEOUT per request they make in sequence, the
+HTTP timeout of a request in src/api.py, and LLM_STAGE_RETRIES more
+attempts.
+"""
+
+import heapq
+import itertools
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+from src import tracing
+
+PIPELINE_LLM_WORKERS = int(os.getenv("PIPELINE_LLM_WORKERS", "32"))
+PIPELINE_CPU_WORKERS = int(os.getenv("PIPELINE_CPU_WORKERS", str(os.cpu_count() or 4)))
+LLM_STAGE_TIMEOUT = float(os.getenv("PIPELINE_LLM_STAGE_TIMEOUT", "60"))
+LLM_STAGE_RETRIES = int(os.getenv("PIPELINE_LLM_STAGE_RETRIES", "1"))
+
+class Stage(NamedTuple):
+    name: str
+    fn: Callable[..., Any]
+    inputs: Tuple[str, ...] = ("question",)
+    # Stages that must be settled first without being passed in, e.g. for `when`
+    after: Tuple[str, ...] = ()
+    # Called with the results so far; the stage is skipped when it returns False
+    when: Optional[Callable[[Dict[str, Any]], bool]] = None
+    pool: str = "llm"  # "llm" or "cpu"
+    retries: int = 0
+    timeout: Optional[float] = None
+    # Settle as None instead of ending the question when the stage fails
+    optional: bool = False
+
+
+class _Job:
+    def __init__(self, key, order, question):
+        self.key = key
+        self.order = order
+        self.domain = None
+        self.stages: List[Stage] = []
+        self.results: Dict[str, Any] = {"question": question}
+        self.settled = {"question"}
+        self.ran = set()
+        self.queued = set()
+        self.attempts: Dict[str, int] = {}
+        self.answer = None
+        self.done = False
+
+
+class Pipeline:
+    """Interleaves the stages of many questions over an LLM pool and a CPU pool.
+
+    `route` is a stage that returns the question's domain, which selects its
+    graph from `graphs`; unknown domains use the `default` graph.
+    """
+
+    def __init__(
+        self,
+        route: Stage,
+        graphs: Dict[str, Sequence[Stage]],
+        default: str,
+        llm_workers: int = None,
+        cpu_workers: int = None,
+        max_active: int = None,
+    ):
+        self.route = route
+        self.graphs = graphs
+        self.default = default
+        self.workers = {
+            "llm": max(1, llm_workers or PIPELINE_LLM_WORKERS),
+            "cpu": max(1, cpu_workers or PIPELINE_CPU_WORKERS),
+        }
+        # Enough questions in flight to keep both pools busy
+        self.max_active = max_active or 2 * (self.workers["llm"] + self.workers["cpu"])
+
+    def run(
+        self,
+        items: Iterable[Tuple[Any, str]],
+        on_done: Callable[[Any, str], None] = None,
+    ) -> Dict[Any, str]:
+        """Solve (key, question) pairs, admitted in the given order.
+
+        on_done(key, answer) is called from this thread as each question
+        finishes; the answers are also returned keyed by `key`.
+        """
+        waiting = iter(items)
+        order = itertools.count()
+        seq = itertools.count()
+        ready = {pool: [] for pool in self.workers}
+        busy = {pool: 0 for pool in self.workers}
+        running = {}  # future -> (job, stage, deadline); job is None once abandoned
+        active = 0
+        answers = {}
+        pools = {
+            pool: ThreadPoolExecutor(max_workers=n, thread_name_prefix=f"pipeline-{pool}")
+            for pool, n in self.workers.items()
+        }
+
+        def finish(job, answer):
+            nonlocal active
+            job.done = True
+            job.answer = answer
+            active -= 1
+            answers[job.key] = answer
+            if on_done is not None:
+                on_done(job.key, answer)
+
+        def enqueue(job, stage):
+            job.queued.add(stage.name)
+            heapq.heappush(ready[stage.pool], (job.order, next(seq), job, stage))
+
+        def advance(job):
+            # Skip stages whose condition is false and queue the ones that can run
+            progress = True
+            while progress and not job.done:
+                progress = False
+                for stage in job.stages:
+                    if stage.name in job.settled or stage.name in job.queued:
+                        continue
+                    if not all(name in job.settled for name in stage.inputs + stage.after):
+                        continue
+                    if stage.when is not None and not stage.when(job.results):
+                        job.results[stage.name] = None
+                        job.settled.add(stage.name)
+                        progress = True
+                    else:
+                        enqueue(job, stage)
+            if job.done:
+                return
+            if all(stage.name in job.settled for stage in job.stages):
+                last = [stage for stage in job.stages if stage.name in job.ran]
+                finish(job, job.results[last[-1].name] if last else "Error: No stage ran")
+            elif not job.queued:
+                # Left with stages whose inputs no stage produces
+                finish(job, f"Error: Stage graph for {job.domain} cannot make progress")
+
+        def settle(job, stage, result):
+            job.queued.discard(stage.name)
+            if stage is self.route:
+                job.domain = result if result in self.graphs else self.default
+                job.results["domain"] = job.domain
+                job.settled.add("domain")
+                job.stages = list(self.graphs[job.domain])
+            else:
+                job.results[stage.name] = result
+                job.settled.add(stage.name)
+                job.ran.add(stage.name)
+            advance(job)
+
+        def fail(job, stage, error):
+            attempts = job.attempts.get(stage.name, 0) + 1
+            job.attempts[stage.name] = attempts
+            if attempts <= stage.retries:
+                enqueue(job, stage)
+            elif stage.optional:
+                job.queued.discard(stage.name)
+                job.results[stage.name] = None
+                job.settled.add(stage.name)
+                advance(job)
+            else:
+                finish(job, f"Error: {error}")
+
+        def admit():
+            nonlocal active
+            while active < self.max_active:
+                item = next(waiting, None)
+                if item is None:
+                    return
+                key, question = item
+                active += 1
+                job = _Job(key, next(order), question)
+                enqueue(job, self.route)
+
+        try:
+            admit()
+            while True:
+                for pool, heap in ready.items():
+                    while heap and busy[pool] < self.workers[pool]:
+                        _, _, job, stage = heapq.heappop(heap)
+                        if job.done:
+                            continue
+                        args = [job.results[name] for name in stage.inputs]
+                        future = pools[pool].submit(self._call, job, stage, args)
+                        deadline = time.monotonic() + stage.timeout if stage.timeout else None
+                        running[future] = (job, stage, deadline)
+                        busy[pool] += 1
+                # Stages abandoned after a timeout do not keep the run going
+                queued = any(not job.done for heap in ready.values() for _, _, job, _ in heap)
+                if not queued and all(job is None for job, _, _ in running.values()):
+                    break
+
+                deadlines = [d for job, _, d in running.values() if job is not None and d is not None]
+                timeout = max(0.0, min(deadlines) - time.monotonic()) if deadlines else None
+                finished, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    job, stage, _ = running.pop(future)
+                    busy[stage.pool] -= 1
+                    if job is None or job.done:
+                        continue
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        fail(job, stage, e)
+                    else:
+                        settle(job, stage, result)
+
+                now = time.monotonic()
+                for future, (job, stage, deadline) in list(running.items()):
+                    if job is not None and deadline is not None and now >= deadline:
+                        # The thread cannot be stopped; keep its slot until it
+                        # returns but ignore the result
+                        running[future] = (None, stage, None)
+                        if not job.done:
+                            fail(job, stage, TimeoutError(f"Stage {stage.name} timed out after {stage.timeout:g} seconds"))
+                admit()
+        finally:
+            for pool in pools.values():
+                pool.shutdown(wait=False, cancel_futures=True)
+        return answers
+
+    def _call(self, job, stage, args):
+        name = f"pipeline.{job.domain}.{stage.name}" if job.domain else f"pipeline.{stage.name}"
+        with tracing.question(job.key), tracing.stage(name):
+            return stage.fn(*args)
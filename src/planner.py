@@ -0,0 +1,235 @@
+"""Heuristic search planner for the STRIPS problems parsed by src/strips.py.
+
+Actions are grounded by joining their preconditions against the facts that
+are reachable from the initial state (ignoring delete effects), and indexed
+by precondition. Search is A* guided by the FF heuristic (the size of a
+relaxed plan extracted from h_add best supporters), followed by a much
+greedier weighted A* if the first search runs out of budget.
+"""
+
+import heapq
+import itertools
+import time
+from collections import defaultdict
+from typing import List, NamedTuple, Optional
+
+from src.strips import Problem, Step, ground
+
+
+class GroundAction(NamedTuple):
+    step: Step
+    pre: frozenset
+    neg_pre: frozenset
+    add: frozenset
+    delete: frozenset
+
+
+def _argument_values(problem: Problem):
+    """The objects seen at each (predicate, position) in the initial state and goal."""
+    values = defaultdict(set)
+    for name, args in list(problem.init) + list(problem.goal):
+        for i, arg in enumerate(args):
+            values[(name, i)].add(arg)
+    return values
+
+
+def _free_candidates(action, param, values, objects):
+    """Objects an unconstrained parameter may take.
+
+    A parameter no precondition mentions would otherwise range over every
+    object, e.g. the destination of a drive over packages. Each effect or
+    negative precondition using it restricts it to the objects found in that
+    predicate position; positions never seen restrict nothing.
+    """
+    allowed = None
+    for name, args in action.add + action.delete + action.neg_pre:
+        for i, arg in enumerate(args):
+            if arg == param and values.get((name, i)):
+                allowed = values[(name, i)] if allowed is None else allowed & values[(name, i)]
+    return list(objects) if allowed is None else [obj for obj in objects if obj in allowed]
+
+
+def _bindings(action, facts_by_pred, candidates):
+    """Yield every parameter binding whose positive preconditions are all in the fact set.
+
+    `candidates` maps each parameter to the objects it may take when no
+    precondition binds it.
+    """
+    pre = sorted(action.pre, key=lambda atom: len(facts_by_pred.get(atom[0], ())))
+
+    def extend(i, binding):
+        if i == len(pre):
+            free = [p for p in action.params if p not in binding]
+            for values in itertools.product(*(candidates[p] for p in free)):
+                yield {**binding, **dict(zip(free, values))}
+            return
+        name, args = pre[i]
+        for fact_args in facts_by_pred.get(name, ()):
+            if len(fact_args) != len(args):
+                continue
+            new = dict(binding)
+            for arg, value in zip(args, fact_args):
+                if arg in action.params:
+                    if new.setdefault(arg, value) != value:
+                        break
+                elif arg != value:
+                    break
+            else:
+                yield from extend(i + 1, new)
+
+    yield from extend(0, {})
+
+
+def ground_actions(problem: Problem) -> List[GroundAction]:
+    """Ground the actions reachable from the initial state under the delete relaxation."""
+    reachable = set(problem.init)
+    grounded = {}
+    values = _argument_values(problem)
+    candidates = {
+        action.name: {p: _free_candidates(action, p, values, problem.objects) for p in action.params}
+        for action in problem.actions.values()
+    }
+    changed = True
+    while changed:
+        changed = False
+        facts_by_pred = defaultdict(list)
+        for name, args in reachable:
+            facts_by_pred[name].append(args)
+        for action in problem.actions.values():
+            for binding in _bindings(action, facts_by_pred, candidates[action.name]):
+                step = (action.name, tuple(binding[p] for p in action.params))
+                if step in grounded:
+                    continue
+                add = frozenset(ground(action.add, binding))
+                grounded[step] = GroundAction(
+                    step,
+                    frozenset(ground(action.pre, binding)),
+                    frozenset(ground(action.neg_pre, binding)),
+                    add,
+                    frozenset(ground(action.delete, binding)) - add,
+                )
+                if not add <= reachable:
+                    reachable |= add
+                    changed = True
+    return list(grounded.values())
+
+
+class _Heuristic:
+    """FF heuristic over actions indexed by precondition."""
+
+    def __init__(self, actions, goal):
+        self.actions = actions
+        self.goal = goal
+        self.by_pre = defaultdict(list)
+        self.no_pre = []
+        for i, action in enumerate(actions):
+            if action.pre:
+                for fact in action.pre:
+                    self.by_pre[fact].append(i)
+            else:
+                self.no_pre.append(i)
+
+    def __call__(self, state):
+        cost = {fact: 0 for fact in state}
+        supporter = {}
+        remaining = {}
+        heap = [(0, fact) for fact in state]
+        ready = list(self.no_pre)
+        while heap or ready:
+            for i in ready:
+                action = self.actions[i]
+                c = sum(cost[p] for p in action.pre) + 1
+                for fact in action.add:
+                    if c < cost.get(fact, float("inf")):
+                        cost[fact] = c
+                        supporter[fact] = i
+                        heapq.heappush(heap, (c, fact))
+            ready = []
+            if not heap:
+                break
+            c, fact = heapq.heappop(heap)
+            if c > cost[fact]:
+                continue
+            for i in self.by_pre.get(fact, ()):
+                left = remaining.get(i, len(self.actions[i].pre)) - 1
+                remaining[i] = left
+                if left == 0:
+                    ready.append(i)
+
+        if any(g not in cost for g in self.goal):
+            return None
+        # Extract a relaxed plan by following best supporters back from the goals
+        relaxed_plan = set()
+        stack = [g for g in self.goal if cost[g] > 0]
+        seen = set()
+        while stack:
+            fact = stack.pop()
+            if fact in seen:
+                continue
+            seen.add(fact)
+            i = supporter[fact]
+            if i not in relaxed_plan:
+                relaxed_plan.add(i)
+                stack.extend(p for p in self.actions[i].pre if cost[p] > 0)
+        return len(relaxed_plan)
+
+
+def _search(problem, actions, heuristic, weight, max_expansions, deadline):
+    by_first_pre = defaultdict(list)
+    always = []
+    for action in actions:
+        if action.pre:
+            by_first_pre[min(action.pre)].append(action)
+        else:
+            always.append(action)
+
+    goal = frozenset(problem.goal)
+    start = frozenset(problem.init)
+    h = heuristic(start)
+    if h is None:
+        return None
+    counter = itertools.count()
+    heap = [(weight * h, next(counter), 0, start)]
+    parents = {start: (None, None)}
+    best_g = {start: 0}
+    expansions = 0
+    while heap:
+        _, _, g, state = heapq.heappop(heap)
+        if g > best_g[state]:
+            continue
+        if goal <= state:
+            steps = []
+            while parents[state][0] is not None:
+                state, step = parents[state]
+                steps.append(step)
+            return steps[::-1]
+        expansions += 1
+        if expansions > max_expansions or time.monotonic() > deadline:
+            return None
+        candidates = always + [a for fact in state for a in by_first_pre.get(fact, ())]
+        for action in candidates:
+            if not action.pre <= state or action.neg_pre & state:
+                continue
+            child = (state - action.delete) | action.add
+            if g + 1 >= best_g.get(child, float("inf")):
+                continue
+            h = heuristic(child)
+            if h is None:
+                continue
+            best_g[child] = g + 1
+            parents[child] = (state, action.step)
+            heapq.heappush(heap, (g + 1 + weight * h, next(counter), g + 1, child))
+    return None
+
+
+def find_plan(problem: Problem, max_expansions: int = 20000, time_limit: float = 10.0) -> Optional[List[Step]]:
+    """Search for a plan; returns None if none is found within the budget."""
+    deadline = time.monotonic() + time_limit
+    actions = ground_actions(problem)
+    heuristic = _Heuristic(actions, frozenset(problem.goal))
+    # A* with the FF heuristic first for short plans, then a greedier search
+    for weight in (1.0, 5.0):
+        steps = _search(problem, actions, heuristic, weight, max_expansions, deadline)
+        if steps is not None:
+            return steps
+    return None
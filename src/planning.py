@@ -1,10 +1,18 @@
+import itertools
+import re
+
 from src.api import call_llm
+from src.pipeline import LLM_STAGE_RETRIES, LLM_STAGE_TIMEOUT, Stage
+from src.tracing import traced
+from src.strips import FILLER_WORDS, parse_problem, parse_plan, read_plan_steps, simulate, describe_failure, format_step
+from src.planner import find_plan
 
 # Debugging log file for tracking the thought process of the model
 def log_to_file(message):
     with open("src/cot_debug.log", "a") as f:
         f.write(message + "\n")
 
+@traced("planning.extract_and_normalize")
 def extract_and_normalize(problem: str, logging: bool = False):
     system_prompt = (
         "You are an expert planning problem extractor. "
@@ -37,6 +45,7 @@ def extract_and_normalize(problem: str, logging: bool = False):
         log_to_file(f"\n[Normalized Problem]\n{response}")
     return response
 
+@traced("planning.generate_draft_plan")
 def generate_draft_plan(normalized_problem: str, logging: bool = False):
     system_prompt = (
         "You are a strategic planner. Generate a plan to solve the problem starting from the initial state. "
@@ -59,7 +68,7 @@ def generate_draft_plan(normalized_problem: str, logging: bool = False):
         log_to_file(f"\n[Draft Plan]\n{response}\n")
     return response
 
-def validate_and_repair(normalized_problem: str, draft_plan: str, logging: bool = False):
+def _llm_validate_and_repair(normalized_problem: str, draft_plan: str, logging: bool = False):
     system_prompt = (
         "You are a rigorous plan validator and repairer. "
         "Simulate the plan step by step against the problem definition. "
@@ -76,13 +85,93 @@ def validate_and_repair(normalized_problem: str, draft_plan: str, logging: bool
         "Please simulate and repair the plan. Output the final plan in the same format."
     )
     
-    if logging:
-        log_to_file(f"\n[Step 3: Validate and Repair]")
     response = call_llm(prompt, system=system_prompt, temperature=0.0, timeout=120, max_tokens=2048)
     if logging:
         log_to_file(f"\n[Validated Plan]\n{response}\n")
     return response
 
+@traced("planning.repair_plan")
+def repair_plan(normalized_problem: str, plan_steps: list, failure: str, logging: bool = False):
+    system_prompt = (
+        "You are a rigorous plan repairer. A simulator has checked the plan and found the exact problem. "
+        "Fix it by inserting, removing or reordering steps, using ONLY actions from the ACTIONS list "
+        "and objects from the INITIAL STATE. Keep the steps that already work. "
+        "Output the FINAL REPAIRED PLAN."
+    )
+    plan_text = "\n".join(format_step(step) for step in plan_steps)
+    prompt = (
+        f"Problem Definition:\n{normalized_problem}\n\n"
+        f"Current Plan:\n{plan_text}\n\n"
+        f"Simulator Report:\n{failure}\n\n"
+        "Please repair the plan. Format your output as:\n"
+        "PLAN:\n"
+        "action1 arg1 arg2\n"
+        "action2 arg1\n"
+        "..."
+    )
+    
+    response = call_llm(prompt, system=system_prompt, temperature=0.0, timeout=120, max_tokens=2048)
+    if logging:
+        log_to_file(f"\n[Simulator Report]\n{failure}\n\n[Repaired Plan]\n{response}\n")
+    return response
+
+@traced("planning.validate_and_repair")
+def validate_and_repair(normalized_problem: str, draft_plan: str, logging: bool = False, max_repairs: int = 2):
+    if logging:
+        log_to_file(f"\n[Step 3: Validate and Repair]")
+
+    # Simulate locally when the problem and plan can be parsed; the LLM is
+    # then only asked to repair a plan with a known, concrete violation.
+    problem = parse_problem(normalized_problem)
+    steps = parse_plan(draft_plan, problem) if problem is not None else None
+    if steps is None:
+        return _llm_validate_and_repair(normalized_problem, draft_plan, logging=logging)
+
+    for attempt in range(max_repairs + 1):
+        result = simulate(problem, steps)
+        if result.valid or attempt == max_repairs:
+            break
+        repaired = repair_plan(normalized_problem, steps, describe_failure(steps, result), logging=logging)
+        repaired_steps = parse_plan(repaired, problem)
+        if repaired_steps is None:
+            return repaired
+        steps = repaired_steps
+
+    validated_plan = "PLAN:\n" + "\n".join(format_step(step) for step in steps)
+    if logging:
+        log_to_file(f"\n[Validated Plan] (simulator: {'valid' if result.valid else result.reason})\n{validated_plan}\n")
+    return validated_plan
+
+# The part of the question that lists the available actions
+_ACTION_LIST_RE = re.compile(
+    r"actions (?:I can do|that can be performed)\W*(.*?)"
+    r"(?:I have the following restrictions|The following are the restrictions|\[STATEMENT\]|$)",
+    re.I | re.S,
+)
+
+def known_actions(normalized_problem: str, question: str = ""):
+    """Names a plan step may use: the actions of the normalized problem, or
+    else the words of the question's action list."""
+    problem = parse_problem(normalized_problem)
+    if problem is not None:
+        return {re.sub(r"[-_]", "", name) for name in problem.actions}
+    match = _ACTION_LIST_RE.search(question)
+    if match is None:
+        return set()
+    return {word for word in re.findall(r"[a-z]+", match.group(1).lower()) if word not in FILLER_WORDS}
+
+def format_plan_locally(validated_plan: str, actions):
+    """Format the plan as `(action arg1 arg2)` lines without the LLM, or return None.
+
+    Every step must name one of `actions` (see known_actions()), so trailing
+    prose such as "Done." is left to the LLM formatter.
+    """
+    steps = read_plan_steps(validated_plan, actions)
+    if steps is None:
+        return None
+    return "\n".join(f"({format_step(step)})" for step in steps)
+
+@traced("planning.format_plan")
 def format_plan(validated_plan: str, logging: bool = False):
     system_prompt = (
         "You are a plan formatter. Format the plan exactly as required. "
@@ -105,6 +194,7 @@ def format_plan(validated_plan: str, logging: bool = False):
         log_to_file(f"\n[Formatted Plan]\n{response}\n")
     return response
 
+@traced("planning.force_final_cleaning")
 def force_final_cleaning(formatted_plan: str):
     system_prompt = (
         "You are a strict cleaner. Return ONLY the action lines in parentheses. "
@@ -115,22 +205,112 @@ def force_final_cleaning(formatted_plan: str):
     response = call_llm(prompt, system=system_prompt, temperature=0.0, timeout=60, max_tokens=1000)
     return response.strip()
 
+# "A depot is a type of place"
+_TYPE_OF_RE = re.compile(r"\b([a-z]+) is an? (?:type|kind) of ([a-z]+)", re.I)
+
+def _object_type(name: str):
+    # Numbered objects carry their type: truck0, depot1
+    match = re.fullmatch(r"([a-z]+)\d+", name)
+    return match.group(1) if match else None
+
+def _action_types(question: str, problem):
+    """The argument types of each action as stated in the question's action list.
+
+    Each action's sentence ("Drive a truck from one place to another place")
+    names its argument types, though not necessarily in parameter order.
+    Actions whose sentence does not name exactly one type per parameter are
+    left out.
+    """
+    match = _ACTION_LIST_RE.search(question)
+    if match is None:
+        return {}, {}
+    parents = {sub.lower(): sup.lower() for sub, sup in _TYPE_OF_RE.findall(question)}
+    types = set(parents) | set(parents.values())
+    types |= {t for t in map(_object_type, problem.objects) if t}
+    text = match.group(1).lower()
+    starts = sorted(
+        (found.start(), name) for name in problem.actions
+        for found in [re.search(rf"\b{re.escape(name)}\b", text)] if found
+    )
+    signatures = {}
+    for (start, name), (end, _) in zip(starts, starts[1:] + [(len(text), None)]):
+        words = [word for word in re.findall(r"[a-z]+", text[start:end]) if word in types and word != name]
+        if len(words) == len(problem.actions[name].params):
+            signatures[name] = tuple(words)
+    return signatures, parents
+
+def _is_a(kind: str, wanted: str, parents) -> bool:
+    seen = set()
+    while kind is not None and kind not in seen:
+        if kind == wanted:
+            return True
+        seen.add(kind)
+        kind = parents.get(kind)
+    return False
+
+def type_mismatch(question: str, problem, steps):
+    """The first step whose arguments fit no order of its action's stated types, or None."""
+    signatures, parents = _action_types(question, problem)
+    for step in steps:
+        name, args = step
+        if name not in signatures:
+            continue
+        kinds = [_object_type(arg) for arg in args]
+        if not any(
+            all(kind is None or _is_a(kind, wanted, parents) for kind, wanted in zip(kinds, order))
+            for order in itertools.permutations(signatures[name])
+        ):
+            return step
+    return None
+
+@traced("planning.search_plan")
+def search_plan(normalized_problem: str, question: str = "", logging: bool = False):
+    # Solve the normalized problem locally; None means fall back to the LLM
+    problem = parse_problem(normalized_problem)
+    if problem is None:
+        return None
+    steps = find_plan(problem)
+    if logging:
+        log_to_file(f"\n[Step 2: Search Plan]\n{'no plan found' if steps is None else len(steps)}")
+    if steps is None:
+        return None
+    # The normalized problem may have dropped the question's types
+    mismatch = type_mismatch(question, problem, steps)
+    if mismatch is not None:
+        if logging:
+            log_to_file(f"[Search Plan] `{format_step(mismatch)}` contradicts the question's types")
+        return None
+    return "PLAN:\n" + "\n".join(format_step(step) for step in steps)
+
+def _clean_plan(formatted_plan: str, actions):
+    final_plan = format_plan_locally(formatted_plan, actions)
+    if final_plan is None:
+        final_plan = force_final_cleaning(formatted_plan)
+    return final_plan
+
 def solve_planning_problem(question: str, logging: bool = False):
     try:
         # Step 1: Extract and Normalize
         normalized_problem = extract_and_normalize(question, logging=logging)
         
-        # Step 2: Generate Draft Plan
-        draft_plan = generate_draft_plan(normalized_problem, logging=logging)
-        
-        # Step 3: Validate and Repair
-        validated_plan = validate_and_repair(normalized_problem, draft_plan, logging=logging)
-        
-        # Step 4: Format
-        formatted_plan = format_plan(validated_plan, logging=logging)
+        # Step 2: Search for a plan locally, which is valid by construction
+        validated_plan = search_plan(normalized_problem, question, logging=logging)
+
+        if validated_plan is None:
+            # Step 2b: Generate Draft Plan
+            draft_plan = generate_draft_plan(normalized_problem, logging=logging)
+            
+            # Step 3: Validate and Repair
+            validated_plan = validate_and_repair(normalized_problem, draft_plan, logging=logging)
         
-        # Step 5: Final Cleaning
-        final_plan = force_final_cleaning(formatted_plan)
+        # Step 4: Format locally, falling back to the LLM formatter
+        actions = known_actions(normalized_problem, question)
+        final_plan = format_plan_locally(validated_plan, actions)
+        if final_plan is None:
+            formatted_plan = format_plan(validated_plan, logging=logging)
+            
+            # Step 5: Final Cleaning, only when the LLM output is still not clean
+            final_plan = _clean_plan(formatted_plan, actions)
         
         return final_plan
         
@@ -138,3 +318,42 @@ def solve_planning_problem(question: str, logging: bool = False):
         if logging:
             log_to_file(f"[Error] {str(e)}")
         return f"Error: {str(e)}"
+
+# Pipeline limit for the local search: find_plan() stops itself after its
+# two searches, so this only guards against a blow-up while grounding
+SEARCH_TIMEOUT = 30
+
+def planning_stages():
+    """solve_planning_problem() as pipeline stages, see src/pipeline.py."""
+    # The plan found by search, or else the repaired LLM draft
+    def chosen(found, repaired):
+        return found if found is not None else repaired
+
+    not_found = lambda r: r["search"] is None
+    not_formatted = lambda r: r["format_locally"] is None
+    llm = dict(retries=LLM_STAGE_RETRIES, timeout=LLM_STAGE_TIMEOUT)
+    return [
+        Stage("normalize", extract_and_normalize, ("question",), **llm),
+        # A search that fails or runs long leaves the problem to the LLM draft
+        Stage("search", search_plan, ("normalize", "question"), pool="cpu", timeout=SEARCH_TIMEOUT, optional=True),
+        Stage("actions", known_actions, ("normalize", "question"), pool="cpu"),
+        Stage("draft", generate_draft_plan, ("normalize",), after=("search",), when=not_found, **llm),
+        Stage(
+            "repair", validate_and_repair, ("normalize", "draft"), after=("search",), when=not_found,
+            retries=LLM_STAGE_RETRIES, timeout=LLM_STAGE_TIMEOUT * 2,  # Up to two repair requests
+        ),
+        Stage(
+            "format_locally",
+            lambda found, repaired, actions: format_plan_locally(chosen(found, repaired), actions),
+            ("search", "repair", "actions"), pool="cpu",
+        ),
+        Stage(
+            "format", lambda found, repaired: format_plan(chosen(found, repaired)),
+            ("search", "repair"), after=("format_locally",), when=not_formatted, **llm,
+        ),
+        Stage(
+            "clean", _clean_plan, ("format", "actions"), after=("format_locally",), when=not_formatted, pool="cpu",
+            **llm,  # May call the LLM cleaner
+        ),
+    ]
+
@@ -0,0 +1,55 @@
+import random
+import threading
+import time
+
+# HTTP statuses worth retrying: rate limiting and transient server errors
+RETRY_STATUSES = {408, 429, 500, 502, 503, 504}
+
+
+class RetryPolicy:
+    """Exponential backoff with full jitter, honouring Retry-After when the server sends one."""
+
+    def __init__(self, max_retries=4, backoff_base=1.0, backoff_max=30.0):
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+    def delay(self, attempt, retry_after=None):
+        if retry_after is not None:
+            try:
+                return min(float(retry_after), self.backoff_max)
+            except ValueError:
+                pass
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+
+class TokenBucket:
+    """Client-side rate limiter allowing `rate` requests per second with bursts up to `burst`.
+
+    reserve() takes a token and returns how long the caller must wait before
+    using it, so the same bucket works for blocking and async callers.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1.0, rate)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        if not self.rate:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    def acquire(self):
+        delay = self.reserve()
+        if delay:
+            time.sleep(delay)
@@ -0,0 +1,147 @@
+"""Run generated code in a separate, resource-limited Python process.
+
+Each run gets a fresh interpreter (`python -I`) in a temporary directory with
+CPU time, address space and wall-clock limits, so a crashing, looping or
+memory-hungry candidate cannot take the solver down with it. The candidate is
+executed first, then each example statement in a copy of its namespace; what
+the code and every example print is returned so callers can compare it with
+the expected output. At most SANDBOX_WORKERS processes run at once across
+all solver threads, and run_many() spreads a batch of jobs over them.
+
+These limits do not isolate the code from the network or the filesystem, so
+running model-written code is opt-in: nothing is executed unless
+SANDBOX_ENABLED is set or configure() enables it. Until then every run is
+"unavailable", which callers treat as inconclusive.
+"""
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, NamedTuple, Optional, Sequence
+
+SANDBOX_WORKERS = int(os.getenv("SANDBOX_WORKERS", str(os.cpu_count() or 4)))
+SANDBOX_TIMEOUT = float(os.getenv("SANDBOX_TIMEOUT", "10"))
+SANDBOX_MEMORY_MB = int(os.getenv("SANDBOX_MEMORY_MB", "2048"))
+SANDBOX_ENABLED = os.getenv("SANDBOX_ENABLED", "").lower() in {"1", "true", "yes"}
+
+_slots = threading.BoundedSemaphore(SANDBOX_WORKERS)
+
+# Runs inside the child process. Reads {"code", "examples", "cpu_seconds",
+# "memory_mb"} from stdin and prints a JSON result as the last line of stdout.
+# The limits are set here rather than in a preexec_fn, which can deadlock
+# when the parent has other threads running.
+_HARNESS = r'''
+import contextlib, io, json, sys, traceback
+job = json.loads(sys.stdin.read())
+try:
+    import resource
+except ImportError:  # Not available on Windows: only the wall-clock timeout applies
+    pass
+else:
+    resource.setrlimit(resource.RLIMIT_CPU, (job["cpu_seconds"], job["cpu_seconds"] + 1))
+    limit = job["memory_mb"] * 1024 * 1024
+    resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+result = {"error": None, "inconclusive": False, "outputs": [], "stdout": ""}
+namespace = {"__name__": "__sandbox__"}
+out = io.StringIO()
+try:
+    try:
+        with contextlib.redirect_stdout(out):
+            exec(compile(job["code"], "<solution>", "exec"), namespace)
+    finally:
+        result["stdout"] = out.getvalue()[-10000:]
+    # Like doctest, examples get their own globals so `string = task_func()`
+    # cannot shadow a module the solution uses
+    examples = dict(namespace)
+    for source in job["examples"]:
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            exec(compile(source, "<example>", "single"), examples)
+        result["outputs"].append(out.getvalue())
+except (ModuleNotFoundError, OSError):
+    # A missing module, file, permission or network: the environment, not the code
+    result["inconclusive"] = True
+    result["error"] = traceback.format_exc(limit=-3)
+except BaseException:
+    result["error"] = traceback.format_exc(limit=-3)
+sys.__stdout__.write("\n" + json.dumps(result) + "\n")
+'''
+
+
+class RunResult(NamedTuple):
+    status: str  # "passed", "failed", "timeout" or "unavailable"
+    error: Optional[str]
+    outputs: List[str]
+    stdout: str = ""
+
+    @property
+    def passed(self):
+        return self.status == "passed"
+
+
+def configure(enabled=True):
+    """Allow (or stop) running generated code, overriding SANDBOX_ENABLED."""
+    global SANDBOX_ENABLED
+    SANDBOX_ENABLED = enabled
+
+
+def run_code(
+    code: str,
+    examples: Sequence[str] = (),
+    timeout: float = None,
+    memory_mb: int = None,
+) -> RunResult:
+    """Execute `code` followed by the example statements in a sandboxed process.
+
+    The status is "unavailable" when the run says nothing about the code
+    itself: the sandbox is disabled or cannot start, or the code failed on a
+    missing module, file, permission or network connection (an OSError).
+    """
+    if not SANDBOX_ENABLED:
+        return RunResult("unavailable", "Running generated code is disabled (set SANDBOX_ENABLED=1).", [])
+    timeout = timeout or SANDBOX_TIMEOUT
+    memory_mb = memory_mb or SANDBOX_MEMORY_MB
+    job = json.dumps({
+        "code": code,
+        "examples": list(examples),
+        "cpu_seconds": int(timeout) + 1,
+        "memory_mb": memory_mb,
+    })
+    env = {"PATH": os.environ.get("PATH", ""), "OPENBLAS_NUM_THREADS": "1", "OMP_NUM_THREADS": "1", "MPLBACKEND": "Agg"}
+
+    with _slots, tempfile.TemporaryDirectory() as workdir:
+        try:
+            proc = subprocess.run(
+                [sys.executable, "-I", "-c", _HARNESS],
+                input=job, capture_output=True, text=True, timeout=timeout,
+                cwd=workdir, env=env,
+            )
+        except subprocess.TimeoutExpired:
+            return RunResult("timeout", f"Timed out after {timeout:g} seconds.", [])
+        except OSError as e:
+            return RunResult("unavailable", f"Could not start the sandbox: {e}", [])
+
+    lines = proc.stdout.rstrip().splitlines()
+    try:
+        result = json.loads(lines[-1])
+    except (IndexError, ValueError):
+        # Killed before reporting: CPU or memory limit, or os._exit() in the code
+        error = proc.stderr.strip()[-2000:] or f"Process exited with code {proc.returncode}."
+        return RunResult("failed", error, [])
+    if result["inconclusive"]:
+        return RunResult("unavailable", result["error"], result["outputs"], result["stdout"])
+    if result["error"]:
+        return RunResult("failed", result["error"], result["outputs"], result["stdout"])
+    return RunResult("passed", None, result["outputs"], result["stdout"])
+
+
+def run_many(jobs: Sequence[dict]) -> List[RunResult]:
+    """Run several run_code() jobs (dicts of its keyword arguments) in parallel."""
+    if not jobs:
+        return []
+    with ThreadPoolExecutor(max_workers=min(len(jobs), SANDBOX_WORKERS)) as executor:
+        return list(executor.map(lambda job: run_code(**job), jobs))
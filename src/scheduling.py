@@ -0,0 +1,149 @@
+"""Order questions so the most expensive ones start first.
+
+With a fixed number of workers, a run ends when its slowest worker does. In
+file order, a few slow planning or math questions near the end can keep one
+worker busy long after the others have finished. Starting the expensive
+questions first and filling in with cheap ones shortens the run.
+
+A question's cost is estimated from its domain and its length:
+`intercept + slope * characters`. Without timings, each domain's intercept
+is its usual number of LLM calls. Given the JSONL of an earlier `--trace`
+run on the same input file, the coefficients are fitted per domain to the
+seconds its questions took, and each traced question keeps the domain it
+was solved as. Domains missing from the trace keep their defaults, rescaled
+to seconds.
+
+Other questions are routed locally by route_domain(). Those it cannot place
+also pay for the LLM classifier, and are costed by the naive Bayes
+posterior when a router model is loaded, or else as COMMON_SENSE: the
+router has rules for every other domain, so that is what it usually misses.
+"""
+
+import json
+from collections import defaultdict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from src.domain_router import get_model, predict_proba, route_domain
+
+# Typical LLM calls per question; see the domain sections of the README
+DEFAULT_COSTS = {
+    "MATH": 9.0,
+    "PLANNING": 5.0,
+    "CODING": 4.0,
+    "FUTURE_PREDICTION": 4.0,
+    "COMMON_SENSE": 3.0,
+}
+# A question this many characters long counts double
+DEFAULT_LENGTH_SCALE = 4000.0
+# Questions the local router cannot place also pay for the LLM classifier
+ROUTING_COST = 1.0
+# Fewest timed questions of a domain needed to fit a length slope
+MIN_FIT_SAMPLES = 5
+
+
+class CostModel:
+    """Estimated cost per question: intercept + slope * length, per domain."""
+
+    def __init__(
+        self,
+        coefficients: Optional[Dict[str, Tuple[float, float]]] = None,
+        routing_cost: float = ROUTING_COST,
+        domains: Optional[Dict[int, str]] = None,
+    ):
+        if coefficients is None:
+            coefficients = {
+                domain: (cost, cost / DEFAULT_LENGTH_SCALE) for domain, cost in DEFAULT_COSTS.items()
+            }
+        self.coefficients = coefficients
+        self.routing_cost = routing_cost
+        # Domains of the questions in the trace, by question index
+        self.domains = domains or {}
+
+    def _cost(self, domain: str, question: str) -> float:
+        intercept, slope = self.coefficients.get(domain, self.coefficients["COMMON_SENSE"])
+        return intercept + slope * len(question)
+
+    def estimate(self, question: str, domain: Optional[str] = None) -> float:
+        if domain is not None:
+            return self._cost(domain, question)
+        domain = route_domain(question)
+        if domain is not None:
+            return self._cost(domain, question)
+        # Unrouted: the expected cost under the router model, plus the routing call
+        model = get_model()
+        if model is not None:
+            posterior = predict_proba(model, question)
+            cost = sum(p * self._cost(domain, question) for domain, p in posterior.items())
+        else:
+            cost = self._cost("COMMON_SENSE", question)
+        return cost + self.routing_cost
+
+    @classmethod
+    def from_trace(cls, path, questions: Sequence[Dict[str, str]]) -> "CostModel":
+        """Fit the model to the per-question solve times recorded in a trace file."""
+        times = question_times(path)
+        samples = defaultdict(list)
+        for (index, domain), seconds in times.items():
+            if 0 <= index < len(questions):
+                samples[domain].append((len(questions[index]["input"]), seconds))
+
+        learned = {domain: _fit(points) for domain, points in samples.items() if domain in DEFAULT_COSTS}
+        if not learned:
+            return cls()
+        domains = {
+            index: domain for index, domain in times if domain in DEFAULT_COSTS and 0 <= index < len(questions)
+        }
+
+        # Convert the defaults of untimed domains from calls to seconds
+        seconds = sum(seconds for domain in learned for _, seconds in samples[domain])
+        calls = sum(DEFAULT_COSTS[domain] * len(samples[domain]) for domain in learned)
+        seconds_per_call = seconds / calls
+        coefficients = {
+            domain: (cost * seconds_per_call, cost * seconds_per_call / DEFAULT_LENGTH_SCALE)
+            for domain, cost in DEFAULT_COSTS.items()
+        }
+        coefficients.update(learned)
+        return cls(coefficients, routing_cost=ROUTING_COST * seconds_per_call, domains=domains)
+
+
+def _fit(points: List[Tuple[int, float]]) -> Tuple[float, float]:
+    """Least-squares line through (length, seconds), with a non-negative slope."""
+    mean_x = sum(length for length, _ in points) / len(points)
+    mean_y = sum(seconds for _, seconds in points) / len(points)
+    variance = sum((x - mean_x) ** 2 for x, _ in points)
+    if len(points) < MIN_FIT_SAMPLES or variance == 0:
+        return mean_y, 0.0
+    slope = max(0.0, sum((x - mean_x) * (y - mean_y) for x, y in points) / variance)
+    return mean_y - slope * mean_x, slope
+
+
+def question_times(path) -> Dict[Tuple[int, str], float]:
+    """Seconds spent solving each question, keyed by (question index, domain).
+
+    Sequential runs record one `solve.<DOMAIN>` stage per question; pipeline
+    runs record `pipeline.<DOMAIN>.<stage>` stages, which are summed.
+    """
+    times = defaultdict(float)
+    with open(path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if record.get("type") != "stage" or record.get("question") is None:
+                continue
+            parts = (record.get("stage") or "").split(".")
+            if parts[0] == "solve" and len(parts) == 2:
+                domain = parts[1]
+            elif parts[0] == "pipeline" and len(parts) == 3:
+                domain = parts[1]
+            else:
+                continue
+            times[(record["question"], domain)] += record["wall_time"]
+    return dict(times)
+
+
+def longest_first(indices: Sequence[int], questions: Sequence[Dict[str, str]], model: CostModel) -> List[int]:
+    """The question indices sorted by decreasing estimated cost; ties keep file order."""
+    costs = {idx: model.estimate(questions[idx]["input"], model.domains.get(idx)) for idx in indices}
+    return sorted(indices, key=lambda idx: -costs[idx])
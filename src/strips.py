@@ -0,0 +1,336 @@
+"""STRIPS parsing and simulation for the normalized planning problems.
+
+`extract_and_normalize()` in planning.py asks the LLM for an
+ACTIONS / INITIAL STATE / GOAL description. parse_problem() reads that text
+into action schemas and ground facts, parse_plan() reads a plan in any of the
+usual LLM spellings (`feast b d`, `(feast b d)`, `Feast(b, d)`, numbered
+lists, ...), and simulate() applies the plan checking preconditions and
+add/delete effects. Both parsers return None when the text cannot be read
+reliably, so callers can fall back to the LLM.
+"""
+
+import re
+from typing import Collection, Dict, FrozenSet, List, NamedTuple, Optional, Tuple
+
+Atom = Tuple[str, Tuple[str, ...]]
+Step = Tuple[str, Tuple[str, ...]]
+
+# Words the LLM sprinkles into facts and plan steps that are never arguments
+FILLER_WORDS = {"object", "objects", "from", "to", "another", "other", "the", "is", "are", "on", "onto", "with", "and", "at", "in", "into", "of"}
+
+_SECTION_RE = re.compile(r"^[\s*#>_-]*(actions|initial\s+state|init|goals?)\b[\s*_]*(?::(.*)|$)", re.I)
+_HEADER_RE = re.compile(r"([A-Za-z][\w-]*)\s*\(([^()]*)\)\s*:")
+_FIELD_RE = re.compile(
+    r"\b(pre(?:conditions?)?|add(?:\s+effects?)?|del(?:ete)?(?:\s+effects?)?)\s*:", re.I
+)
+_NUMBERING_RE = re.compile(r"^\s*(?:[-*•]|\d+[.):]|step\s*\d+\s*[.:)]?)\s*", re.I)
+_PLAN_MARKER_RE = re.compile(r"^\W*(?:final\s+(?:validated\s+)?)?plan\W*:?\W*$|\bPLAN\s*:", re.I | re.M)
+_STEP_RE = re.compile(r"^\(?\s*([A-Za-z][\w-]*)\s*(?:\(([^()]*)\)|([\w\s,-]*?))\s*\)?\s*\.?$")
+# Argument prefixes the expected output drops ("object a" -> "a")
+ARG_PREFIXES = {"object", "crate", "truck", "block"}
+# Connectives allowed between step arguments ("feast b from d")
+_CONNECTIVES = {"from", "to", "on", "onto", "with", "at", "in", "into"}
+
+
+class Action(NamedTuple):
+    name: str
+    params: Tuple[str, ...]
+    pre: Tuple[Atom, ...]
+    neg_pre: Tuple[Atom, ...]
+    add: Tuple[Atom, ...]
+    delete: Tuple[Atom, ...]
+
+
+class Problem(NamedTuple):
+    actions: Dict[str, Action]
+    init: FrozenSet[Atom]
+    goal: Tuple[Atom, ...]
+    objects: Tuple[str, ...]
+
+
+class SimulationResult(NamedTuple):
+    valid: bool
+    failed_step: Optional[int]
+    reason: Optional[str]
+    missing: Tuple[Atom, ...]
+    unmet_goals: Tuple[Atom, ...]
+    state: FrozenSet[Atom]
+
+
+def format_atom(atom: Atom) -> str:
+    name, args = atom
+    return f"{name}({', '.join(args)})" if args else name
+
+
+def format_step(step: Step) -> str:
+    name, args = step
+    return " ".join((name,) + args)
+
+
+def _clean_name(token: str) -> str:
+    token = token.strip().strip("*`'\".").lower()
+    return token[1:] if token.startswith("?") else token
+
+
+def _split_atoms(text: str) -> List[str]:
+    # Split on commas, semicolons, "and" and conjunction signs outside parentheses
+    parts, depth, current = [], 0, []
+    for ch in re.sub(r"\s+(?:and|∧|&)\s+", ",", text):
+        if ch == "(":
+            depth += 1
+        elif ch == ")":
+            depth -= 1
+        if ch in ",;\n" and depth <= 0:
+            parts.append("".join(current))
+            current = []
+        else:
+            current.append(ch)
+    parts.append("".join(current))
+    return [p.strip() for p in parts if p.strip()]
+
+
+def _parse_atom(text: str, predicates=None, fillers=FILLER_WORDS) -> Optional[Tuple[bool, Atom]]:
+    """Parse one fact. Returns (negated, atom), or None for empty/placeholder text."""
+    text = text.strip().strip(".*`")
+    negated = False
+    match = re.match(r"^(?:not\s+|¬\s*|~\s*|!\s*)(.*)$", text, re.I)
+    if match:
+        negated, text = True, match.group(1)
+        if text.startswith("(") and text.endswith(")"):
+            text = text[1:-1]
+    if not text or text.lower() in {"none", "-", "nothing", "(none)", "{}", "[]"}:
+        return None
+
+    match = re.match(r"^([A-Za-z][\w-]*)\s*\((.*)\)$", text)
+    if match:
+        name = _clean_name(match.group(1))
+        args = tuple(_clean_name(a) for a in re.split(r"[,\s]+", match.group(2)) if a.strip())
+        return negated, (name, args)
+
+    tokens = [_clean_name(t) for t in re.split(r"[\s(),]+", text) if t.strip()]
+    tokens = [t for t in tokens if t]
+    # Natural word order such as "a craves d" or "crate0 is at depot2":
+    # put the known predicate first
+    if predicates:
+        for i, token in enumerate(tokens):
+            if token in predicates:
+                args = [t for t in tokens[:i] + tokens[i + 1:] if t not in fillers]
+                return negated, (token, tuple(args))
+    tokens = [t for t in tokens if t not in fillers]
+    if not tokens:
+        return None
+    return negated, (tokens[0], tuple(tokens[1:]))
+
+
+def _sections(text: str) -> Dict[str, str]:
+    sections: Dict[str, List[str]] = {}
+    current = None
+    for line in text.splitlines():
+        match = _SECTION_RE.match(line)
+        if match:
+            key = match.group(1).lower()
+            current = "actions" if key == "actions" else "goal" if key.startswith("goal") else "init"
+            sections.setdefault(current, [])
+            line = match.group(2) or ""
+        if current is not None and line.strip() and not line.strip().startswith("```"):
+            sections[current].append(line)
+    return {key: "\n".join(lines) for key, lines in sections.items()}
+
+
+def _parse_actions(text: str) -> Dict[str, Action]:
+    actions = {}
+    headers = list(_HEADER_RE.finditer(text))
+    for i, header in enumerate(headers):
+        name = _clean_name(header.group(1))
+        params = tuple(_clean_name(p) for p in re.split(r"[,\s]+", header.group(2)) if p.strip())
+        body = text[header.end(): headers[i + 1].start() if i + 1 < len(headers) else len(text)]
+
+        fields = {"pre": [], "add": [], "del": []}
+        matches = list(_FIELD_RE.finditer(body))
+        for j, field in enumerate(matches):
+            key = field.group(1).lower()[:3]
+            end = matches[j + 1].start() if j + 1 < len(matches) else len(body)
+            fields[key].extend(_split_atoms(body[field.end():end]))
+
+        pre, neg_pre, add, delete = [], [], [], []
+        for key, items in fields.items():
+            for item in items:
+                # Keep filler words here: "pain object" means the schema is prose
+                parsed = _parse_atom(item, fillers=())
+                if parsed is None:
+                    continue
+                negated, atom = parsed
+                if key == "pre":
+                    (neg_pre if negated else pre).append(atom)
+                elif key == "add":
+                    (delete if negated else add).append(atom)
+                else:
+                    delete.append(atom)
+        actions[name] = Action(name, params, tuple(pre), tuple(neg_pre), tuple(add), tuple(delete))
+    return actions
+
+
+def parse_problem(text: str) -> Optional[Problem]:
+    """Parse the normalized problem text, or return None if it does not look reliable."""
+    sections = _sections(text)
+    if not all(sections.get(key) for key in ("actions", "init", "goal")):
+        return None
+    actions = _parse_actions(sections["actions"])
+    if not actions:
+        return None
+
+    predicates = {atom[0] for a in actions.values() for atom in a.pre + a.neg_pre + a.add + a.delete}
+    init, goal = set(), []
+    for item in _split_atoms(sections["init"]):
+        parsed = _parse_atom(item, predicates)
+        if parsed is not None and not parsed[0]:
+            init.add(parsed[1])
+    for item in _split_atoms(sections["goal"]):
+        parsed = _parse_atom(item, predicates)
+        if parsed is not None and not parsed[0]:
+            goal.append(parsed[1])
+    if not goal:
+        return None
+
+    objects = sorted({arg for _, args in list(init) + goal for arg in args})
+
+    # Each predicate must be used with a single arity everywhere
+    arities = {}
+    schema_atoms = [atom for a in actions.values() for atom in a.pre + a.neg_pre + a.add + a.delete]
+    for name, args in schema_atoms + list(init) + goal:
+        if arities.setdefault(name, len(args)) != len(args):
+            return None
+
+    # Every schema must be expressed in terms of its parameters (or known
+    # objects); otherwise the LLM copied the prose and simulation is meaningless.
+    for action in actions.values():
+        atoms = action.pre + action.neg_pre + action.add + action.delete
+        if not action.add and not action.delete:
+            return None
+        for _, args in atoms:
+            if any(arg not in action.params and arg not in objects for arg in args):
+                return None
+        if action.params and not any(arg in action.params for _, args in atoms for arg in args):
+            return None
+
+    return Problem(actions, frozenset(init), tuple(goal), tuple(objects))
+
+
+def _last_plan_block(text: str) -> str:
+    # Only look at the last PLAN: block when the response has one
+    markers = list(_PLAN_MARKER_RE.finditer(text))
+    return text[markers[-1].end():] if markers else text
+
+
+def _known_action(name: str, actions: Collection[str]) -> bool:
+    # "pick-up" matches an action "PickUp(x)" or the words "pick" and "up"
+    parts = [part for part in re.split(r"[-_]", name) if part]
+    return re.sub(r"[-_]", "", name) in actions or all(part in actions for part in parts)
+
+
+def read_plan_steps(text: str, actions: Collection[str], max_args: int = 4) -> Optional[List[Step]]:
+    """Read plan steps without a parsed problem to check them against.
+
+    Stricter than parse_plan(): every non-empty line must look like an
+    action with a consistent arity whose name is one of `actions` (lowercase
+    names or words, without hyphens), otherwise None is returned.
+    """
+    steps, arities = [], {}
+    for line in _last_plan_block(text).splitlines():
+        line = line.strip().strip("`*").strip()
+        if not line or line.lower() in {"text", "lisp", "pddl", "plaintext"}:
+            continue
+        match = _STEP_RE.match(_NUMBERING_RE.sub("", line).strip())
+        if not match:
+            return None
+        tokens = [_clean_name(t) for t in re.split(r"[\s,]+", match.group(2) or match.group(3) or "") if t]
+        args = []
+        for i, token in enumerate(tokens):
+            if token in ARG_PREFIXES and i + 1 < len(tokens) and tokens[i + 1] not in ARG_PREFIXES:
+                continue
+            if token in _CONNECTIVES:
+                continue
+            # Articles and trailing type words ("the red block") mean prose
+            if token in FILLER_WORDS or token in ARG_PREFIXES:
+                return None
+            args.append(token)
+        name = match.group(1).lower()
+        if not _known_action(name, actions):
+            return None
+        if len(args) > max_args or arities.setdefault(name, len(args)) != len(args):
+            return None
+        steps.append((name, tuple(args)))
+    return steps or None
+
+
+def parse_plan(text: str, problem: Problem) -> Optional[List[Step]]:
+    """Read plan steps from LLM output. Returns None if no step could be read."""
+    text = _last_plan_block(text)
+
+    objects = set(problem.objects)
+    steps = []
+    for line in text.splitlines():
+        line = _NUMBERING_RE.sub("", line.strip().strip("`*")).strip()
+        match = re.match(r"^\(?\s*([A-Za-z][\w-]*)\b(.*)$", line)
+        if not match:
+            continue
+        name = match.group(1).lower()
+        action = problem.actions.get(name)
+        if action is None:
+            continue
+        tokens = [_clean_name(t) for t in re.split(r"[\s(),]+", match.group(2)) if t.strip()]
+        args = [t for t in tokens if t in objects]
+        if len(args) != len(action.params):
+            args = [t for t in tokens if t and t not in FILLER_WORDS]
+        if len(args) != len(action.params):
+            return None
+        steps.append((name, tuple(args)))
+    return steps or None
+
+
+def ground(atoms, binding) -> List[Atom]:
+    return [(name, tuple(binding.get(arg, arg) for arg in args)) for name, args in atoms]
+
+
+def simulate(problem: Problem, steps: List[Step]) -> SimulationResult:
+    """Apply the plan step by step and report the first failing step or unmet goals."""
+    state = set(problem.init)
+    for i, (name, args) in enumerate(steps):
+        action = problem.actions.get(name)
+        if action is None:
+            return SimulationResult(False, i, f"unknown action '{name}'", (), (), frozenset(state))
+        if len(args) != len(action.params):
+            return SimulationResult(
+                False, i, f"'{name}' takes {len(action.params)} arguments, got {len(args)}",
+                (), (), frozenset(state),
+            )
+        binding = dict(zip(action.params, args))
+        missing = [a for a in ground(action.pre, binding) if a not in state]
+        present = [a for a in ground(action.neg_pre, binding) if a in state]
+        if missing or present:
+            reason = "preconditions not satisfied"
+            if present:
+                reason = "negative preconditions violated by " + ", ".join(format_atom(a) for a in present)
+            return SimulationResult(False, i, reason, tuple(missing), (), frozenset(state))
+        state.difference_update(ground(action.delete, binding))
+        state.update(ground(action.add, binding))
+
+    unmet = tuple(g for g in problem.goal if g not in state)
+    return SimulationResult(not unmet, None, "goals not satisfied" if unmet else None, (), unmet, frozenset(state))
+
+
+def describe_failure(steps: List[Step], result: SimulationResult) -> str:
+    """Human-readable description of a failed simulation for the repair prompt."""
+    state = ", ".join(sorted(format_atom(a) for a in result.state))
+    if result.failed_step is not None:
+        step = format_step(steps[result.failed_step])
+        lines = [f"Step {result.failed_step + 1} `{step}` cannot be applied: {result.reason}."]
+        if result.missing:
+            lines.append("Missing preconditions: " + ", ".join(format_atom(a) for a in result.missing) + ".")
+        lines.append(f"State before step {result.failed_step + 1}: {state}")
+        return "\n".join(lines)
+    return (
+        "Every step can be applied, but these goals are not satisfied at the end: "
+        + ", ".join(format_atom(a) for a in result.unmet_goals)
+        + f".\nFinal state: {state}"
+    )
@@ -0,0 +1,220 @@
+import asyncio
+import json
+import unittest
+from unittest.mock import patch, MagicMock
+
+import httpx
+import requests
+
+from src import api
+
+
+def completion(content):
+    return {"choices": [{"message": {"content": content}}]}
+
+
+class TestPooledSession(unittest.TestCase):
+
+    def setUp(self):
+        api.configure_pool(max_connections=4)
+
+    def test_session_is_reused_across_calls(self):
+        response = MagicMock()
+        response.json.return_value = completion("hi")
+        with patch.object(api.get_session(), 'post', return_value=response) as mock_post:
+            self.assertEqual(api.call_llm("a"), "hi")
+            self.assertEqual(api.chat_llm([{"role": "user", "content": "b"}]), "hi")
+        self.assertEqual(mock_post.call_count, 2)
+        self.assertIs(api.get_session(), api.get_session())
+
+    def test_configure_pool_rebuilds_session(self):
+        session = api.get_session()
+        api.configure_pool(max_connections=8)
+        self.assertIsNot(api.get_session(), session)
+        self.assertEqual(api.MAX_CONNECTIONS, 8)
+
+
+class TestAsyncClient(unittest.TestCase):
+
+    def test_concurrent_acall_llm(self):
+        in_flight = 0
+        peak = 0
+
+        async def handler(request):
+            nonlocal in_flight, peak
+            in_flight += 1
+            peak = max(peak, in_flight)
+            await asyncio.sleep(0.01)
+            in_flight -= 1
+            body = json.loads(request.content)
+            return httpx.Response(200, json=completion(body["messages"][-1]["content"].upper()))
+
+        async def run():
+            client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+            with patch('src.api._get_async_client', return_value=client):
+                results = await asyncio.gather(
+                    api.acall_llm("one"),
+                    api.achat_llm([{"role": "user", "content": "two"}]),
+                    api.acall_llm("three"),
+                )
+            await client.aclose()
+            return results
+
+        self.assertEqual(asyncio.run(run()), ["ONE", "TWO", "THREE"])
+        self.assertEqual(peak, 3)
+
+    def test_missing_httpx_raises_import_error(self):
+        with patch('src.api.httpx', None), patch('src.api._ASYNC_RETRY_ERRORS', ()):
+            with self.assertRaises(ImportError):
+                asyncio.run(api.acall_llm("one"))
+
+    def test_async_client_is_shared_within_a_loop(self):
+        async def run():
+            first = api._get_async_client()
+            second = api._get_async_client()
+            await api.aclose()
+            return first, second
+
+        first, second = asyncio.run(run())
+        self.assertIs(first, second)
+
+class TestStreaming(unittest.TestCase):
+
+    def tearDown(self):
+        api._stream_usage_supported = True
+
+    def sse_response(self, deltas, usage=None):
+        response = MagicMock(status_code=200, ok=True, headers={"Content-Type": "text/event-stream"})
+        lines = [
+            "data: " + json.dumps({"choices": [{"delta": {"content": delta}}]}) for delta in deltas
+        ]
+        if usage is not None:
+            lines.append("data: " + json.dumps({"choices": [], "usage": usage}))
+        response.iter_lines.return_value = iter(lines + ["data: [DONE]"])
+        return response
+
+    def test_stop_when_closes_the_stream_after_the_answer_line(self):
+        response = self.sse_response(["Thinking", "...\nFINAL:", " 42", "\n", "Actually, more text", "\n"])
+        with patch.object(api.get_session(), 'post', return_value=response) as mock_post:
+            text = api.call_llm("q", stop_when=api.stop_at_line("FINAL:"))
+        self.assertEqual(text, "Thinking...\nFINAL: 42\n")
+        self.assertTrue(mock_post.call_args[1]["json"]["stream"])
+        response.close.assert_called()
+
+    @patch('src.tracing.record_llm_call')
+    def test_streamed_calls_record_usage(self, mock_record):
+        usage = {"prompt_tokens": 12, "completion_tokens": 3}
+        response = self.sse_response(["FINAL:", " 4", "\n"], usage=usage)
+        with patch.object(api.get_session(), 'post', return_value=response) as mock_post:
+            api.call_llm("q", stop_when=api.stop_at_line("DONE:"))
+        self.assertEqual(mock_post.call_args[1]["json"]["stream_options"], {"include_usage": True})
+        self.assertEqual(mock_record.call_args[1]["usage"], usage)
+
+        # Stopped before the usage chunk: the received deltas are counted
+        response = self.sse_response(["Thinking", "...\nFINAL:", " 42", "\n", "more"], usage=usage)
+        with patch.object(api.get_session(), 'post', return_value=response):
+            api.call_llm("x" * 40, system="s" * 40, stop_when=api.stop_at_line("FINAL:"))
+        recorded = mock_record.call_args[1]["usage"]
+        self.assertEqual((recorded["prompt_tokens"], recorded["completion_tokens"]), (20, 4))
+        self.assertTrue(recorded["estimated"])
+
+    def test_rejected_stream_options_are_dropped(self):
+        rejected = MagicMock(status_code=400, ok=False)
+        rejected.raise_for_status.side_effect = requests.HTTPError(response=rejected)
+
+        def post(url, json, **kwargs):
+            return rejected if "stream_options" in json else self.sse_response(["FINAL: 1\n"])
+
+        with patch.object(api.get_session(), 'post', side_effect=post) as mock_post:
+            self.assertEqual(api.call_llm("q", stop_when=api.stop_at_line("FINAL:")), "FINAL: 1\n")
+            self.assertEqual(mock_post.call_count, 2)
+            api.call_llm("q2", stop_when=api.stop_at_line("FINAL:"))
+            self.assertEqual(mock_post.call_count, 3)
+
+    def test_stream_llm_yields_deltas(self):
+        response = self.sse_response(["a", "b", "c"])
+        with patch.object(api.get_session(), 'post', return_value=response):
+            self.assertEqual(list(api.stream_llm("q")), ["a", "b", "c"])
+
+    def test_non_streaming_server_is_handled(self):
+        response = MagicMock(status_code=200, ok=True, headers={"Content-Type": "application/json"})
+        response.json.return_value = completion("FINAL: 7")
+        with patch.object(api.get_session(), 'post', return_value=response):
+            self.assertEqual(api.call_llm("q", stop_when=api.stop_at_line("FINAL:")), "FINAL: 7")
+
+    def test_stop_predicate_needs_a_complete_value_line(self):
+        stop = api.stop_at_line("INTERNAL_PREDICTION:")
+        self.assertFalse(stop("INTERNAL_PREDICTION:\n- A\n"))
+        self.assertFalse(stop("INTERNAL_PREDICTION: Ye"))
+        self.assertTrue(stop("INTERNAL_PREDICTION: Yes\n"))
+
+
+class TestSampling(unittest.TestCase):
+
+    def tearDown(self):
+        api._n_supported = True
+
+    def json_response(self, *contents):
+        response = MagicMock(status_code=200, ok=True, headers={"Content-Type": "application/json"})
+        response.json.return_value = {
+            "choices": [{"index": i, "message": {"content": c}} for i, c in enumerate(contents)]
+        }
+        return response
+
+    def test_samples_come_from_one_request(self):
+        response = self.json_response("a", "b", "c")
+        with patch.object(api.get_session(), 'post', return_value=response) as mock_post:
+            self.assertEqual(api.sample_llm("q", 3), ["a", "b", "c"])
+        self.assertEqual(mock_post.call_count, 1)
+        self.assertEqual(mock_post.call_args[1]["json"]["n"], 3)
+
+    def test_missing_choices_are_fanned_out(self):
+        # A server that ignores `n` returns a single choice; the rest are awaited together
+        sent = []
+
+        async def asend(payload, timeout=60, stats=None):
+            sent.append(payload)
+            return completion("x")
+
+        with patch.object(api.get_session(), 'post', return_value=self.json_response("x")) as mock_post, \
+                patch('src.api._asend', side_effect=asend):
+            self.assertEqual(api.sample_llm("q", 3), ["x", "x", "x"])
+        self.assertEqual(mock_post.call_count, 1)
+        self.assertEqual(len(sent), 2)
+        self.assertNotIn("n", sent[0])
+
+    def test_rejected_n_falls_back_to_separate_requests(self):
+        rejected = MagicMock(status_code=400, ok=False)
+        rejected.raise_for_status.side_effect = requests.HTTPError(response=rejected)
+
+        def post(url, json, **kwargs):
+            return rejected if "n" in json else self.json_response("y")
+
+        async def asend(payload, timeout=60, stats=None):
+            self.assertNotIn("n", payload)
+            return completion("y")
+
+        with patch.object(api.get_session(), 'post', side_effect=post) as mock_post, \
+                patch('src.api._asend', side_effect=asend) as mock_asend:
+            self.assertEqual(api.sample_llm("q", 2), ["y", "y"])
+            self.assertEqual((mock_post.call_count, mock_asend.call_count), (1, 2))
+            # The server is not asked for `n` again
+            api.sample_llm("q", 2)
+            self.assertEqual((mock_post.call_count, mock_asend.call_count), (1, 4))
+
+    def test_streamed_choices_stop_independently(self):
+        response = MagicMock(status_code=200, ok=True, headers={"Content-Type": "text/event-stream"})
+        chunks = [(0, "FINAL: 1\n"), (1, "FINAL:"), (0, "ignored"), (1, " 2\n"), (1, "ignored")]
+        response.iter_lines.return_value = iter(
+            ["data: " + json.dumps({"choices": [{"index": i, "delta": {"content": d}}]}) for i, d in chunks]
+            + ["data: [DONE]"]
+        )
+        with patch.object(api.get_session(), 'post', return_value=response) as mock_post:
+            samples = api.sample_llm("q", 2, stop_when=api.stop_at_line("FINAL:"))
+        self.assertEqual(samples, ["FINAL: 1\n", "FINAL: 2\n"])
+        self.assertEqual(mock_post.call_count, 1)
+        response.close.assert_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
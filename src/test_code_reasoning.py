@@ -0,0 +1,153 @@
+import unittest
+from unittest.mock import patch
+
+from src.code_reasoning import (
+    extract_examples, check_code, strip_preamble_locally, remove_preamble, solve_coding_problem,
+    select_candidate, _probes,
+)
+
+QUESTION = """Count the vowels in a string. >>> task_func("banana") 3
+You should write self-contained code starting with:
+```
+import re
+def task_func(text):
+```
+"""
+
+GOOD = "import re\ndef task_func(text):\n    return len(re.findall('[aeiou]', text))"
+WRONG = "import re\ndef task_func(text):\n    return len(text)"
+
+
+class TestCodeReasoning(unittest.TestCase):
+
+    def setUp(self):
+        patcher = patch('src.sandbox.SANDBOX_ENABLED', True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_extract_examples(self):
+        self.assertEqual(extract_examples(QUESTION), [('task_func("banana")', "3")])
+        docstring = "Example:\n>>> rows = task_func(2)\n>>> print(rows)\n[0, 1]\n\nNotes"
+        self.assertEqual(extract_examples(docstring), [("rows = task_func(2)", ""), ("print(rows)", "[0, 1]")])
+
+    def test_checks_signature_and_examples(self):
+        self.assertEqual(check_code(QUESTION, GOOD), ("passed", None))
+        status, report = check_code(QUESTION, GOOD.replace("(text)", "(s)"))
+        self.assertIn("must take the parameters (text)", report)
+        status, report = check_code(QUESTION, WRONG)
+        self.assertEqual(status, "failed")
+        self.assertIn("Expected:\n3", report)
+
+    def test_inconclusive_runs_are_not_failures(self):
+        with patch('src.sandbox.SANDBOX_ENABLED', False):
+            self.assertEqual(check_code(QUESTION, WRONG)[0], "unavailable")
+        reads_file = "import re\ndef task_func(text):\n    return len(open('vowels.txt').read())"
+        self.assertEqual(check_code(QUESTION, reads_file)[0], "unavailable")
+        # Docstring-style example whose expected output is an object repr
+        question = QUESTION.replace('>>> task_func("banana") 3', '>>> task_func("banana")\n<Counter object at 0x7f>\n')
+        self.assertEqual(check_code(question, GOOD)[0], "unavailable")
+
+    def test_strip_preamble_keeps_body_and_extra_imports(self):
+        code = (
+            "import re\nfrom collections import Counter\n\n"
+            "def task_func(text):\n    # vowels only\n    return Counter(re.findall('[aeiou]', text))\n\n"
+            "print(task_func('banana'))\n"
+        )
+        self.assertEqual(
+            strip_preamble_locally(QUESTION, code),
+            "    from collections import Counter\n    # vowels only\n    return Counter(re.findall('[aeiou]', text))",
+        )
+        self.assertIsNone(strip_preamble_locally(QUESTION, "Here is the code: " + GOOD))
+
+    def test_strip_preamble_leaves_future_imports_at_module_top(self):
+        code = "from __future__ import annotations\n" + GOOD
+        self.assertEqual(strip_preamble_locally(QUESTION, code), code)
+        question = QUESTION.replace("```\nimport re", "```\nfrom __future__ import annotations\nimport re")
+        self.assertEqual(
+            strip_preamble_locally(question, code), "    return len(re.findall('[aeiou]', text))"
+        )
+
+    def test_strip_preamble_keeps_strings_and_skips_starter_nodes(self):
+        question = QUESTION.replace("import re\n", "import re\nVOWELS = 'aeiou'\n")
+        code = (
+            '"""Count vowels.\n\nLine two.\n"""\nimport re\nVOWELS = \'aeiou\'\nHELP = """a\n  b"""\n\n'
+            "def task_func(text):\n    return len(re.findall(f'[{VOWELS}]', text))\n"
+        )
+        self.assertEqual(
+            strip_preamble_locally(question, code),
+            '    """Count vowels.\n\nLine two.\n"""\n    HELP = """a\n  b"""\n'
+            "    return len(re.findall(f'[{VOWELS}]', text))",
+        )
+        redefined = GOOD + "\n\ndef task_func(text):\n    return 0\n"
+        self.assertIsNone(strip_preamble_locally(QUESTION, redefined))
+
+    @patch('src.code_reasoning.call_llm')
+    def test_passing_draft_skips_the_critic(self, mock_call_llm):
+        mock_call_llm.side_effect = ["plan", GOOD]
+        self.assertEqual(solve_coding_problem(QUESTION), "    return len(re.findall('[aeiou]', text))")
+        self.assertEqual(mock_call_llm.call_count, 2)
+
+    @patch('src.code_reasoning.call_llm')
+    def test_failure_is_sent_to_the_critic(self, mock_call_llm):
+        mock_call_llm.side_effect = ["plan", WRONG, "FINAL CODE:\n" + GOOD]
+        self.assertEqual(solve_coding_problem(QUESTION), "    return len(re.findall('[aeiou]', text))")
+        critic_prompt = mock_call_llm.call_args_list[2][0][0]
+        self.assertIn("printed:\n6\nExpected:\n3", critic_prompt)
+
+    @patch('src.code_reasoning.call_llm')
+    def test_unparseable_code_falls_back_to_llm_formatter(self, mock_call_llm):
+        mock_call_llm.return_value = "```python\n    return 1\n```"
+        self.assertEqual(remove_preamble(QUESTION, "def task_func(text) return 1"), "return 1")
+        self.assertIn("code formatter", mock_call_llm.call_args[1]["system"])
+
+    def test_select_largest_agreeing_cluster(self):
+        results = [
+            ("a", "failed", "boom", None),
+            ("b", "passed", None, ("1\n",)),
+            ("c", "passed", None, ("2\n",)),
+            ("d", "passed", None, ("2\n",)),
+        ]
+        self.assertEqual(select_candidate(results), ("c", "passed", None))
+        self.assertEqual(select_candidate(results[:1]), ("a", "failed", "boom"))
+
+    def test_probes_come_from_examples_or_the_signature(self):
+        self.assertEqual(len(_probes("", [("n = task_func(2)", "")])), 1)
+        typed = "Starts with:\n```\nfrom typing import List\ndef task_func(items: List[int], sep=',', seed=None):\n```\n"
+        calls = [probe.splitlines()[1] for probe in _probes(typed, [])]
+        self.assertEqual(calls, [
+            "    print(repr(task_func(items=[], sep='')))",
+            "    print(repr(task_func(items=[3, 1, 2], sep='Hello World 42')))",
+        ])
+        # Nothing known about a required parameter, or only defaults: no probes
+        self.assertEqual(_probes(QUESTION, []), [])
+        self.assertEqual(_probes("Starts with:\n```\ndef task_func(path=None):\n```\n", []), [])
+
+    @patch('src.code_reasoning.acall_llm')
+    @patch('src.code_reasoning.call_llm')
+    def test_candidates_need_probes(self, mock_call_llm, mock_acall_llm):
+        mock_call_llm.side_effect = ["plan", GOOD]
+        self.assertEqual(solve_coding_problem(QUESTION, candidates=3), "    return len(re.findall('[aeiou]', text))")
+        mock_acall_llm.assert_not_called()
+
+    @patch('src.code_reasoning.acall_llm')
+    @patch('src.code_reasoning.call_llm')
+    def test_candidates_skip_the_critic_when_one_passes(self, mock_call_llm, mock_acall_llm):
+        question = QUESTION.replace('>>> task_func("banana") 3', '>>> n = task_func("banana")')
+        other = "import re\ndef task_func(text):\n    return sum(c in 'aeiou' for c in text)"
+        mock_call_llm.return_value = "plan"
+        candidates = iter([WRONG, GOOD, other])
+
+        async def acall_llm(prompt, **kwargs):
+            return next(candidates)
+
+        mock_acall_llm.side_effect = acall_llm
+        result = solve_coding_problem(question, candidates=3)
+        # GOOD and other agree (n == 3), WRONG does not; no critic call
+        self.assertIn(result, ["    return len(re.findall('[aeiou]', text))", "    return sum(c in 'aeiou' for c in text)"])
+        self.assertEqual(mock_call_llm.call_count, 1)
+        # The candidates are requested together, the first at low temperature
+        self.assertEqual([c[1]["temperature"] for c in mock_acall_llm.call_args_list], [0.2, 0.8, 0.8])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+import unittest
+from unittest.mock import patch
+
+from src.common_sense import extract_answer_locally, parse_options, solve_common_sense
+
+MC_QUESTION = "Which is a chemical change? A. ice melting B. wood burning C. salt dissolving D. water boiling"
+
+
+class TestCommonSense(unittest.TestCase):
+
+    def test_marker_and_trimming(self):
+        self.assertEqual(extract_answer_locally("REASONING:\n...\nFINAL ANSWER: Arthur's Magazine."), "Arthur's Magazine")
+        self.assertEqual(extract_answer_locally("**FINAL ANSWER:** **Delhi**"), "Delhi")
+        self.assertEqual(extract_answer_locally("FINAL ANSWER: The answer is U.S."), "U.S.")
+        self.assertEqual(extract_answer_locally("FINAL ANSWER:\n\\boxed{stay the same}"), "stay the same")
+
+    def test_escalates_without_marker_or_for_sentences(self):
+        self.assertIsNone(extract_answer_locally("The answer is Delhi."))
+        self.assertIsNone(extract_answer_locally(
+            "FINAL ANSWER: Based on the reasoning above, the magazine that was started first is Arthur's Magazine, in 1844."
+        ))
+
+    def test_multiple_choice(self):
+        self.assertEqual(parse_options("(A) red\n(B) blue\n(C) green"), {"A": "red", "B": "blue", "C": "green"})
+        self.assertEqual(parse_options("Who wrote A. Smith's biography?"), {})
+        for answer in ["B", "(B) wood burning.", "Option b", "wood burning"]:
+            self.assertEqual(extract_answer_locally(f"FINAL ANSWER: {answer}", MC_QUESTION), "B. wood burning")
+
+    @patch('src.common_sense.call_llm')
+    def test_solver_skips_llm_extraction(self, mock_call_llm):
+        mock_call_llm.side_effect = ["QUESTIONS: ...", "REASONING:\nIt began in 1844.\nFINAL ANSWER: Arthur's Magazine"]
+        self.assertEqual(solve_common_sense("Which magazine was started first?"), "Arthur's Magazine")
+        self.assertEqual(mock_call_llm.call_count, 2)
+
+    @patch('src.common_sense.call_llm')
+    def test_solver_falls_back_to_llm_extraction(self, mock_call_llm):
+        mock_call_llm.side_effect = ["QUESTIONS: ...", "I believe it is Arthur's Magazine.", "Arthur's Magazine"]
+        self.assertEqual(solve_common_sense("Which magazine was started first?"), "Arthur's Magazine")
+        self.assertEqual(mock_call_llm.call_count, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
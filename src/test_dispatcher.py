@@ -0,0 +1,164 @@
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import MagicMock, patch
+
+import requests
+
+from src import api
+from src.dispatcher import Dispatcher, batch_key, render_chat, split_batch_response
+
+
+CHATML = {"chat_template": r"<|im_start|>{role}\n{content}<|im_end|>\n", "generation_prompt": r"<|im_start|>assistant\n"}
+
+
+def chatml(messages):
+    return render_chat(messages, "<|im_start|>{role}\n{content}<|im_end|>\n", "<|im_start|>assistant\n")
+
+
+def payload(prompt, system="sys", temperature=0.0):
+    return {
+        "model": "m",
+        "messages": [{"role": "system", "content": system}, {"role": "user", "content": prompt}],
+        "temperature": temperature,
+        "max_tokens": 16,
+    }
+
+
+def completion(content):
+    return {"choices": [{"message": {"content": content}}]}
+
+
+def prompt_text(prompt):
+    # The user message of a rendered ChatML prompt
+    return prompt.split("<|im_start|>user\n")[1].split("<|im_end|>")[0]
+
+
+class FakeServer:
+    """Answers each prompt with itself and records what was sent where."""
+
+    def __init__(self, batch_status=200):
+        self.batch_status = batch_status
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def __call__(self, body, timeout=60, stats=None, url=None):
+        with self.lock:
+            self.calls.append((url, body))
+        if url is None:
+            return completion(body["messages"][-1]["content"])
+        if self.batch_status != 200:
+            response = MagicMock(status_code=self.batch_status)
+            raise requests.HTTPError(response=response)
+        if stats is not None:
+            stats["retries"] = 1
+        return {
+            "choices": [
+                {"index": i, "text": prompt_text(p), "finish_reason": "stop"} for i, p in enumerate(body["prompt"])
+            ],
+            "usage": {"prompt_tokens": 10 * len(body["prompt"]), "completion_tokens": len(body["prompt"])},
+        }
+
+
+class TestDispatcher(unittest.TestCase):
+
+    def test_batch_key_groups_by_stage_settings(self):
+        self.assertEqual(batch_key(payload("a")), batch_key(payload("b")))
+        self.assertNotEqual(batch_key(payload("a")), batch_key(payload("a", system="other")))
+        self.assertNotEqual(batch_key(payload("a")), batch_key(payload("a", temperature=0.7)))
+
+    def test_requests_in_a_window_share_a_batch(self):
+        server = FakeServer()
+        dispatcher = Dispatcher(server, window=0.05, batch_url="http://batch", **CHATML)
+        stats = [{"retries": 0} for _ in range(3)]
+        futures = [dispatcher.submit(payload(str(i)), stats=stats[i]) for i in range(3)]
+        futures.append(dispatcher.submit(payload("x", system="other")))
+        responses = [f.result(timeout=5) for f in futures]
+        dispatcher.close()
+        self.assertEqual([api._extract_content(r) for r in responses], ["0", "1", "2", "x"])
+        batches = [body for url, body in server.calls if url == "http://batch"]
+        self.assertEqual(len(batches), 1)
+        self.assertEqual(batches[0]["prompt"], [chatml(payload(str(i))["messages"]) for i in range(3)])
+        self.assertNotIn("messages", batches[0])
+        self.assertEqual(batches[0]["temperature"], 0.0)
+        # The batch's usage and retries reach every caller
+        self.assertEqual(sum(r["usage"]["prompt_tokens"] for r in responses[:3]), 30)
+        self.assertEqual(stats, [{"retries": 1}] * 3)
+        # A group of one is sent as a normal request
+        self.assertEqual(sum(url is None for url, _ in server.calls), 1)
+        self.assertEqual(dispatcher.stats()["batches"], 2)
+
+    def test_render_chat(self):
+        self.assertEqual(
+            chatml([{"role": "system", "content": "s"}, {"role": "user", "content": "u"}]),
+            "<|im_start|>system\ns<|im_end|>\n<|im_start|>user\nu<|im_end|>\n<|im_start|>assistant\n",
+        )
+
+    def test_batching_needs_an_explicit_chat_template(self):
+        with patch('src.dispatcher.CHAT_TEMPLATE', None), patch('src.dispatcher.GENERATION_PROMPT', None):
+            with self.assertRaises(ValueError):
+                Dispatcher(FakeServer(), window=0.05, batch_url="http://batch")
+            # Without a batch endpoint the template is not needed
+            Dispatcher(FakeServer(), window=0.05).close()
+
+    def test_split_batch_response_with_several_choices(self):
+        data = {"choices": [{"index": i, "text": t} for i, t in reversed(list(enumerate("abcd")))]}
+        responses = split_batch_response(data, ["p", "q"], n=2)
+        self.assertEqual(
+            [[c["message"]["content"] for c in r["choices"]] for r in responses], [["a", "b"], ["c", "d"]]
+        )
+        with self.assertRaises(ValueError):
+            split_batch_response(data, ["p", "q", "r"], n=2)
+
+    def test_full_batch_is_sent_before_the_window(self):
+        server = FakeServer()
+        dispatcher = Dispatcher(server, window=60, max_batch=2, batch_url="http://batch", **CHATML)
+        futures = [dispatcher.submit(payload(str(i))) for i in range(2)]
+        self.assertEqual(api._extract_content(futures[1].result(timeout=5)), "1")
+        dispatcher.close()
+
+    def test_without_batch_endpoint_requests_are_not_held_back(self):
+        server = FakeServer()
+        dispatcher = Dispatcher(server, window=60)
+        futures = [dispatcher.submit(payload(str(i))) for i in range(4)]
+        self.assertEqual([api._extract_content(f.result(timeout=5)) for f in futures], ["0", "1", "2", "3"])
+        dispatcher.close()
+        self.assertTrue(all(url is None for url, _ in server.calls))
+        self.assertEqual(dispatcher.stats(), {"batches": 4, "requests": 4, "mean_batch_size": 1.0})
+
+    def test_missing_batch_endpoint_falls_back(self):
+        server = FakeServer(batch_status=404)
+        dispatcher = Dispatcher(server, window=0.05, batch_url="http://batch", **CHATML)
+        futures = [dispatcher.submit(payload(str(i))) for i in range(2)]
+        self.assertEqual([api._extract_content(f.result(timeout=5)) for f in futures], ["0", "1"])
+        dispatcher.close()
+        self.assertIsNone(dispatcher.batch_url)
+
+    def test_batch_errors_reach_every_caller(self):
+        server = FakeServer(batch_status=500)
+        dispatcher = Dispatcher(server, window=0.05, batch_url="http://batch", **CHATML)
+        futures = [dispatcher.submit(payload(str(i))) for i in range(2)]
+        for future in futures:
+            with self.assertRaises(requests.HTTPError):
+                future.result(timeout=5)
+        dispatcher.close()
+
+    def test_call_llm_goes_through_the_dispatcher(self):
+        response = MagicMock()
+        response.json.return_value = {"choices": [{"index": 0, "text": "a"}, {"index": 1, "text": "a"}]}
+        api.configure_dispatcher(window=0.05, batch_url="http://batch", **CHATML)
+        try:
+            with patch.object(api.get_session(), 'post', return_value=response) as mock_post:
+                with ThreadPoolExecutor(max_workers=2) as executor:
+                    answers = list(executor.map(lambda i: api.call_llm(f"q{i}"), range(2)))
+        finally:
+            api.configure_dispatcher(None)
+        self.assertEqual(answers, ["a", "a"])
+        self.assertEqual(mock_post.call_count, 1)
+        self.assertEqual(mock_post.call_args[0][0], "http://batch")
+        self.assertEqual(len(mock_post.call_args[1]["json"]["prompt"]), 2)
+        self.assertIsNone(api.get_dispatcher())
+
+
+if __name__ == '__main__':
+    unittest.main()
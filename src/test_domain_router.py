@@ -0,0 +1,68 @@
+import unittest
+from unittest.mock import patch
+
+from src import domain_router
+from src.domain_router import route_by_rules, train_naive_bayes, route_by_model
+
+CODING_QUESTION = """Generate a random string of a given length.
+The function should output with:
+    str: The generated string.
+You should write self-contained code starting with:
+```
+import string
+import random
+def task_func(length, random_seed=None):
+```
+"""
+
+PLANNING_QUESTION = (
+    "I am playing with a set of objects. Here are the actions I can do Attack object Feast object "
+    "from another object. [STATEMENT] As initial conditions I have that, object b craves object d, "
+    "harmony. My goal is to have that object a craves object d. My plan is as follows:\n\n[PLAN]"
+)
+
+FUTURE_QUESTION = (
+    "You are an agent that can predict future events. The event to be predicted: \"Will it rain?\"\n"
+    " IMPORTANT: Your final answer MUST end with this exact format:\n \\boxed{Yes} or \\boxed{No}"
+)
+
+MATH_QUESTION = "Let $x$ satisfy $\\frac{x}{2} = 3$. Find the value of $x^2$."
+
+COMMON_SENSE_QUESTION = "Which magazine was started first Arthur's Magazine or First for Women?"
+
+
+class TestDomainRouter(unittest.TestCase):
+
+    def test_rules_route_obvious_questions(self):
+        self.assertEqual(route_by_rules(CODING_QUESTION), "CODING")
+        self.assertEqual(route_by_rules(PLANNING_QUESTION), "PLANNING")
+        self.assertEqual(route_by_rules(FUTURE_QUESTION), "FUTURE_PREDICTION")
+        self.assertEqual(route_by_rules(MATH_QUESTION), "MATH")
+
+    def test_rules_defer_ambiguous_questions(self):
+        self.assertIsNone(route_by_rules(COMMON_SENSE_QUESTION))
+        self.assertIsNone(route_by_rules("How many moons does Mars have?"))
+
+    def test_naive_bayes_model(self):
+        examples = [
+            ("Which river flows through Paris?", "COMMON_SENSE"),
+            ("Which magazine was founded first?", "COMMON_SENSE"),
+            ("Who directed the film Jaws?", "COMMON_SENSE"),
+            ("What is 12 plus 30 divided by 6?", "MATH"),
+            ("What is 7 times 8 minus 5?", "MATH"),
+        ]
+        model = train_naive_bayes(examples)
+        self.assertEqual(route_by_model(model, "Which magazine was founded first, Time or Life?"), "COMMON_SENSE")
+
+    @patch('generate_answer_template.call_llm')
+    def test_identify_domain_skips_llm_when_confident(self, mock_call_llm):
+        import generate_answer_template as gat
+        self.assertEqual(gat.identify_domain(CODING_QUESTION), "CODING")
+        mock_call_llm.assert_not_called()
+
+        mock_call_llm.return_value = "Reasoning: a fact.\nFINAL: COMMON_SENSE"
+        self.assertEqual(gat.identify_domain(COMMON_SENSE_QUESTION), "COMMON_SENSE")
+        self.assertEqual(mock_call_llm.call_count, 1)
+
+if __name__ == '__main__':
+    unittest.main()
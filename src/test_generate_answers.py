@@ -0,0 +1,157 @@
+import json
+import tempfile
+import time
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+import generate_answer_template as gat
+from src.scheduling import CostModel
+
+
+def fake_solve(question_data):
+    # Later questions finish first so completion order differs from input order
+    time.sleep(0.01 * (5 - int(question_data["input"])))
+    if question_data["input"] == "2":
+        raise RuntimeError("boom")
+    return f"answer {question_data['input']}"
+
+
+class TestBuildAnswers(unittest.TestCase):
+
+    @patch('generate_answer_template.solve_question', side_effect=fake_solve)
+    def test_concurrent_answers_keep_input_order(self, mock_solve):
+        questions = [{"input": str(i)} for i in range(5)]
+        with tempfile.TemporaryDirectory() as tmp:
+            output_file = Path(tmp) / "answers.json"
+            answers = gat.build_answers(questions, output_file, workers=4)
+            with output_file.open("r") as fp:
+                saved = json.load(fp)
+
+        expected = [
+            {"output": "answer 0"},
+            {"output": "answer 1"},
+            {"output": "Error"},
+            {"output": "answer 3"},
+            {"output": "answer 4"},
+        ]
+        self.assertEqual(answers, expected)
+        self.assertEqual(saved, expected)
+        gat.validate_results(questions, saved)
+
+    @patch('generate_answer_template.solve_question')
+    def test_resume_only_solves_unfinished_questions(self, mock_solve):
+        mock_solve.side_effect = lambda q: f"new {q['input']}"
+        questions = [{"input": str(i)} for i in range(4)]
+        with tempfile.TemporaryDirectory() as tmp:
+            output_file = Path(tmp) / "answers.json"
+            journal = gat.journal_path_for(output_file)
+            with journal.open("w") as f:
+                f.write(json.dumps({"index": 0, "output": "old 0", "error": False}) + "\n")
+                f.write(json.dumps({"index": 1, "output": "Error: timeout", "error": True}) + "\n")
+                f.write('{"index": 2, "outp')  # crashed mid-write
+
+            answers = gat.build_answers(questions, output_file, workers=2, resume=True)
+            records = gat.load_journal(journal)
+
+        self.assertEqual(
+            [a["output"] for a in answers], ["old 0", "new 1", "new 2", "new 3"]
+        )
+        self.assertEqual(mock_solve.call_count, 3)
+        self.assertEqual(records[1]["output"], "new 1")
+
+    def test_finalize_requires_every_answer(self):
+        questions = [{"input": "a"}, {"input": "b"}]
+        with tempfile.TemporaryDirectory() as tmp:
+            output_file = Path(tmp) / "answers.json"
+            with self.assertRaises(ValueError):
+                gat.finalize_answers(questions, {0: {"output": "x"}}, output_file)
+            self.assertFalse(output_file.exists())
+
+    def test_parse_shard(self):
+        self.assertEqual(gat.parse_shard("1/3", 10), range(0, 3))
+        self.assertEqual(gat.parse_shard("3/3", 10), range(6, 10))
+        self.assertEqual(gat.parse_shard("4:", 10), range(4, 10))
+        self.assertEqual(gat.parse_shard(":20", 10), range(0, 10))
+        with self.assertRaises(ValueError):
+            gat.parse_shard("0/3", 10)
+
+    @patch('generate_answer_template.solve_question')
+    def test_shards_merge_in_original_order(self, mock_solve):
+        mock_solve.side_effect = lambda q: f"answer {q['input']}"
+        questions = [{"input": str(i)} for i in range(7)]
+        with tempfile.TemporaryDirectory() as tmp:
+            output_file = Path(tmp) / "answers.json"
+            shard_files = []
+            for spec in ("2/2", "1/2"):
+                indices = gat.parse_shard(spec, len(questions))
+                shard_file = gat.shard_output_path(output_file, indices)
+                gat.build_answers(questions, shard_file, workers=2, indices=indices)
+                shard_files.append(shard_file)
+
+            answers = gat.merge_shards(questions, shard_files, output_file)
+            with output_file.open("r") as fp:
+                saved = json.load(fp)
+
+        expected = [{"output": f"answer {i}"} for i in range(7)]
+        self.assertEqual(answers, expected)
+        self.assertEqual(saved, expected)
+
+    def test_overlapping_json_shards_prefer_clean_answers(self):
+        questions = [{"input": str(i)} for i in range(2)]
+        with tempfile.TemporaryDirectory() as tmp:
+            output_file = Path(tmp) / "answers.json"
+            clean = {0: {"output": "answer 0"}, 1: {"output": "Error: timeout", "error": True}}
+            retried = {0: {"output": "Error: timeout", "error": True}, 1: {"output": "answer 1"}}
+            first = Path(tmp) / "first.json"
+            second = Path(tmp) / "second.json"
+            gat.write_shard(questions, clean, first, range(2))
+            gat.write_shard(questions, retried, second, range(2))
+            with first.open("r") as fp:
+                self.assertEqual(json.load(fp)[1], {"index": 1, "output": "Error: timeout", "error": True})
+
+            answers = gat.merge_shards(questions, [first, second], output_file)
+
+        self.assertEqual(answers, [{"output": "answer 0"}, {"output": "answer 1"}])
+
+    @patch('generate_answer_template.solve_math_v2', side_effect=lambda q, **kwargs: f"math {q}")
+    @patch('generate_answer_template.identify_domain', side_effect=lambda q: "BOGUS" if q == "1" else "MATH")
+    @patch('src.common_sense.generate_clarifying_questions', side_effect=RuntimeError("boom"))
+    def test_pipeline_answers_keep_input_order(self, mock_clarify, mock_route, mock_math):
+        questions = [{"input": str(i)} for i in range(3)]
+        with tempfile.TemporaryDirectory() as tmp:
+            output_file = Path(tmp) / "answers.json"
+            answers = gat.build_answers(questions, output_file, workers=2, pipeline=True)
+            records = gat.load_journal(gat.journal_path_for(output_file))
+
+        # Unknown domains fall back to the common sense stages, which fail here
+        self.assertEqual(answers, [{"output": "math 0"}, {"output": "Error: boom"}, {"output": "math 2"}])
+        self.assertTrue(records[1]["error"])
+        self.assertFalse(records[0]["error"])
+
+    @patch('generate_answer_template.solve_question')
+    def test_cost_model_orders_work_but_not_answers(self, mock_solve):
+        mock_solve.side_effect = lambda q: f"answer {q['input'][:4]}"
+        questions = [
+            {"input": "short"},
+            {"input": "$\\frac{1}{2}$ in \\boxed{}"},
+            {"input": "long" + " " * 8000},
+        ]
+        with tempfile.TemporaryDirectory() as tmp:
+            output_file = Path(tmp) / "answers.json"
+            answers = gat.build_answers(questions, output_file, workers=1, cost_model=CostModel())
+
+        solved = [call.args[0]["input"][:4] for call in mock_solve.call_args_list]
+        self.assertEqual(solved, ["long", "$\\fr", "shor"])
+        self.assertEqual([a["output"] for a in answers], ["answer shor", "answer $\\fr", "answer long"])
+
+    @patch('generate_answer_template.load_questions')
+    def test_conflicting_options_are_rejected(self, mock_load):
+        for argv in (["--cost_trace", "run.jsonl"], ["--shard", "1/2", "--merge", "a.json"]):
+            with patch('sys.argv', ["generate_answer_template.py", *argv]), patch('sys.stderr'):
+                with self.assertRaises(SystemExit):
+                    gat.main()
+        mock_load.assert_not_called()
+
+if __name__ == '__main__':
+    unittest.main()
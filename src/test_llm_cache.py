@@ -0,0 +1,104 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from src import api
+from src.llm_cache import ResponseCache
+
+
+def payload(prompt, temperature=0.0):
+    return {
+        "model": "m",
+        "messages": [{"role": "user", "content": prompt}],
+        "temperature": temperature,
+        "max_tokens": 10,
+    }
+
+
+class TestResponseCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "cache.sqlite")
+
+    def tearDown(self):
+        api.configure_cache(None)
+        self.tmp.cleanup()
+
+    def test_hit_and_miss_counters(self):
+        cache = ResponseCache(self.path)
+        key = cache.key_for(payload("q"))
+        self.assertIsNone(cache.get(key))
+        cache.put(key, "a")
+        self.assertEqual(cache.get(key), "a")
+        self.assertEqual(cache.stats()["hits"], 1)
+        self.assertEqual(cache.stats()["misses"], 1)
+        cache.close()
+
+    def test_entries_persist_across_instances(self):
+        cache = ResponseCache(self.path)
+        cache.put(cache.key_for(payload("q")), "a")
+        cache.close()
+        reopened = ResponseCache(self.path)
+        self.assertEqual(reopened.get(reopened.key_for(payload("q"))), "a")
+        reopened.close()
+
+    def test_stopped_streams_have_their_own_key(self):
+        cache = ResponseCache(self.path)
+        full = cache.key_for(payload("q"))
+        self.assertEqual(full, cache.key_for(payload("q")))
+        self.assertNotEqual(full, cache.key_for({**payload("q"), "stop_when": "stop_at_line('FINAL:')"}))
+        cache.close()
+
+    def test_lru_eviction(self):
+        cache = ResponseCache(self.path, max_entries=2)
+        keys = [cache.key_for(payload(p)) for p in ("a", "b", "c")]
+        cache.put(keys[0], "A")
+        cache.put(keys[1], "B")
+        cache.get(keys[0])  # "b" is now the least recently used
+        cache.put(keys[2], "C")
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.get(keys[0]), "A")
+        self.assertIsNone(cache.get(keys[1]))
+        self.assertEqual(cache.get(keys[2]), "C")
+        cache.close()
+
+    def test_row_count_is_tracked_without_scanning(self):
+        cache = ResponseCache(self.path, max_entries=3)
+        cache.put(cache.key_for(payload("a")), "A")
+        cache.put(cache.key_for(payload("a")), "A again")  # Replacing does not add a row
+        cache.close()
+        reopened = ResponseCache(self.path, max_entries=3)
+        self.assertEqual(reopened._count, 1)
+        statements = []
+        reopened._conn.set_trace_callback(statements.append)
+        reopened.put(reopened.key_for(payload("b")), "B")
+        self.assertFalse(any("COUNT" in statement for statement in statements))
+        self.assertEqual(reopened._count, 2)
+        reopened.close()
+
+    def test_sampled_calls_policy(self):
+        cache = ResponseCache(self.path)
+        self.assertIsNone(cache.key_for(payload("q", temperature=0.7)))
+        cache.close()
+
+        sampled = ResponseCache(self.path, cache_sampled=True)
+        first = sampled.key_for(payload("q", temperature=0.7))
+        second = sampled.key_for(payload("q", temperature=0.7))
+        self.assertNotEqual(first, second)
+        sampled.close()
+
+    def test_post_uses_cache(self):
+        api.configure_cache(self.path)
+        fresh = {"choices": [{"message": {"content": "fresh"}}]}
+        with patch('src.api._send', return_value=fresh) as mock_send:
+            self.assertEqual(api.call_llm("q"), "fresh")
+            self.assertEqual(api.call_llm("q"), "fresh")
+            api.call_llm("q", temperature=0.5)
+            api.call_llm("q", temperature=0.5)
+        self.assertEqual(mock_send.call_count, 3)
+        self.assertEqual(api.get_cache().stats()["hits"], 1)
+
+if __name__ == '__main__':
+    unittest.main()
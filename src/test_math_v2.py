@@ -1,8 +1,16 @@
 import unittest
 from unittest.mock import patch, MagicMock
-from src.math_reasoning_v2 import generate_plan, reason_and_solve, self_refine, solve_math_v2
+from src.math_reasoning_v2 import generate_plan, reason_and_solve, self_refine, solve_math_v2, normalize_answer, run_chain, majority_vote, answers_agree
+import re
+import threading
 import time
 
+
+def sample_via(mock_call_llm):
+    # sample_llm() stand-in that draws each sample through the mocked call_llm
+    return lambda prompt, n, **kwargs: [mock_call_llm(prompt, **kwargs) for _ in range(n)]
+
+
 class TestMathReasoningV2(unittest.TestCase):
 
     @patch('src.math_reasoning_v2.call_llm')
@@ -33,6 +41,122 @@ class TestMathReasoningV2(unittest.TestCase):
         self.assertEqual(answer, "43")
         self.assertEqual(calls, 1)
 
+    def test_normalize_answer(self):
+        self.assertEqual(normalize_answer("42.0"), "42")
+        self.assertEqual(normalize_answer("$1,250"), "1250")
+        self.assertEqual(normalize_answer("0.5"), "0.5")
+        self.assertEqual(normalize_answer(" x = y "), "x = y")
+        self.assertIsNone(normalize_answer("Error: No answer found"))
+
+    def test_answers_agree_on_huge_numbers(self):
+        self.assertTrue(answers_agree("1e400", "10" + "0" * 399))
+        self.assertFalse(answers_agree("1e400", "2e400"))
+        self.assertFalse(answers_agree("1e400", "5"))
+        self.assertTrue(answers_agree("0.75", "3/4"))
+        self.assertTrue(answers_agree("6", "6.0000000001"))
+
+    def test_majority_vote_breaks_ties_by_sample_index(self):
+        # Chain 2 finished first, but chain 0 is the earlier sample
+        self.assertEqual(majority_vote({2: "7", 0: "5"}), "5")
+        self.assertEqual(majority_vote({2: "7", 0: "5", 1: "7.0"}), "7")
+        self.assertEqual(majority_vote({3: "Error: x", 1: "Error: y"}), "Error: y")
+
+    @patch('src.math_reasoning_v2.sample_llm')
+    @patch('src.math_reasoning_v2.call_llm')
+    def test_solve_math_v2_runs_chains_concurrently(self, mock_call_llm, mock_sample_llm):
+        mock_sample_llm.side_effect = sample_via(mock_call_llm)
+        lock = threading.Lock()
+        state = {"in_flight": 0, "peak": 0, "critiques": 0}
+
+        def fake_call_llm(prompt, system, temperature, **kwargs):
+            with lock:
+                state["in_flight"] += 1
+                state["peak"] = max(state["peak"], state["in_flight"])
+            time.sleep(0.02)
+            with lock:
+                state["in_flight"] -= 1
+                if "critic" not in system:
+                    return "Thought: ... FINAL: 7"
+                state["critiques"] += 1
+                # One of the three chains disagrees
+                return "FINAL: 8" if state["critiques"] == 2 else "FINAL: 7.0"
+
+        mock_call_llm.side_effect = fake_call_llm
+        answer = solve_math_v2("Q", samples=3)
+        self.assertEqual(answer, "7")
+        self.assertEqual(mock_call_llm.call_count, 9)
+        self.assertEqual(state["peak"], 3)
+        # The three plans come from one sampling request
+        self.assertEqual(mock_sample_llm.call_count, 1)
+        self.assertEqual(mock_sample_llm.call_args[0][1], 3)
+
+    @patch('src.sandbox.SANDBOX_ENABLED', True)
+    @patch('src.math_reasoning_v2.call_llm')
+    def test_program_of_thought_replaces_critique(self, mock_call_llm):
+        mock_call_llm.side_effect = ["plan", "Thought: 3/4 of 8.\nFINAL: 6\n```python\nprint(8 * 3 / 4)\n```"]
+        self.assertEqual(run_chain("Q", program_of_thought=True), "6")
+        self.assertEqual(mock_call_llm.call_count, 2)
+        self.assertIn("```python", mock_call_llm.call_args_list[1][1]["system"])
+
+    @patch('src.sandbox.SANDBOX_ENABLED', True)
+    @patch('src.math_reasoning_v2.call_llm')
+    def test_program_disagreement_goes_to_critique(self, mock_call_llm):
+        mock_call_llm.side_effect = ["plan", "FINAL: 5\n```python\nprint(8 * 3 / 4)\n```", "FINAL: 6"]
+        self.assertEqual(run_chain("Q", program_of_thought=True), "6")
+        self.assertIn("printed: 6.0", mock_call_llm.call_args_list[2][0][0])
+
+    @patch('src.math_reasoning_v2.sample_llm')
+    @patch('src.math_reasoning_v2.call_llm')
+    def test_solve_math_v2_skips_failed_chains(self, mock_call_llm, mock_sample_llm):
+        mock_sample_llm.side_effect = sample_via(mock_call_llm)
+        mock_call_llm.side_effect = RuntimeError("server down")
+        self.assertEqual(solve_math_v2("Q", samples=2), "Error: No answers generated")
+
+    def _chain_answers(self, mock_call_llm, chain_answers):
+        # Each plan is tagged with its chain number so the critic can answer per chain
+        lock = threading.Lock()
+        plans = []
+
+        def fake_call_llm(prompt, system, temperature, **kwargs):
+            if "planner" in system:
+                with lock:
+                    plans.append(len(plans))
+                    return f"plan-{plans[-1]}"
+            chain = int(re.search(r"plan-(\d+)", prompt).group(1))
+            return f"FINAL: {chain_answers[chain]}"
+
+        mock_call_llm.side_effect = fake_call_llm
+        return plans
+
+    @patch('src.math_reasoning_v2.sample_llm')
+    @patch('src.math_reasoning_v2.call_llm')
+    def test_adaptive_stops_when_first_chains_agree(self, mock_call_llm, mock_sample_llm):
+        mock_sample_llm.side_effect = sample_via(mock_call_llm)
+        plans = self._chain_answers(mock_call_llm, ["12", "12.0", "13", "13", "13", "13"])
+        answer = solve_math_v2("Q", adaptive=True, agreement=2, max_samples=6)
+        self.assertEqual(answer, "12")
+        self.assertEqual(len(plans), 2)
+        self.assertEqual(mock_call_llm.call_count, 6)
+        self.assertEqual(mock_sample_llm.call_count, 1)
+
+    @patch('src.math_reasoning_v2.sample_llm')
+    @patch('src.math_reasoning_v2.call_llm')
+    def test_adaptive_samples_more_on_disagreement(self, mock_call_llm, mock_sample_llm):
+        mock_sample_llm.side_effect = sample_via(mock_call_llm)
+        plans = self._chain_answers(mock_call_llm, ["1", "2", "3", "2", "5", "6"])
+        answer = solve_math_v2("Q", adaptive=True, agreement=2, max_samples=6)
+        self.assertEqual(answer, "2")
+        self.assertEqual(len(plans), 4)
+
+    @patch('src.math_reasoning_v2.sample_llm')
+    @patch('src.math_reasoning_v2.call_llm')
+    def test_adaptive_respects_budget(self, mock_call_llm, mock_sample_llm):
+        mock_sample_llm.side_effect = sample_via(mock_call_llm)
+        plans = self._chain_answers(mock_call_llm, ["1", "2", "3", "4", "5", "6"])
+        answer = solve_math_v2("Q", adaptive=True, agreement=3, max_samples=4)
+        self.assertIn(answer, {"1", "2", "3", "4"})
+        self.assertEqual(len(plans), 4)
+
     def test_integration_problem_1(self):
         print("\n\n============================================================")
         print("Testing Math Problem 1 (V2)")
@@ -0,0 +1,137 @@
+import threading
+import time
+import unittest
+
+from src.pipeline import Pipeline, Stage
+
+
+def route(question):
+    return question.split(":")[0]
+
+
+class TestPipeline(unittest.TestCase):
+
+    def run_pipeline(self, graphs, questions, **kwargs):
+        pipeline = Pipeline(Stage("route", route), graphs, default="A", **kwargs)
+        finished = []
+        answers = pipeline.run(enumerate(questions), lambda key, answer: finished.append(key))
+        return answers, finished
+
+    def test_stages_pass_results_and_skip_on_condition(self):
+        graphs = {
+            "A": [
+                Stage("upper", str.upper),
+                Stage("local", lambda text: text if text.endswith("!") else None, ("upper",), pool="cpu"),
+                Stage(
+                    "fallback", lambda text, domain: f"{text} ({domain})", ("upper", "domain"),
+                    after=("local",), when=lambda r: r["local"] is None,
+                ),
+            ],
+        }
+        answers, finished = self.run_pipeline(graphs, ["A:hi!", "A:hi", "unknown:x"])
+        self.assertEqual(answers, {0: "A:HI!", 1: "A:HI (A)", 2: "UNKNOWN:X (A)"})
+        self.assertEqual(sorted(finished), [0, 1, 2])
+
+    def test_stages_of_different_questions_interleave(self):
+        lock = threading.Lock()
+        state = {"in_flight": 0, "peak": 0}
+
+        def slow(text):
+            with lock:
+                state["in_flight"] += 1
+                state["peak"] = max(state["peak"], state["in_flight"])
+            time.sleep(0.05)
+            with lock:
+                state["in_flight"] -= 1
+            return text
+
+        graphs = {"A": [Stage("first", slow), Stage("second", slow, ("first",))]}
+        start = time.monotonic()
+        answers, _ = self.run_pipeline(graphs, [f"A:{i}" for i in range(4)], llm_workers=4)
+        self.assertEqual(answers, {i: f"A:{i}" for i in range(4)})
+        self.assertEqual(state["peak"], 4)
+        self.assertLess(time.monotonic() - start, 0.5)
+
+    def test_independent_stages_run_in_parallel(self):
+        barrier = threading.Barrier(2, timeout=5)
+
+        def meet(text):
+            barrier.wait()
+            return text
+
+        graphs = {
+            "A": [
+                Stage("left", meet),
+                Stage("right", meet, pool="cpu"),
+                Stage("join", lambda a, b: a + b, ("left", "right"), pool="cpu"),
+            ],
+        }
+        answers, _ = self.run_pipeline(graphs, ["A:x"], llm_workers=1, cpu_workers=1)
+        self.assertEqual(answers, {0: "A:xA:x"})
+
+    def test_retries_then_error(self):
+        calls = {"flaky": 0, "broken": 0}
+
+        def flaky(text):
+            calls["flaky"] += 1
+            if calls["flaky"] == 1:
+                raise RuntimeError("server down")
+            return "recovered"
+
+        def broken(text):
+            calls["broken"] += 1
+            raise RuntimeError("still down")
+
+        graphs = {"A": [Stage("flaky", flaky, retries=1)], "B": [Stage("broken", broken, retries=2)]}
+        answers, _ = self.run_pipeline(graphs, ["A:1", "B:2"])
+        self.assertEqual(answers, {0: "recovered", 1: "Error: still down"})
+        self.assertEqual(calls, {"flaky": 2, "broken": 3})
+
+    def test_timeout_ends_the_question(self):
+        release = threading.Event()
+
+        def hang(text):
+            release.wait(5)
+            return "late"
+
+        graphs = {"A": [Stage("hang", hang, timeout=0.05)]}
+        try:
+            answers, _ = self.run_pipeline(graphs, ["A:1"])
+        finally:
+            release.set()
+        self.assertTrue(answers[0].startswith("Error: Stage hang timed out"))
+
+    def test_timed_out_optional_stage_falls_through_to_its_fallback(self):
+        release = threading.Event()
+        calls = {"hang": 0}
+
+        def hang(text):
+            calls["hang"] += 1
+            release.wait(5)
+            return "late"
+
+        graphs = {"A": [
+            Stage("hang", hang, timeout=0.05, retries=1, optional=True),
+            Stage("fallback", lambda text: "fallback", after=("hang",), when=lambda r: r["hang"] is None),
+        ]}
+        try:
+            answers, _ = self.run_pipeline(graphs, ["A:1"])
+        finally:
+            release.set()
+        self.assertEqual(answers, {0: "fallback"})
+        self.assertEqual(calls["hang"], 2)
+
+    def test_missing_input_is_an_error(self):
+        graphs = {"A": [Stage("orphan", str.upper, ("nowhere",))]}
+        answers, _ = self.run_pipeline(graphs, ["A:1"])
+        self.assertTrue(answers[0].startswith("Error:"))
+
+    def test_admits_questions_in_order(self):
+        started = []
+        graphs = {"A": [Stage("record", lambda text: started.append(text) or text)]}
+        self.run_pipeline(graphs, [f"A:{i}" for i in range(6)], llm_workers=1, max_active=2)
+        self.assertEqual(started, [f"A:{i}" for i in range(6)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,174 @@
+import unittest
+from unittest.mock import patch
+
+from src.planning import validate_and_repair, solve_planning_problem, format_plan_locally, known_actions, search_plan
+from src.strips import parse_problem, simulate, format_step
+from src.planner import find_plan, ground_actions
+from src.test_strips import FEAST_PROBLEM, FEAST_SOLUTION
+
+VALID_PLAN = "PLAN:\n" + "\n".join(" ".join((name,) + args) for name, args in FEAST_SOLUTION)
+
+
+class TestValidateAndRepair(unittest.TestCase):
+
+    @patch('src.planning.call_llm')
+    def test_valid_plan_needs_no_llm_call(self, mock_call_llm):
+        draft = "Let me think.\nPLAN:\n" + "\n".join(f"({name} {' '.join(args)})" for name, args in FEAST_SOLUTION)
+        self.assertEqual(validate_and_repair(FEAST_PROBLEM, draft), VALID_PLAN)
+        mock_call_llm.assert_not_called()
+
+    @patch('src.planning.call_llm')
+    def test_repair_gets_the_precise_failure(self, mock_call_llm):
+        mock_call_llm.return_value = VALID_PLAN
+        draft = "PLAN:\nfeast b d\nattack a\n"
+        self.assertEqual(validate_and_repair(FEAST_PROBLEM, draft), VALID_PLAN)
+        self.assertEqual(mock_call_llm.call_count, 1)
+        prompt = mock_call_llm.call_args[0][0]
+        self.assertIn("Step 2 `attack a` cannot be applied", prompt)
+        self.assertIn("province(a)", prompt)
+
+    @patch('src.planning.call_llm')
+    def test_repairs_are_bounded(self, mock_call_llm):
+        mock_call_llm.return_value = "PLAN:\nattack a\n"
+        result = validate_and_repair(FEAST_PROBLEM, "PLAN:\nattack a\n", max_repairs=2)
+        self.assertEqual(result, "PLAN:\nattack a")
+        self.assertEqual(mock_call_llm.call_count, 2)
+
+    @patch('src.planning.call_llm')
+    def test_unparseable_problem_falls_back_to_llm_simulation(self, mock_call_llm):
+        mock_call_llm.return_value = "FINAL VALIDATED PLAN: feast b d"
+        result = validate_and_repair("Some free-form description", "feast b d")
+        self.assertEqual(result, "FINAL VALIDATED PLAN: feast b d")
+        self.assertIn("Simulate the plan", mock_call_llm.call_args[1]["system"])
+
+
+DEPOT_PROBLEM = """ACTIONS:
+Drive(t, from, to): pre: truck(t), at(t, from)
+                    add: at(t, to)
+                    del: at(t, from)
+Lift(h, c, s, p): pre: at(h, p), available(h), at(c, p), on(c, s), clear(c)
+                  add: lifting(h, c), clear(s)
+                  del: at(c, p), clear(c), available(h), on(c, s)
+Drop(h, c, s, p): pre: at(h, p), at(s, p), clear(s), lifting(h, c)
+                  add: available(h), at(c, p), clear(c), on(c, s)
+                  del: lifting(h, c), clear(s)
+Load(h, c, t, p): pre: at(h, p), at(t, p), lifting(h, c)
+                  add: in(c, t), available(h)
+                  del: lifting(h, c)
+Unload(h, c, t, p): pre: at(h, p), at(t, p), available(h), in(c, t)
+                    add: lifting(h, c)
+                    del: in(c, t), available(h)
+
+INITIAL STATE:
+at(crate0, depot0), at(hoist0, depot0), at(hoist1, depot1), at(pallet0, depot0),
+at(pallet1, depot1), at(truck0, depot0), available(hoist0), available(hoist1),
+clear(crate0), clear(pallet1), on(crate0, pallet0), truck(truck0)
+
+GOAL:
+on(crate0, pallet1)
+"""
+
+DEPOT_QUESTION = (
+    "Here are the actions I can do: Drive a truck from one place to another place. "
+    "Lift a crate from a surface at a place with a hoist. Drop a crate onto a surface at a place with a hoist. "
+    "Load a crate into a truck at a place with a hoist. Unload a crate from a truck at a place with a hoist. "
+    "I have the following restrictions on my actions: A depot is a type of place. A pallet is a type of surface. "
+    "A crate is a type of surface. [STATEMENT] ..."
+)
+
+
+class TestPlanner(unittest.TestCase):
+
+    def test_finds_shortest_plan(self):
+        problem = parse_problem(FEAST_PROBLEM)
+        steps = find_plan(problem)
+        self.assertTrue(simulate(problem, steps).valid)
+        self.assertEqual(len(steps), len(FEAST_SOLUTION))
+
+    def test_logistics_plan(self):
+        problem = parse_problem(DEPOT_PROBLEM)
+        steps = find_plan(problem)
+        self.assertTrue(simulate(problem, steps).valid)
+        self.assertEqual(len(steps), 5)
+
+    def test_unsolvable_problem(self):
+        problem = parse_problem(FEAST_PROBLEM.replace("craves(a, d), craves(d, c)", "unknown(a)"))
+        self.assertIsNone(find_plan(problem))
+
+    def test_unconstrained_parameters_follow_predicate_usage(self):
+        # Drive's destination only appears in at(t, to), so it ranges over places
+        steps = [action.step for action in ground_actions(parse_problem(DEPOT_PROBLEM))]
+        destinations = {args[2] for name, args in steps if name == "drive"}
+        self.assertEqual(destinations, {"depot0", "depot1"})
+
+    def test_search_respects_question_types(self):
+        # Without truck(t) the shortest plan drives the crate or a pallet instead
+        untyped = DEPOT_PROBLEM.replace("pre: truck(t), at(t, from)", "pre: at(t, from)")
+        name, args = find_plan(parse_problem(untyped))[0]
+        self.assertEqual(name, "drive")
+        self.assertNotEqual(args[0], "truck0")
+        self.assertIsNone(search_plan(untyped, DEPOT_QUESTION))
+        self.assertIsNotNone(search_plan(untyped, "question"))
+        self.assertIsNotNone(search_plan(DEPOT_PROBLEM, DEPOT_QUESTION))
+
+    @patch('src.planning.call_llm')
+    def test_solver_skips_draft_when_search_succeeds(self, mock_call_llm):
+        mock_call_llm.side_effect = [FEAST_PROBLEM]
+        steps = find_plan(parse_problem(FEAST_PROBLEM))
+        expected = "\n".join(f"({format_step(step)})" for step in steps)
+        self.assertEqual(solve_planning_problem("question"), expected)
+        self.assertEqual(mock_call_llm.call_count, 1)
+
+
+FEAST_QUESTION = (
+    "I am playing with a set of objects. Here are the actions I can do Attack object Feast object from "
+    "another object Succumb object Overcome object from another object I have the following restrictions "
+    "on my actions: ... [STATEMENT] ... My goal is to have that object a craves object d."
+)
+FEAST_ACTIONS = {"attack", "feast", "succumb", "overcome"}
+
+
+class TestFormatPlan(unittest.TestCase):
+
+    def test_known_actions(self):
+        self.assertEqual(known_actions(FEAST_PROBLEM), FEAST_ACTIONS)
+        self.assertEqual(known_actions("not a symbolic problem", FEAST_QUESTION), FEAST_ACTIONS)
+        self.assertEqual(known_actions("not a symbolic problem", "question"), set())
+
+    def test_formats_common_spellings(self):
+        plan = "FINAL VALIDATED PLAN:\n```\n1. Feast object b from object d\n2. Succumb(b)\n3. (overcome b c)\n```"
+        self.assertEqual(format_plan_locally(plan, FEAST_ACTIONS), "(feast b d)\n(succumb b)\n(overcome b c)")
+        self.assertEqual(format_plan_locally("PLAN:\npick-up a\nstack a b", {"pick", "up", "stack"}), "(pick-up a)\n(stack a b)")
+
+    def test_prose_is_left_to_the_llm(self):
+        self.assertIsNone(format_plan_locally("PLAN:\nunstack the yellow block from on top of the red block", {"unstack"}))
+        self.assertIsNone(format_plan_locally("feast b d\nThis plan works because every precondition holds.", FEAST_ACTIONS))
+        self.assertIsNone(format_plan_locally("PLAN:\nfeast b d\nsuccumb b\nDone.", FEAST_ACTIONS))
+        self.assertIsNone(format_plan_locally("PLAN:\nfeast b d\nGoal achieved.", known_actions("", FEAST_QUESTION)))
+        self.assertIsNone(format_plan_locally("PLAN:\nfeast b d", set()))
+
+    @patch('src.planning.call_llm')
+    def test_llm_formatter_is_a_fallback(self, mock_call_llm):
+        mock_call_llm.side_effect = [
+            "not a symbolic problem",
+            "First feast the object b from the object d, then succumb b.",
+            "PLAN:\nFirst feast the object b from the object d, then succumb b.",
+            "Here is the plan:\n(feast b d)\n(succumb b)",
+        ]
+        self.assertEqual(solve_planning_problem(FEAST_QUESTION), "(feast b d)\n(succumb b)")
+        # extract, draft, LLM validation and LLM format; no final cleaning call
+        self.assertEqual(mock_call_llm.call_count, 4)
+
+    @patch('src.planning.call_llm')
+    def test_trailing_prose_goes_to_the_llm_formatter(self, mock_call_llm):
+        mock_call_llm.side_effect = [
+            "not a symbolic problem",
+            "feast b d",
+            "PLAN:\nfeast b d\nsuccumb b\nDone.",
+            "(feast b d)\n(succumb b)",
+        ]
+        self.assertEqual(solve_planning_problem(FEAST_QUESTION), "(feast b d)\n(succumb b)")
+        self.assertEqual(mock_call_llm.call_count, 4)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import time
+import unittest
+from unittest.mock import patch, MagicMock
+
+import requests
+
+from src import api
+from src.resilience import RetryPolicy, TokenBucket
+
+
+def response(status, content="ok", headers=None):
+    resp = MagicMock()
+    resp.status_code = status
+    resp.headers = headers or {}
+    resp.json.return_value = {"choices": [{"message": {"content": content}}]}
+    if status >= 400:
+        resp.raise_for_status.side_effect = requests.HTTPError(f"{status} error")
+    return resp
+
+
+class TestRetryPolicy(unittest.TestCase):
+
+    def test_backoff_is_jittered_and_capped(self):
+        policy = RetryPolicy(backoff_base=1.0, backoff_max=5.0)
+        for attempt in range(6):
+            delay = policy.delay(attempt)
+            self.assertGreaterEqual(delay, 0)
+            self.assertLessEqual(delay, min(5.0, 2 ** attempt))
+        self.assertEqual(policy.delay(0, retry_after="3"), 3.0)
+        self.assertEqual(policy.delay(0, retry_after="120"), 5.0)
+
+    def test_token_bucket(self):
+        bucket = TokenBucket(rate=10, burst=2)
+        self.assertEqual(bucket.reserve(), 0.0)
+        self.assertEqual(bucket.reserve(), 0.0)
+        self.assertAlmostEqual(bucket.reserve(), 0.1, places=2)
+        self.assertEqual(TokenBucket(rate=0).reserve(), 0.0)
+
+
+class TestTransportRetries(unittest.TestCase):
+
+    def setUp(self):
+        api.configure_transport(max_retries=3, backoff_base=0.0, rate_limit=0)
+
+    def tearDown(self):
+        api.configure_transport(max_retries=api.MAX_RETRIES, backoff_base=api.BACKOFF_BASE)
+
+    def test_retries_rate_limits_and_server_errors(self):
+        session = api.get_session()
+        replies = [response(429), requests.Timeout("slow"), response(503), response(200, "done")]
+        with patch.object(session, 'post', side_effect=replies) as mock_post, patch('src.api.time.sleep') as mock_sleep:
+            self.assertEqual(api.call_llm("q"), "done")
+        self.assertEqual(mock_post.call_count, 4)
+        self.assertEqual(mock_sleep.call_count, 3)
+
+    def test_gives_up_after_max_retries(self):
+        session = api.get_session()
+        with patch.object(session, 'post', return_value=response(500)) as mock_post, patch('src.api.time.sleep'):
+            with self.assertRaises(requests.HTTPError):
+                api.call_llm("q")
+        self.assertEqual(mock_post.call_count, 4)
+
+    def test_client_errors_are_not_retried(self):
+        session = api.get_session()
+        with patch.object(session, 'post', return_value=response(400)) as mock_post:
+            with self.assertRaises(requests.HTTPError):
+                api.call_llm("q")
+        self.assertEqual(mock_post.call_count, 1)
+
+if __name__ == '__main__':
+    unittest.main()
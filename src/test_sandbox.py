@@ -0,0 +1,55 @@
+import unittest
+from unittest.mock import patch
+
+from src.sandbox import run_code, run_many
+
+
+class TestSandbox(unittest.TestCase):
+
+    def setUp(self):
+        patcher = patch('src.sandbox.SANDBOX_ENABLED', True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_runs_examples_and_captures_output(self):
+        result = run_code("def f(x):\n    return x * 2\n", ["print(f(2))", "f(3)", "y = f(4)"])
+        self.assertTrue(result.passed)
+        self.assertEqual(result.outputs, ["4\n", "6\n", ""])
+        self.assertEqual(run_code("print(6 * 7)").stdout, "42\n")
+
+    def test_reports_traceback(self):
+        result = run_code("def f():\n    return 1 / 0\n", ["f()"])
+        self.assertEqual(result.status, "failed")
+        self.assertIn("ZeroDivisionError", result.error)
+
+    def test_timeout(self):
+        result = run_code("while True:\n    pass\n", timeout=1)
+        self.assertEqual(result.status, "timeout")
+
+    def test_memory_limit(self):
+        result = run_code("data = bytearray(512 * 1024 * 1024)\n", memory_mb=256)
+        self.assertEqual(result.status, "failed")
+        self.assertIn("MemoryError", result.error)
+
+    def test_missing_module_is_inconclusive(self):
+        self.assertEqual(run_code("import no_such_module_here\n").status, "unavailable")
+
+    def test_environment_errors_are_inconclusive(self):
+        self.assertEqual(run_code("open('/no/such/file')\n").status, "unavailable")
+        self.assertEqual(run_code("raise ConnectionRefusedError()\n").status, "unavailable")
+        with patch('src.sandbox.subprocess.run', side_effect=PermissionError("denied")):
+            self.assertEqual(run_code("print(1)").status, "unavailable")
+
+    def test_disabled_by_default(self):
+        with patch('src.sandbox.SANDBOX_ENABLED', False), patch('src.sandbox.subprocess.run') as mock_run:
+            self.assertEqual(run_code("print(1)").status, "unavailable")
+        mock_run.assert_not_called()
+
+    def test_run_many_keeps_order(self):
+        results = run_many([{"code": f"print({i})"} for i in range(4)])
+        self.assertTrue(all(r.passed for r in results))
+        self.assertEqual([r.outputs for r in results], [[]] * 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from src.scheduling import CostModel, longest_first, question_times
+
+PLANNING = "[STATEMENT]\nAs initial conditions I have that ... My plan is as follows:"
+CODING = "Count words.\nYou should write self-contained code starting with:\n```\ndef task_func(text):\n```"
+MATH = "Find $x$ if $\\frac{x}{2} = 3$. Put the answer in \\boxed{}."
+
+
+class TestScheduling(unittest.TestCase):
+
+    def write_trace(self, records):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        path = os.path.join(tmp.name, "trace.jsonl")
+        with open(path, "w") as f:
+            for record in records:
+                f.write(json.dumps(record) + "\n")
+            f.write('{"type": "sta')  # truncated by a crash
+        return path
+
+    def test_default_costs_follow_domain_and_length(self):
+        model = CostModel()
+        self.assertGreater(model.estimate(MATH), model.estimate(PLANNING))
+        self.assertGreater(model.estimate(PLANNING), model.estimate(CODING))
+        self.assertGreater(model.estimate(CODING + " " * 4000), model.estimate(CODING))
+        # Questions the router cannot place are costed as common sense, plus routing
+        self.assertLess(model.estimate("Why is the sky blue?"), model.estimate(CODING))
+        self.assertAlmostEqual(
+            model.estimate("Why is the sky blue?"), model.estimate("Why is the sky blue?", "COMMON_SENSE") + 1.0
+        )
+
+    def test_unrouted_questions_use_the_router_posterior(self):
+        model = CostModel()
+        posterior = {"MATH": 0.5, "PLANNING": 0.0, "CODING": 0.0, "FUTURE_PREDICTION": 0.0, "COMMON_SENSE": 0.5}
+        with patch('src.scheduling.get_model', return_value={}), \
+                patch('src.scheduling.predict_proba', return_value=posterior):
+            cost = model.estimate("Why is the sky blue?")
+        expected = (model.estimate("Why is the sky blue?", "MATH") + model.estimate("Why is the sky blue?", "COMMON_SENSE")) / 2
+        self.assertAlmostEqual(cost, expected + 1.0)
+
+    def test_longest_first_keeps_file_order_for_ties(self):
+        questions = [{"input": CODING}, {"input": MATH}, {"input": CODING}, {"input": PLANNING}]
+        self.assertEqual(longest_first(range(4), questions, CostModel()), [1, 3, 0, 2])
+
+    def test_question_times_from_sequential_and_pipeline_traces(self):
+        path = self.write_trace([
+            {"type": "stage", "stage": "solve.MATH", "wall_time": 30.0, "question": 0},
+            {"type": "stage", "stage": "math.generate_plan", "wall_time": 3.0, "question": 0},
+            {"type": "stage", "stage": "pipeline.CODING.plan", "wall_time": 2.0, "question": 1},
+            {"type": "stage", "stage": "pipeline.CODING.code", "wall_time": 5.0, "question": 1},
+            {"type": "stage", "stage": "pipeline.route", "wall_time": 1.0, "question": 1},
+            {"type": "llm_call", "stage": "solve.MATH", "wall_time": 9.0, "question": 0},
+        ])
+        self.assertEqual(question_times(path), {(0, "MATH"): 30.0, (1, "CODING"): 7.0})
+
+    def test_learned_timings_override_defaults(self):
+        # Coding turned out far slower than math on this server
+        path = self.write_trace([
+            {"type": "stage", "stage": "solve.CODING", "wall_time": 90.0, "question": 0},
+            {"type": "stage", "stage": "solve.MATH", "wall_time": 10.0, "question": 1},
+        ])
+        questions = [{"input": CODING}, {"input": MATH}, {"input": PLANNING}]
+        model = CostModel.from_trace(path, questions)
+        self.assertEqual(model.coefficients["CODING"], (90.0, 0.0))
+        self.assertEqual(longest_first(range(3), questions, model), [0, 2, 1])
+
+    def test_traced_domains_are_used_for_unrouted_questions(self):
+        # The router cannot place either question; the trace knows their domains
+        path = self.write_trace([
+            {"type": "stage", "stage": "solve.COMMON_SENSE", "wall_time": 2.0, "question": 0},
+            {"type": "stage", "stage": "solve.CODING", "wall_time": 20.0, "question": 1},
+            {"type": "stage", "stage": "solve.MATH", "wall_time": 40.0, "question": 2},
+        ])
+        questions = [{"input": "Why is the sky blue?"}, {"input": CODING}, {"input": "A train leaves at noon."}]
+        model = CostModel.from_trace(path, questions)
+        self.assertEqual(model.domains, {0: "COMMON_SENSE", 1: "CODING", 2: "MATH"})
+        self.assertEqual(longest_first(range(3), questions, model), [2, 1, 0])
+        self.assertAlmostEqual(model.estimate("Why is the sky blue?", model.domains[0]), 2.0)
+
+    def test_empty_trace_falls_back_to_defaults(self):
+        model = CostModel.from_trace(self.write_trace([]), [{"input": MATH}])
+        self.assertEqual(model.coefficients, CostModel().coefficients)
+
+
+if __name__ == '__main__':
+    unittest.main()
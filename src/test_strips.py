@@ -0,0 +1,125 @@
+import unittest
+
+from src.strips import parse_problem, parse_plan, read_plan_steps, simulate, describe_failure
+
+FEAST_PROBLEM = """ACTIONS:
+Attack(x): pre: province(x), planet(x), harmony
+           add: pain(x)
+           del: province(x), planet(x), harmony
+Succumb(x): pre: pain(x)
+            add: province(x), planet(x), harmony
+            del: pain(x)
+Overcome(x, y): pre: province(y), pain(x)
+                add: harmony, province(x), craves(x, y)
+                del: province(y), pain(x)
+Feast(x, y): pre: craves(x, y), province(x), harmony
+             add: pain(x), province(y)
+             del: craves(x, y), province(x), harmony
+
+INITIAL STATE:
+craves(b, d), craves(c, a), craves(d, c), harmony, planet(a), province(b)
+
+GOAL:
+craves(a, d), craves(d, c)
+"""
+
+FEAST_SOLUTION = [
+    ("feast", ("b", "d")),
+    ("succumb", ("b",)),
+    ("feast", ("d", "c")),
+    ("succumb", ("d",)),
+    ("feast", ("c", "a")),
+    ("succumb", ("c",)),
+    ("attack", ("d",)),
+    ("overcome", ("d", "c")),
+    ("attack", ("a",)),
+    ("overcome", ("a", "d")),
+]
+
+
+class TestParseProblem(unittest.TestCase):
+
+    def test_parse_symbolic_problem(self):
+        problem = parse_problem(FEAST_PROBLEM)
+        self.assertEqual(set(problem.actions), {"attack", "succumb", "overcome", "feast"})
+        self.assertEqual(problem.actions["feast"].params, ("x", "y"))
+        self.assertIn(("craves", ("b", "d")), problem.init)
+        self.assertIn(("harmony", ()), problem.init)
+        self.assertEqual(problem.goal, (("craves", ("a", "d")), ("craves", ("d", "c"))))
+        self.assertEqual(problem.objects, ("a", "b", "c", "d"))
+
+    def test_parse_markdown_and_natural_facts(self):
+        text = (
+            "**ACTIONS:**\n"
+            "- Drive(t, from, to): pre: at(t, from)\n"
+            "  add: at(t, to)\n"
+            "  del: at(t, from)\n\n"
+            "**INITIAL STATE:**\n"
+            "truck0 is at depot0\n\n"
+            "**GOAL:**\n"
+            "truck0 is at depot1\n"
+        )
+        problem = parse_problem(text)
+        self.assertEqual(problem.init, frozenset({("at", ("truck0", "depot0"))}))
+        self.assertEqual(problem.goal, (("at", ("truck0", "depot1")),))
+
+    def test_rejects_prose_schemas(self):
+        text = FEAST_PROBLEM.replace("pain(x)", "pain object")
+        self.assertIsNone(parse_problem(text))
+        self.assertIsNone(parse_problem("The plan is to feast b from d."))
+
+
+class TestSimulate(unittest.TestCase):
+
+    def setUp(self):
+        self.problem = parse_problem(FEAST_PROBLEM)
+
+    def test_parse_plan_spellings(self):
+        text = (
+            "Thinking about it...\n"
+            "PLAN:\n"
+            "1. Feast object b from object d\n"
+            "2. (succumb b)\n"
+            "3. feast(d, c)\n"
+            "- overcome d c\n"
+            "Attack a\n"
+        )
+        self.assertEqual(
+            parse_plan(text, self.problem),
+            [("feast", ("b", "d")), ("succumb", ("b",)), ("feast", ("d", "c")),
+             ("overcome", ("d", "c")), ("attack", ("a",))],
+        )
+        self.assertIsNone(parse_plan("PLAN:\nfeast b\n", self.problem))
+
+    def test_read_plan_steps_without_problem(self):
+        text = "PLAN:\n```\n1. Drive(truck truck0, depot0, depot1)\n- lift hoist0 crate0 pallet0 depot0\n```"
+        self.assertEqual(
+            read_plan_steps(text, {"drive", "lift"}),
+            [("drive", ("truck0", "depot0", "depot1")), ("lift", ("hoist0", "crate0", "pallet0", "depot0"))],
+        )
+        self.assertIsNone(read_plan_steps("feast b d\nfeast b", {"feast"}))
+        self.assertIsNone(read_plan_steps("feast b d\ndone", {"feast"}))
+
+    def test_valid_plan(self):
+        result = simulate(self.problem, FEAST_SOLUTION)
+        self.assertTrue(result.valid)
+        self.assertEqual(result.unmet_goals, ())
+
+    def test_reports_first_failing_step(self):
+        steps = [("feast", ("b", "d")), ("attack", ("a",))]
+        result = simulate(self.problem, steps)
+        self.assertFalse(result.valid)
+        self.assertEqual(result.failed_step, 1)
+        self.assertEqual(result.missing, (("province", ("a",)), ("harmony", ())))
+        self.assertIn("Step 2 `attack a`", describe_failure(steps, result))
+
+    def test_reports_unmet_goals(self):
+        steps = FEAST_SOLUTION[:4]
+        result = simulate(self.problem, steps)
+        self.assertFalse(result.valid)
+        self.assertIsNone(result.failed_step)
+        self.assertIn(("craves", ("a", "d")), result.unmet_goals)
+        self.assertIn("not satisfied at the end", describe_failure(steps, result))
+
+if __name__ == '__main__':
+    unittest.main()
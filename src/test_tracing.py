@@ -0,0 +1,70 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from src import api, tracing
+from src.math_reasoning_v2 import solve_math_v2
+
+
+def completion(content, prompt_tokens=10, completion_tokens=5):
+    return {
+        "choices": [{"message": {"content": content}}],
+        "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens},
+    }
+
+
+class TestTracing(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "trace.jsonl")
+        self.tracer = tracing.configure(self.path)
+
+    def tearDown(self):
+        tracing.disable()
+        self.tmp.cleanup()
+
+    @patch('src.api._stream')
+    @patch('src.api._send', side_effect=lambda payload, **kwargs: {
+        **completion("FINAL: 4"), "choices": completion("FINAL: 4")["choices"] * payload.get("n", 1),
+    })
+    def test_llm_calls_are_attributed_to_question_and_stage(self, mock_send, mock_stream):
+        # reason_and_solve and self_refine stream their completions
+        def stream(payload, timeout=60, stats=None):
+            stats["usage"] = completion("")["usage"]
+            yield "FINAL: 4\n"
+        mock_stream.side_effect = stream
+
+        with tracing.question(7):
+            solve_math_v2("2 + 2", samples=2)
+
+        summary = self.tracer.summary()
+        for name in ("math.reason_and_solve", "math.self_refine"):
+            self.assertEqual(summary[name]["runs"], 2)
+            self.assertEqual(summary[name]["llm_calls"], 2)
+            self.assertEqual(summary[name]["prompt_tokens"], 20)
+            self.assertEqual(summary[name]["completion_tokens"], 10)
+        # Both plans are sampled in one request
+        self.assertEqual(summary["math.generate_plan"]["runs"], 1)
+        self.assertEqual(summary["math.generate_plan"]["llm_calls"], 1)
+
+        with open(self.path) as f:
+            records = [json.loads(line) for line in f]
+        self.assertEqual(len(records), 10)
+        # The question index follows the sample chains into their worker threads
+        self.assertTrue(all(r["question"] == 7 for r in records))
+
+    @patch('src.api._send', side_effect=TimeoutError("slow server"))
+    def test_errors_are_recorded(self, mock_send):
+        with self.assertRaises(TimeoutError):
+            with tracing.stage("demo.stage"):
+                api.call_llm("hi")
+        summary = self.tracer.summary()["demo.stage"]
+        self.assertEqual(summary["errors"], 1)
+        self.assertEqual(summary["llm_calls"], 1)
+        self.assertIn("demo.stage", self.tracer.format_summary())
+
+if __name__ == '__main__':
+    unittest.main()
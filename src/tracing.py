@@ -0,0 +1,158 @@
+import contextvars
+import functools
+import json
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+# The question and solver stage the current code is running for. Context
+# variables follow the code into worker threads when submitted via submit().
+_current_question = contextvars.ContextVar("current_question", default=None)
+_current_stage = contextvars.ContextVar("current_stage", default=None)
+
+_tracer = None
+
+
+class Tracer:
+    """Collects per-stage and per-LLM-call timing records, optionally as JSONL."""
+
+    def __init__(self, path=None):
+        self.path = path
+        self.records = []
+        self._lock = threading.Lock()
+        self._file = open(path, "a") if path else None
+
+    def record(self, **fields):
+        fields["question"] = _current_question.get()
+        with self._lock:
+            self.records.append(fields)
+            if self._file is not None:
+                self._file.write(json.dumps(fields, ensure_ascii=False) + "\n")
+                self._file.flush()
+
+    def summary(self):
+        """Aggregate the records per stage."""
+        stages = defaultdict(lambda: {
+            "runs": 0, "wall_time": 0.0, "llm_calls": 0, "llm_time": 0.0,
+            "prompt_tokens": 0, "completion_tokens": 0, "cached": 0,
+            "retries": 0, "errors": 0,
+        })
+        with self._lock:
+            records = list(self.records)
+        for r in records:
+            s = stages[r["stage"] or "(none)"]
+            if r["type"] == "stage":
+                s["runs"] += 1
+                s["wall_time"] += r["wall_time"]
+                s["errors"] += r["error"] is not None
+            else:
+                s["llm_calls"] += 1
+                s["llm_time"] += r["wall_time"]
+                s["prompt_tokens"] += r["prompt_tokens"] or 0
+                s["completion_tokens"] += r["completion_tokens"] or 0
+                s["cached"] += r["cached"]
+                s["retries"] += r["retries"]
+        return dict(stages)
+
+    def format_summary(self):
+        rows = sorted(self.summary().items(), key=lambda item: -item[1]["llm_time"])
+        lines = [
+            f"{'stage':<40} {'runs':>6} {'calls':>6} {'cached':>6} {'llm s':>9} "
+            f"{'wall s':>9} {'prompt tok':>11} {'compl tok':>10} {'retries':>7} {'errors':>6}"
+        ]
+        for name, s in rows:
+            lines.append(
+                f"{name:<40} {s['runs']:>6} {s['llm_calls']:>6} {s['cached']:>6} {s['llm_time']:>9.1f} "
+                f"{s['wall_time']:>9.1f} {s['prompt_tokens']:>11} {s['completion_tokens']:>10} "
+                f"{s['retries']:>7} {s['errors']:>6}"
+            )
+        return "\n".join(lines)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def configure(path=None):
+    """Start collecting traces, written as JSONL to `path` if given."""
+    global _tracer
+    if _tracer is not None:
+        _tracer.close()
+    _tracer = Tracer(path)
+    return _tracer
+
+
+def disable():
+    global _tracer
+    if _tracer is not None:
+        _tracer.close()
+    _tracer = None
+
+
+def get_tracer():
+    return _tracer
+
+
+def current_stage():
+    return _current_stage.get()
+
+
+@contextmanager
+def question(index):
+    token = _current_question.set(index)
+    try:
+        yield
+    finally:
+        _current_question.reset(token)
+
+
+@contextmanager
+def stage(name):
+    token = _current_stage.set(name)
+    start = time.perf_counter()
+    error = None
+    try:
+        yield
+    except Exception as e:
+        error = repr(e)
+        raise
+    finally:
+        _current_stage.reset(token)
+        if _tracer is not None:
+            _tracer.record(
+                type="stage", stage=name, wall_time=time.perf_counter() - start, error=error
+            )
+
+
+def traced(name):
+    """Decorator that runs the function as the named stage."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record_llm_call(wall_time, usage=None, cached=False, retries=0, error=None):
+    if _tracer is None:
+        return
+    usage = usage or {}
+    _tracer.record(
+        type="llm_call",
+        stage=_current_stage.get(),
+        wall_time=wall_time,
+        prompt_tokens=usage.get("prompt_tokens"),
+        completion_tokens=usage.get("completion_tokens"),
+        cached=cached,
+        retries=retries,
+        error=error,
+    )
+
+
+def submit(executor, fn, *args, **kwargs):
+    """executor.submit() that carries the current question and stage into the worker thread."""
+    return executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)